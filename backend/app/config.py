@@ -2,7 +2,7 @@
 应用配置管理
 """
 
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pathlib import Path
 
@@ -53,6 +53,61 @@ class Settings(BaseSettings):
     allowed_extensions: str = "jpg,jpeg,png,bmp"
     max_files_per_batch: int = 50
 
+    # 批阅并发配置
+    task_workers: int = 2  # 同时执行的批阅任务（批次）数
+    embedded_worker: bool = True  # API 进程内执行批阅任务；单独运行 python -m app.worker 时设为 false
+    job_lease_seconds: int = 60  # 领取批阅任务的租约时长，执行进程停止续约超过该时间后任务被重新领取
+    job_heartbeat_seconds: int = 15  # 续约间隔
+    job_poll_seconds: float = 0.5  # 空闲时检查任务队列的间隔（只读查询，有可领取的任务时才领取）
+    job_max_attempts: int = 3  # 同一批次被领取超过该次数（执行进程反复崩溃）时标记为失败
+    task_retention_hours: int = 72  # 已结束任务的状态和结果保留时长，超过后删除
+    task_retention_max: int = 500  # 最多保留的已结束任务数，超出时先删除最早结束的
+    upload_session_hours: int = 24  # 上传后一直没有开始批阅的会话保留时长，超过后删除会话和上传的文件
+    task_result_cache_size: int = 20  # 内存中保留结果的已结束任务数（LRU），其余查询时从磁盘读取
+    priority_max_essays: int = 3  # 作文篇数不超过该值的批次（如单篇重批）优先执行，0 表示不区分
+    idle_user_batch_slots: int = 2  # 普通名额占满后，每个执行进程为没有批次在执行的老师额外保留的批次名额
+    fair_share_weights: Dict[str, float] = {}  # 老师用户名到调度权重的映射（JSON），未配置的老师权重为 1
+    grading_concurrency: int = 8  # 每个执行进程同时在流水线中的作文数量，由所有批次按提交老师公平分配
+    vision_concurrency: int = 4  # 图片识别阶段的并发数
+    text_concurrency: int = 4  # 姓名提取与批改阶段的并发数（每篇作文两次文本调用并发执行）
+    email_concurrency: int = 2  # 后台邮件投递的并发数
+    email_max_attempts: int = 5  # 超过后标记为发送失败，可手动重发
+    email_retry_base_seconds: int = 30  # 重试间隔按指数退避增长
+    email_retry_max_seconds: int = 1800
+    email_claim_timeout_seconds: int = 300  # 邮件被领取后超过该时间仍在发送中，视为投递进程已中断，可重新领取
+    smtp_max_per_minute: int = 20  # 每分钟最多发送的邮件数，按邮箱服务商限制设置，0 表示不限
+    smtp_idle_seconds: int = 30  # 复用的 SMTP 连接空闲超过该时间后先用 NOOP 检查
+    db_commit_batch_size: int = 16  # 批阅结果按组提交，每组最多条数，1 表示逐条提交
+    db_commit_interval_ms: int = 200  # 分组未满时最多等待的毫秒数
+    analysis_chunk_size: int = 20  # 总体分析时每组归纳的学生数，超过该人数时分组归纳后合并，0 表示不分组
+    local_name_extraction: bool = True  # 先用正则和学生名单在本地提取姓名，无法确定时再调用 LLM
+    roster_match_threshold: float = 0.85  # 姓名匹配置信度低于该值时交给老师确认
+    fused_recognition: bool = True  # 一次视觉调用同时识别作文全文和学生姓名
+
+    # 图片上传前预处理
+    image_preprocess_enabled: bool = True
+    image_max_long_edge: int = 2048  # 缩放后的最长边（像素）
+    image_jpeg_quality: int = 80
+    image_preprocess_workers: int = 2  # 预处理进程数，0 表示在线程池中处理
+    tiered_recognition: bool = True  # 先发送低分辨率图片识别，不可靠时再发送完整图片
+    image_preview_long_edge: int = 1024
+
+    # LLM 结果缓存（data/llm_cache.db）
+    llm_cache_enabled: bool = True
+    llm_cache_max_mb: int = 200  # 超出后按最近访问时间淘汰
+    grading_cache_ttl_hours: int = 72  # 批改结果缓存有效期
+
+    # LLM HTTP 连接池
+    llm_http2: bool = False  # HTTP/2 多路复用，依赖的 h2 随 httpx[http2] 一起安装
+    llm_http_max_connections: int = 20
+    llm_http_max_keepalive: int = 10
+    llm_http_keepalive_seconds: float = 60.0
+
+    # LLM 调用限流（按服务商配额设置）
+    llm_requests_per_minute: int = 300
+    llm_tokens_per_minute: int = 500000
+    llm_max_concurrency: int = 16  # 遇到 429 时自动减半，成功后逐步恢复
+
     # CORS配置
     cors_origins: str = '["*"]'
 
@@ -1,10 +1,13 @@
 """
 数据库连接和会话管理
 """
-from sqlalchemy import create_engine
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, Session
 from contextlib import contextmanager
-from typing import Generator
+from typing import Any, Callable, Generator, TypeVar
 
 from app.paths import DATABASE_PATH_STR
 from app.models.database import Base, User
@@ -24,16 +27,40 @@ engine = create_engine(
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 数据库专用线程池：异步代码中的同步数据库操作放到这里执行，避免 SQLite 提交阻塞事件循环
+_db_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="db")
+
+T = TypeVar("T")
+
 
 def init_db():
     """
     初始化数据库，创建所有表
     """
     Base.metadata.create_all(bind=engine)
+    ensure_added_columns()
     ensure_default_admin()
     print(f"[OK] 数据库初始化完成: {DATABASE_PATH_STR}")
 
 
+# 建表之后新增的列：create_all 不会修改已有的表，启动时补上
+ADDED_COLUMNS = {
+    "email_outbox": {"claimed_at": "DATETIME"},
+}
+
+
+def ensure_added_columns():
+    existing_tables = set(inspect(engine).get_table_names())
+    with engine.begin() as conn:
+        for table, columns in ADDED_COLUMNS.items():
+            if table not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspect(conn).get_columns(table)}
+            for column, definition in columns.items():
+                if column not in existing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+
 def ensure_default_admin():
     db = SessionLocal()
     try:
@@ -103,6 +130,17 @@ def get_db_session() -> Generator[Session, None, None]:
         db.close()
 
 
+async def run_in_db_thread(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    在数据库线程池中执行同步数据库操作并等待结果
+    
+    Usage:
+        records = await run_in_db_thread(grading_db_service.get_all_records, skip=0, limit=10)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, partial(func, *args, **kwargs))
+
+
 if __name__ == "__main__":
     # 测试数据库连接
     print("=" * 50)
@@ -69,4 +69,48 @@ class GradingRecord(Base):
     essay = relationship("Essay", back_populates="grading_record")
     
     def __repr__(self):
-        return f"<GradingRecord(id={self.id}, essay_id={self.essay_id}, score={self.score})>"
\ No newline at end of file
+        return f"<GradingRecord(id={self.id}, essay_id={self.essay_id}, score={self.score})>"
+
+
+class EmailOutbox(Base):
+    """邮件发件箱表 - 待发送的批阅报告邮件，由后台投递器发送"""
+    __tablename__ = "email_outbox"
+    
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    grading_record_id = Column(Integer, ForeignKey("grading_records.id", ondelete="CASCADE"), nullable=False, unique=True, index=True, comment="批阅记录ID（同一记录只发一封）")
+    student_name = Column(String(50), nullable=False, comment="学生姓名")
+    recipient = Column(String(100), nullable=False, comment="收件邮箱")
+    status = Column(String(20), nullable=False, default="pending", index=True, comment="状态：pending/sending/sent/failed")
+    attempts = Column(Integer, nullable=False, default=0, comment="已尝试次数")
+    next_attempt_at = Column(DateTime, server_default=func.now(), nullable=False, comment="下次尝试时间")
+    last_error = Column(Text, nullable=True, comment="最近一次失败原因")
+    claimed_at = Column(DateTime, nullable=True, comment="最近一次被投递器领取的时间")
+    created_at = Column(DateTime, server_default=func.now(), nullable=False, comment="入队时间")
+    sent_at = Column(DateTime, nullable=True, comment="发送成功时间")
+    
+    # 关系
+    grading_record = relationship("GradingRecord")
+    
+    def __repr__(self):
+        return f"<EmailOutbox(id={self.id}, grading_record_id={self.grading_record_id}, status='{self.status}')>"
+
+
+class PendingStudentMatch(Base):
+    """待确认的学生匹配 - 识别出的姓名无法可靠对应到学生时，暂存批阅结果等待老师确认"""
+    __tablename__ = "pending_student_matches"
+    
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    recognized_name = Column(String(100), nullable=True, comment="识别出的姓名")
+    class_name = Column(String(50), nullable=True, comment="识别出的班级")
+    candidates = Column(Text, nullable=True, comment="候选学生及置信度（JSON）")
+    essay_text = Column(Text, nullable=True, comment="OCR识别的作文全文")
+    requirements = Column(Text, nullable=True, comment="作文要求")
+    image_path = Column(String(255), nullable=True, comment="作文图片路径")
+    raw_result = Column(Text, nullable=True, comment="完整的JSON批阅结果")
+    status = Column(String(20), nullable=False, default="pending", index=True, comment="状态：pending/confirmed/dismissed")
+    grading_record_id = Column(Integer, ForeignKey("grading_records.id", ondelete="SET NULL"), nullable=True, comment="确认后生成的批阅记录ID")
+    created_at = Column(DateTime, server_default=func.now(), nullable=False, comment="创建时间")
+    resolved_at = Column(DateTime, nullable=True, comment="确认或忽略时间")
+    
+    def __repr__(self):
+        return f"<PendingStudentMatch(id={self.id}, recognized_name='{self.recognized_name}', status='{self.status}')>"
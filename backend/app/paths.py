@@ -21,6 +21,10 @@ DATA_DIR = PROJECT_ROOT / "data"
 STUDENTS_JSON = DATA_DIR / "students.json"
 DATABASE_PATH = DATA_DIR / "database.db"
 TEACHER_CONFIG_PATH = DATA_DIR / "teacher_config.json"
+LLM_CACHE_PATH = DATA_DIR / "llm_cache.db"
+CHECKPOINTS_DIR = DATA_DIR / "checkpoints"
+TASKS_DB_PATH = DATA_DIR / "tasks.db"
+TASK_RESULTS_DIR = DATA_DIR / "task_results"
 
 # 上传目录
 UPLOADS_DIR = DATA_DIR / "uploads"
@@ -30,6 +34,7 @@ ESSAYS_DIR = UPLOADS_DIR / "essays"
 # 日志目录
 LOGS_DIR = PROJECT_ROOT / "logs"
 APP_LOG = LOGS_DIR / "app.log"
+WORKER_LOG = LOGS_DIR / "worker.log"
 
 # 备份目录
 BACKUP_DIR = DATA_DIR / "backup"
@@ -53,6 +58,8 @@ def ensure_directories():
         ESSAYS_DIR,
         LOGS_DIR,
         BACKUP_DIR,
+        CHECKPOINTS_DIR,
+        TASK_RESULTS_DIR,
     ]
     
     for directory in directories:
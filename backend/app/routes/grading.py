@@ -1,15 +1,28 @@
 import logging
 import os
 import shutil
-from typing import List
+from typing import List, Optional
 from uuid import uuid4
 
-from fastapi import (APIRouter, File, HTTPException, UploadFile, BackgroundTasks)
+from fastapi import (APIRouter, Depends, File, HTTPException, Request, UploadFile, BackgroundTasks)
 from fastapi.responses import JSONResponse
-
-from app.services.workflow_engine import WorkflowEngine
+from pydantic import BaseModel, Field
+
+from app.config import settings
+from app.models.database import User
+from app.services.fair_scheduler import fair_scheduler
+from app.services.grading_pipeline import pipeline_metrics
+from app.services.llm_service import recognition_stats
+from app.services.name_extractor import name_extraction_stats
+from app.services.rate_limiter import llm_rate_limiter
+from app.services.result_cache import result_cache
+from app.services.task_store import task_store
+from app.tasks.grading_batch import submit_grading_batch_async
+from app.tasks.job_worker import job_worker
 from app.tasks.task_manager import task_manager
 from app.paths import UPLOADS_DIR
+from app.utils.dependencies import get_optional_user
+from app.utils.loop_monitor import loop_monitor
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -19,15 +32,14 @@ router = APIRouter(
     tags=["作文批阅"],
 )
 
-# 实例化工作流引擎
-workflow = WorkflowEngine()
-
 # 上传目录 - 使用统一路径管理
 UPLOAD_DIRECTORY = str(UPLOADS_DIR)
 
-# 用于存储每个会话上传的文件信息
-# 注意：这是一个简单的内存存储，在多进程或分布式环境中需要使用Redis等共享存储
-session_files = {}
+
+
+class PromptTextRequest(BaseModel):
+    """文字版作文要求"""
+    requirements: str = Field(..., min_length=1, description="作文题目和写作要求")
 
 
 @router.post("/upload-prompt", summary="上传作文要求图片")
@@ -50,7 +62,8 @@ async def upload_prompt(file: UploadFile = File(...)):
         logger.error(f"保存提示文件失败: {e}")
         raise HTTPException(status_code=500, detail="文件保存失败")
 
-    session_files[session_id] = {"prompt": file_path, "essays": []}
+    # 会话保存在任务存储中，多个 worker 进程都能读取
+    await task_store.create_session_async(session_id, {"prompt": file_path, "essays": []})
 
     return {
         "success": True,
@@ -60,12 +73,31 @@ async def upload_prompt(file: UploadFile = File(...)):
     }
 
 
+@router.post("/upload-prompt-text", summary="提交文字版作文要求")
+async def upload_prompt_text(request: PromptTextRequest):
+    """
+    直接提交文字版作文要求，批阅时跳过作文要求图片识别。
+    """
+    requirements = request.requirements.strip()
+    if not requirements:
+        raise HTTPException(status_code=400, detail="作文要求不能为空")
+
+    session_id = str(uuid4())
+    await task_store.create_session_async(session_id, {"prompt": None, "requirements_text": requirements, "essays": []})
+
+    return {
+        "success": True,
+        "message": "作文要求提交成功",
+        "session_id": session_id,
+    }
+
+
 @router.post("/upload-essays/{session_id}", summary="批量上传学生作文图片")
 async def upload_essays(session_id: str, files: List[UploadFile] = File(...)):
     """
     为一个会话批量上传多张学生作文图片。
     """
-    if session_id not in session_files:
+    if await task_store.get_session_async(session_id) is None:
         raise HTTPException(status_code=404, detail="会话ID无效或已过期")
 
     if len(files) > 50: # 限制一次上传数量
@@ -87,78 +119,69 @@ async def upload_essays(session_id: str, files: List[UploadFile] = File(...)):
             logger.error(f"保存作文文件失败: {e}")
             raise HTTPException(status_code=500, detail=f"保存文件 '{file.filename}' 失败")
 
-    session_files[session_id]["essays"].extend(essay_paths)
+    uploaded_count = await task_store.add_session_essays_async(session_id, essay_paths)
+    if uploaded_count is None:
+        # 会话在上传期间过期或已开始批阅，刚保存的文件不会再被使用
+        for path in essay_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        raise HTTPException(status_code=404, detail="会话ID无效或已过期")
 
     return {
         "success": True,
         "message": f"成功上传 {len(files)} 份作文",
         "session_id": session_id,
-        "uploaded_count": len(session_files[session_id]["essays"])
+        "uploaded_count": uploaded_count
     }
 
 
 @router.post("/process-batch/{session_id}", summary="开始批量处理任务")
-async def process_batch(session_id: str, background_tasks: BackgroundTasks):
+async def process_batch(
+    session_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    force_regrade: bool = False,
+    current_user: Optional[User] = Depends(get_optional_user),
+):
     """
     启动一个后台任务来处理指定会话中的所有作文。
+
+    批次按提交老师公平排队；未登录时按客户端地址区分提交者。
+
+    - **force_regrade**: 忽略已缓存的批改结果，全部重新批改
     """
-    if session_id not in session_files:
+    session_data = await task_store.get_session_async(session_id)
+    if session_data is None:
         raise HTTPException(status_code=404, detail="会话ID无效或已过期")
+    if not (session_data.get("prompt") or session_data.get("requirements_text")) or not session_data.get("essays"):
+        raise HTTPException(status_code=400, detail="作文要求或学生作文文件缺失")
 
-    session_data = session_files[session_id]
+    # 取出会话，同一会话在多个进程中也只会开始一次；使用取出时的数据，包含检查之后上传的作文
+    session_data = await task_store.take_session_async(session_id)
+    if session_data is None:
+        raise HTTPException(status_code=404, detail="会话ID无效或已过期")
     prompt_path = session_data.get("prompt")
+    requirements_text = session_data.get("requirements_text")
     essay_paths = session_data.get("essays")
 
-    if not prompt_path or not essay_paths:
-        raise HTTPException(status_code=400, detail="作文要求或学生作文文件缺失")
-
-    # 创建一个可以访问task_id的协程工厂函数
-    def create_batch_processing_task(task_id_ref):
-        async def batch_processing_task():
-            """
-            实际执行批处理的协程任务。
-            """
-            try:
-                with open(prompt_path, "rb") as f:
-                    prompt_bytes = f.read()
-
-                essay_bytes_list = []
-                for path in essay_paths:
-                    with open(path, "rb") as f:
-                        essay_bytes_list.append(f.read())
-                
-                # 定义进度回调函数
-                def progress_callback(completed_count, current_step):
-                    # 更新任务管理器中的进度信息
-                    task = task_manager.active_tasks.get(task_id_ref[0])
-                    if task:
-                        task.completed_count = completed_count
-                        task.current_step = current_step
-                        task.progress = int((completed_count / len(essay_paths)) * 100)
-                        logger.info(f"任务 {task_id_ref[0]} 进度更新: {completed_count}/{len(essay_paths)} - {current_step}")
-                
-                # 调用工作流引擎并返回结果
-                result = await workflow.process_batch(prompt_bytes, essay_bytes_list, progress_callback)
-                return result
-
-            finally:
-                # 清理临时文件
-                try:
-                    os.remove(prompt_path)
-                    for path in essay_paths:
-                        os.remove(path)
-                    del session_files[session_id]
-                    logger.info(f"会话 {session_id} 的临时文件已清理。")
-                except Exception as e:
-                    logger.error(f"清理会话 {session_id} 的临时文件失败: {e}")
-        
-        return batch_processing_task
-
-    # 使用引用传递task_id
-    task_id_ref = [None]
-    task_coro = create_batch_processing_task(task_id_ref)()
-    task_id = task_manager.submit_task(task_coro, total_count=len(essay_paths))
-    task_id_ref[0] = task_id  # 设置task_id供回调函数使用
+    if current_user is not None:
+        user_key = f"user:{current_user.id}"
+        weight = settings.fair_share_weights.get(current_user.username, 1.0)
+    else:
+        user_key = f"ip:{request.client.host if request.client else 'unknown'}"
+        weight = 1.0
+
+    # 上传的文件保留到批次完成，进程重启后可以从检查点继续
+    task_id = await submit_grading_batch_async(
+        prompt_path,
+        essay_paths,
+        requirements_text=requirements_text,
+        force_regrade=force_regrade,
+        user_key=user_key,
+        weight=weight,
+    )
+    # 本进程内嵌执行器时立即领取，否则由执行进程轮询队列
+    job_worker.wake()
 
     return JSONResponse(
         status_code=202,
@@ -176,8 +199,29 @@ async def get_task_status(task_id: str):
     """
     根据任务ID查询后台任务的处理状态和结果。
     """
-    status = task_manager.get_task_status(task_id)
+    status = await task_manager.get_task_status_async(task_id)
     if status is None:
         raise HTTPException(status_code=404, detail="任务ID不存在")
     
     return status
+
+
+@router.get("/metrics", summary="查询批阅流水线运行指标")
+async def get_grading_metrics():
+    """
+    返回各批阅阶段的队列深度、并发和吞吐量，分级识别的统计，姓名由哪种方式确定的次数，
+    LLM 结果缓存的命中情况，LLM 限流器当前的速率和并发上限，事件循环阻塞情况，
+    后台任务工作协程的利用率，作文名额的公平分配情况，
+    以及任务队列的积压情况（多进程部署时为所有进程共享的队列）。
+    """
+    return {
+        "pipeline": pipeline_metrics.snapshot(),
+        "recognition": recognition_stats,
+        "name_extraction": name_extraction_stats,
+        "cache": await result_cache.stats_async(),
+        "rate_limiter": llm_rate_limiter.stats(),
+        "event_loop": loop_monitor.stats(),
+        "task_manager": task_manager.stats(),
+        "scheduler": fair_scheduler.stats(),
+        "job_queue": {**await task_store.job_stats_async(), "worker": job_worker.stats()},
+    }
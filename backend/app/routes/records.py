@@ -6,10 +6,10 @@ import logging
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
 
-from app.database import get_db
 from app.models.database import User
+from app.services.email_outbox import email_outbox_service
+from app.services.email_service import EmailService
 from app.services.grading_db import grading_db_service
 from app.utils.dependencies import get_current_user, require_admin, require_student
 
@@ -34,13 +34,17 @@ class RecordDetailResponse(BaseModel):
     record: dict
 
 
+class ConfirmMatchRequest(BaseModel):
+    """确认学生匹配请求"""
+    student_id: int
+
+
 # ===== API端点 =====
 
 @router.get("/my", response_model=RecordListResponse, summary="查看我的批阅记录")
 async def get_my_records(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
     current_user: User = Depends(require_student)
 ):
     """
@@ -52,11 +56,10 @@ async def get_my_records(
     返回该学生的所有批阅记录，按时间倒序排列
     """
     try:
-        records = grading_db_service.get_student_records(
+        records = await grading_db_service.get_student_records_async(
             student_id=current_user.id,
             skip=skip,
-            limit=limit,
-            db=db
+            limit=limit
         )
         
         logger.info(f"学生 {current_user.username} 查询了自己的批阅记录，共 {len(records)} 条")
@@ -78,7 +81,6 @@ async def get_my_records(
 async def get_all_records(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
     current_user: User = Depends(require_admin)
 ):
     """
@@ -90,10 +92,9 @@ async def get_all_records(
     返回所有学生的批阅记录，按时间倒序排列
     """
     try:
-        records = grading_db_service.get_all_records(
+        records = await grading_db_service.get_all_records_async(
             skip=skip,
-            limit=limit,
-            db=db
+            limit=limit
         )
         
         logger.info(f"管理员 {current_user.username} 查询了所有批阅记录，共 {len(records)} 条")
@@ -116,7 +117,6 @@ async def get_student_records_by_name(
     username: str,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
     current_user: User = Depends(require_admin)
 ):
     """
@@ -128,10 +128,7 @@ async def get_student_records_by_name(
     """
     try:
         # 查询学生
-        student = db.query(User).filter(
-            User.username == username,
-            User.role == "student"
-        ).first()
+        student = await grading_db_service.find_student_async(username=username)
         
         if not student:
             raise HTTPException(
@@ -139,11 +136,10 @@ async def get_student_records_by_name(
                 detail=f"学生 '{username}' 不存在"
             )
         
-        records = grading_db_service.get_student_records(
-            student_id=student.id,
+        records = await grading_db_service.get_student_records_async(
+            student_id=student["id"],
             skip=skip,
-            limit=limit,
-            db=db
+            limit=limit
         )
         
         logger.info(f"管理员 {current_user.username} 查询了学生 {username} 的批阅记录，共 {len(records)} 条")
@@ -163,10 +159,192 @@ async def get_student_records_by_name(
         )
 
 
+@router.get("/email-outbox", summary="查看邮件发件箱")
+async def get_email_outbox(
+    status_filter: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    current_user: User = Depends(require_admin)
+):
+    """
+    管理员查看批阅报告邮件的发送状态（仅管理员）
+    
+    - **status_filter**: 按状态过滤（pending/sending/sent/failed）
+    - **skip**: 跳过记录数（分页）
+    - **limit**: 返回记录数（默认100）
+    """
+    try:
+        entries = await email_outbox_service.list_entries_async(
+            status=status_filter,
+            skip=skip,
+            limit=limit
+        )
+        return {"total": len(entries), "entries": entries}
+        
+    except Exception as e:
+        logger.error(f"查询邮件发件箱失败: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"查询失败: {str(e)}"
+        )
+
+
+@router.post("/email-outbox/resend-failed", summary="重发全部失败邮件")
+async def resend_failed_emails(
+    current_user: User = Depends(require_admin)
+):
+    """
+    把所有发送失败的邮件重新放回发件箱（仅管理员）
+    """
+    try:
+        count = await email_outbox_service.resend_async()
+        logger.info(f"管理员 {current_user.username} 重发了 {count} 封失败邮件")
+        return {"success": True, "message": f"已重新发送 {count} 封邮件", "count": count}
+        
+    except Exception as e:
+        logger.error(f"重发失败邮件出错: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"重发失败: {str(e)}"
+        )
+
+
+@router.get("/pending-matches", summary="查看待确认的学生匹配")
+async def get_pending_matches(
+    status_filter: Optional[str] = "pending",
+    skip: int = 0,
+    limit: int = 100,
+    current_user: User = Depends(require_admin)
+):
+    """
+    管理员查看识别出的姓名无法可靠匹配到学生的批阅结果（仅管理员）
+    
+    - **status_filter**: 按状态过滤（pending/confirmed/dismissed，默认 pending）
+    - **skip**: 跳过记录数（分页）
+    - **limit**: 返回记录数（默认100）
+    """
+    try:
+        entries = await grading_db_service.list_pending_matches_async(
+            status=status_filter or None,
+            skip=skip,
+            limit=limit
+        )
+        return {"total": len(entries), "entries": entries}
+        
+    except Exception as e:
+        logger.error(f"查询待确认匹配失败: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"查询失败: {str(e)}"
+        )
+
+
+@router.post("/pending-matches/{pending_id}/confirm", summary="确认学生匹配")
+async def confirm_pending_match(
+    pending_id: int,
+    request: ConfirmMatchRequest,
+    current_user: User = Depends(require_admin)
+):
+    """
+    把暂存的批阅结果保存到老师选择的学生名下，并按设置发送批阅邮件（仅管理员）
+    """
+    try:
+        result = await grading_db_service.confirm_pending_match_async(
+            pending_id=pending_id,
+            student_id=request.student_id
+        )
+        if not result["success"]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=result.get("error")
+            )
+        
+        email_queued = False
+        if result.get("student_email") and EmailService().is_configured():
+            await email_outbox_service.enqueue_async(
+                grading_record_id=result["grading_record_id"],
+                student_name=result["student_name"],
+                recipient=result["student_email"]
+            )
+            email_queued = True
+        
+        logger.info(f"管理员 {current_user.username} 将待确认记录 {pending_id} 分配给学生 {result['student_name']}")
+        return {
+            "success": True,
+            "message": "已保存到学生的批阅记录",
+            "grading_record_id": result["grading_record_id"],
+            "email_queued": email_queued
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"确认学生匹配出错: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"确认失败: {str(e)}"
+        )
+
+
+@router.post("/pending-matches/{pending_id}/dismiss", summary="忽略待确认的学生匹配")
+async def dismiss_pending_match(
+    pending_id: int,
+    current_user: User = Depends(require_admin)
+):
+    """
+    忽略一条待确认记录，例如不属于任何学生的作文（仅管理员）
+    """
+    try:
+        dismissed = await grading_db_service.dismiss_pending_match_async(pending_id=pending_id)
+        if not dismissed:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="待确认记录不存在或已处理"
+            )
+        return {"success": True, "message": "已忽略"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"忽略待确认匹配出错: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"操作失败: {str(e)}"
+        )
+
+
+@router.post("/{record_id}/resend-email", summary="重发指定批阅记录的邮件")
+async def resend_record_email(
+    record_id: int,
+    current_user: User = Depends(require_admin)
+):
+    """
+    重新发送指定批阅记录发送失败的邮件（仅管理员）
+    """
+    try:
+        count = await email_outbox_service.resend_async(grading_record_id=record_id)
+        if not count:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="该批阅记录没有发送失败的邮件"
+            )
+        
+        logger.info(f"管理员 {current_user.username} 重发了批阅记录 {record_id} 的邮件")
+        return {"success": True, "message": "邮件已重新加入发送队列", "count": count}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"重发邮件出错: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"重发失败: {str(e)}"
+        )
+
+
 @router.get("/{record_id}", response_model=RecordDetailResponse, summary="查看批阅记录详情")
 async def get_record_detail(
     record_id: int,
-    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -176,9 +354,8 @@ async def get_record_detail(
     - 管理员可以查看任意记录详情
     """
     try:
-        record = grading_db_service.get_record_by_id(
-            record_id=record_id,
-            db=db
+        record = await grading_db_service.get_record_by_id_async(
+            record_id=record_id
         )
         
         if not record:
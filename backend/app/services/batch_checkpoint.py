@@ -0,0 +1,128 @@
+"""
+批阅批次检查点
+
+批阅过程中把每篇作文各阶段的结果（识别文本、姓名、成绩、保存和邮件状态）写入磁盘，
+进程重启后可以从每篇作文最后完成的阶段继续，不必重新上传，也不必重复调用大模型。
+
+每个批次一个目录：
+    checkpoints/<task_id>/batch.json     批次信息（上传文件路径、作文要求、状态）
+    checkpoints/<task_id>/essay_<n>.json 第 n 篇作文已完成的阶段和结果
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.paths import CHECKPOINTS_DIR
+
+logger = logging.getLogger(__name__)
+
+# 没有批次信息的检查点目录超过该时间才清理
+STALE_DIRECTORY_SECONDS = 60
+
+
+class BatchStatus:
+    RUNNING = "running"
+    COMPLETED = "completed"
+
+
+def _write_json(path: Path, data: Dict[str, Any]) -> None:
+    """先写临时文件再替换，进程中途退出时不会留下写了一半的文件。"""
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取检查点 {path} 失败: {e}")
+        return None
+
+
+class BatchCheckpoint:
+    """一个批阅批次的检查点目录。"""
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.directory = CHECKPOINTS_DIR / task_id
+
+    def create(self, manifest: Dict[str, Any]) -> None:
+        """创建检查点并写入批次信息。"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.save_manifest({**manifest, "task_id": self.task_id, "status": BatchStatus.RUNNING})
+
+    def load_manifest(self) -> Optional[Dict[str, Any]]:
+        return _read_json(self.directory / "batch.json")
+
+    def save_manifest(self, manifest: Dict[str, Any]) -> None:
+        _write_json(self.directory / "batch.json", manifest)
+
+    def update_manifest(self, **values: Any) -> None:
+        manifest = self.load_manifest() or {}
+        manifest.update(values)
+        self.save_manifest(manifest)
+
+    async def update_manifest_async(self, **values: Any) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, partial(self.update_manifest, **values))
+
+    def save_essay(self, index: int, state: Dict[str, Any]) -> None:
+        _write_json(self.directory / f"essay_{index}.json", state)
+
+    async def save_essay_async(self, index: int, state: Dict[str, Any]) -> None:
+        """在线程池中写入，fsync 不阻塞事件循环。"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.save_essay, index, state)
+
+    def load_essays(self) -> Dict[int, Dict[str, Any]]:
+        """返回每篇作文已保存的状态，键为作文序号。"""
+        states = {}
+        for path in self.directory.glob("essay_*.json"):
+            state = _read_json(path)
+            if state is None:
+                continue
+            try:
+                states[int(path.stem.split("_", 1)[1])] = state
+            except ValueError:
+                continue
+        return states
+
+    async def load_essays_async(self) -> Dict[int, Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.load_essays)
+
+    def remove(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def list_interrupted_batches() -> List[BatchCheckpoint]:
+    """返回上次运行时没有完成的批次。"""
+    if not CHECKPOINTS_DIR.exists():
+        return []
+    interrupted = []
+    for directory in sorted(CHECKPOINTS_DIR.iterdir()):
+        if not directory.is_dir():
+            continue
+        checkpoint = BatchCheckpoint(directory.name)
+        manifest = checkpoint.load_manifest()
+        if manifest and manifest.get("status") == BatchStatus.RUNNING:
+            interrupted.append(checkpoint)
+        elif manifest is None or manifest.get("status") == BatchStatus.COMPLETED:
+            # 批次信息都没写完，或已完成但清理前退出的目录；
+            # 刚创建的目录可能是其他进程正在写入的新批次，暂不删除
+            if time.time() - directory.stat().st_mtime > STALE_DIRECTORY_SECONDS:
+                checkpoint.remove()
+    return interrupted
@@ -0,0 +1,321 @@
+"""
+邮件发件箱服务
+批阅流程只把邮件写入 email_outbox 表，由后台投递器异步发送并按指数退避重试
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import get_db_session, run_in_db_thread
+from app.models.database import EmailOutbox
+from app.services.email_service import EmailService, close_smtp_sessions
+
+logger = logging.getLogger(__name__)
+
+# 写入 last_error 的失败原因最长保留的字符数
+MAX_ERROR_LENGTH = 500
+
+
+class EmailOutboxStatus:
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+
+def _outbox_to_dict(entry: EmailOutbox) -> Dict:
+    return {
+        "id": entry.id,
+        "grading_record_id": entry.grading_record_id,
+        "student_name": entry.student_name,
+        "recipient": entry.recipient,
+        "status": entry.status,
+        "attempts": entry.attempts,
+        "next_attempt_at": entry.next_attempt_at.isoformat() if entry.next_attempt_at else None,
+        "last_error": entry.last_error,
+        "created_at": entry.created_at.isoformat() if entry.created_at else None,
+        "sent_at": entry.sent_at.isoformat() if entry.sent_at else None,
+    }
+
+
+class EmailOutboxService:
+    """发件箱的数据库操作"""
+
+    def enqueue(
+        self,
+        grading_record_id: int,
+        student_name: str,
+        recipient: str,
+        db: Optional[Session] = None
+    ) -> Dict:
+        """
+        把一封批阅报告邮件写入发件箱，同一批阅记录只会入队一次
+
+        Args:
+            grading_record_id: 批阅记录ID
+            student_name: 学生姓名
+            recipient: 收件邮箱
+            db: 数据库会话（可选）
+
+        Returns:
+            Dict: 发件箱记录
+        """
+        def _enqueue(session: Session):
+            entry = session.query(EmailOutbox).filter(
+                EmailOutbox.grading_record_id == grading_record_id
+            ).first()
+            if entry:
+                return _outbox_to_dict(entry)
+
+            entry = EmailOutbox(
+                grading_record_id=grading_record_id,
+                student_name=student_name,
+                recipient=recipient,
+                status=EmailOutboxStatus.PENDING,
+                attempts=0,
+                next_attempt_at=datetime.utcnow(),
+            )
+            session.add(entry)
+            session.commit()
+            return _outbox_to_dict(entry)
+
+        if db:
+            return _enqueue(db)
+        else:
+            with get_db_session() as session:
+                return _enqueue(session)
+
+    def list_entries(
+        self,
+        status: Optional[str] = None,
+        skip: int = 0,
+        limit: int = 100,
+        db: Optional[Session] = None
+    ) -> List[Dict]:
+        """按状态查询发件箱记录，最新的在前"""
+        def _query(session: Session):
+            query = session.query(EmailOutbox)
+            if status:
+                query = query.filter(EmailOutbox.status == status)
+            entries = query.order_by(EmailOutbox.id.desc()).offset(skip).limit(limit).all()
+            return [_outbox_to_dict(entry) for entry in entries]
+
+        if db:
+            return _query(db)
+        else:
+            with get_db_session() as session:
+                return _query(session)
+
+    def resend(
+        self,
+        grading_record_id: Optional[int] = None,
+        db: Optional[Session] = None
+    ) -> int:
+        """
+        重新发送失败的邮件
+
+        Args:
+            grading_record_id: 只重发该批阅记录的邮件；为空时重发全部失败邮件
+            db: 数据库会话（可选）
+
+        Returns:
+            int: 重新入队的邮件数量
+        """
+        def _resend(session: Session):
+            query = session.query(EmailOutbox).filter(EmailOutbox.status == EmailOutboxStatus.FAILED)
+            if grading_record_id is not None:
+                query = query.filter(EmailOutbox.grading_record_id == grading_record_id)
+            count = query.update(
+                {
+                    EmailOutbox.status: EmailOutboxStatus.PENDING,
+                    EmailOutbox.attempts: 0,
+                    EmailOutbox.next_attempt_at: datetime.utcnow(),
+                },
+                synchronize_session=False,
+            )
+            session.commit()
+            return count
+
+        if db:
+            return _resend(db)
+        else:
+            with get_db_session() as session:
+                return _resend(session)
+
+    # ===== 异步接口：在数据库线程池中执行，入队后立即唤醒投递器 =====
+
+    async def enqueue_async(self, **kwargs) -> Dict:
+        result = await run_in_db_thread(self.enqueue, **kwargs)
+        email_dispatcher.wake()
+        return result
+
+    async def list_entries_async(self, **kwargs) -> List[Dict]:
+        return await run_in_db_thread(self.list_entries, **kwargs)
+
+    async def resend_async(self, **kwargs) -> int:
+        count = await run_in_db_thread(self.resend, **kwargs)
+        if count:
+            email_dispatcher.wake()
+        return count
+
+    @staticmethod
+    def _claimable(now: datetime):
+        """到期的待发送邮件，以及领取后超时仍未结束（投递进程已中断）的邮件"""
+        stale_before = now - timedelta(seconds=settings.email_claim_timeout_seconds)
+        return or_(
+            and_(
+                EmailOutbox.status == EmailOutboxStatus.PENDING,
+                EmailOutbox.next_attempt_at <= now,
+            ),
+            and_(
+                EmailOutbox.status == EmailOutboxStatus.SENDING,
+                or_(EmailOutbox.claimed_at.is_(None), EmailOutbox.claimed_at < stale_before),
+            ),
+        )
+
+    def claim_due(self, limit: int) -> List[Dict]:
+        """取出到期的待发送邮件并标记为发送中"""
+        now = datetime.utcnow()
+        with get_db_session() as session:
+            entries = session.query(EmailOutbox).filter(
+                self._claimable(now)
+            ).order_by(EmailOutbox.next_attempt_at).limit(limit).all()
+
+            claimed = []
+            for entry in entries:
+                # 条件更新，多个执行进程同时领取时同一封邮件只会被一个进程取到
+                updated = session.query(EmailOutbox).filter(
+                    EmailOutbox.id == entry.id,
+                    self._claimable(now),
+                ).update(
+                    {
+                        EmailOutbox.status: EmailOutboxStatus.SENDING,
+                        EmailOutbox.attempts: EmailOutbox.attempts + 1,
+                        EmailOutbox.claimed_at: now,
+                    },
+                    synchronize_session=False,
+                )
+                if updated != 1:
+                    continue
+                session.refresh(entry)
+                raw_result = entry.grading_record.raw_result if entry.grading_record else None
+                item = _outbox_to_dict(entry)
+                item["grading_result"] = json.loads(raw_result) if raw_result else {}
+                claimed.append(item)
+            session.commit()
+            return claimed
+
+    def mark_sent(self, outbox_id: int) -> None:
+        with get_db_session() as session:
+            session.query(EmailOutbox).filter(EmailOutbox.id == outbox_id).update(
+                {
+                    EmailOutbox.status: EmailOutboxStatus.SENT,
+                    EmailOutbox.sent_at: datetime.utcnow(),
+                    EmailOutbox.last_error: None,
+                },
+                synchronize_session=False,
+            )
+            session.commit()
+
+    def mark_failed(self, outbox_id: int, attempts: int, error: str) -> None:
+        """记录发送失败；未超过重试次数时按指数退避安排下次发送"""
+        if attempts >= settings.email_max_attempts:
+            values = {EmailOutbox.status: EmailOutboxStatus.FAILED}
+        else:
+            delay = min(
+                settings.email_retry_base_seconds * (2 ** (attempts - 1)),
+                settings.email_retry_max_seconds,
+            )
+            values = {
+                EmailOutbox.status: EmailOutboxStatus.PENDING,
+                EmailOutbox.next_attempt_at: datetime.utcnow() + timedelta(seconds=delay),
+            }
+        values[EmailOutbox.last_error] = error
+        with get_db_session() as session:
+            session.query(EmailOutbox).filter(EmailOutbox.id == outbox_id).update(
+                values,
+                synchronize_session=False,
+            )
+            session.commit()
+
+
+class EmailDispatcher:
+    """后台邮件投递器，持续发送发件箱中到期的邮件"""
+
+    def __init__(self, poll_interval: float = 10.0):
+        self.poll_interval = poll_interval
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def wake(self) -> None:
+        """有新邮件入队时立即唤醒投递器"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _send(self, item: Dict, email_service: EmailService) -> None:
+        try:
+            await email_service.deliver_grading_email(
+                student_name=item["student_name"],
+                student_email=item["recipient"],
+                grading_result=item["grading_result"],
+            )
+        except Exception as exc:
+            # 记录真实的失败原因（授权失败、收件人被拒、连接超时等），方便老师排查
+            reason = f"{type(exc).__name__}: {exc}"[:MAX_ERROR_LENGTH]
+            logger.warning("邮件 %s 发送失败（第 %s 次）: %s", item["id"], item["attempts"], reason)
+            await run_in_db_thread(
+                email_outbox_service.mark_failed,
+                item["id"],
+                item["attempts"],
+                reason,
+            )
+        else:
+            await run_in_db_thread(email_outbox_service.mark_sent, item["id"])
+
+    async def _run(self) -> None:
+        logger.info("邮件投递器已启动。")
+        while True:
+            self._wakeup.clear()
+            try:
+                email_service = EmailService()
+                batch = (
+                    await run_in_db_thread(email_outbox_service.claim_due, max(1, settings.email_concurrency))
+                    if email_service.is_configured()
+                    else []
+                )
+                if batch:
+                    await asyncio.gather(*(self._send(item, email_service) for item in batch))
+                    continue
+            except Exception as e:
+                logger.error(f"邮件投递失败: {e}", exc_info=True)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            # 其他进程中断时停在发送中的邮件，超过 email_claim_timeout_seconds 后由 claim_due 重新领取
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await close_smtp_sessions()
+
+
+email_outbox_service = EmailOutboxService()
+email_dispatcher = EmailDispatcher()
@@ -1,16 +1,157 @@
+import asyncio
 import logging
 import smtplib
 import ssl
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from html import escape
-from typing import Any, Dict
+from typing import Any, Deque, Dict, Optional, Tuple
 
+from app.config import settings
 from app.services.teacher_config import teacher_config_service
 
 
 logger = logging.getLogger(__name__)
 
+# Dedicated threads for blocking SMTP I/O, sized to the email pipeline stage.
+SMTP_THREADS = max(1, settings.email_concurrency)
+_smtp_executor = ThreadPoolExecutor(
+    max_workers=SMTP_THREADS,
+    thread_name_prefix="smtp",
+)
+
+
+class SMTPSession:
+    """
+    A logged-in SMTP connection reused for many messages.
+
+    Each SMTP thread owns one session. It connects and logs in lazily, checks
+    the connection with NOOP after it has been idle, and reconnects once when
+    the server has dropped it.
+    """
+
+    def __init__(self, host: str, port: int, username: str, password: str):
+        self.config_key = (host, port, username, password)
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.port == 465:
+            context = ssl.create_default_context()
+            server = smtplib.SMTP_SSL(self.host, self.port, context=context, timeout=30)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=30)
+            server.starttls()
+        server.login(self.username, self.password)
+        logger.info("SMTP session opened: %s@%s", self.username, self.host)
+        return server
+
+    def _is_alive(self) -> bool:
+        if self._server is None:
+            return False
+        if time.monotonic() - self._last_used < settings.smtp_idle_seconds:
+            return True
+        try:
+            return self._server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, msg: MIMEMultipart) -> None:
+        if not self._is_alive():
+            self._reset()
+            self._server = self._connect()
+        try:
+            self._server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError, ssl.SSLError):
+            # The server closed an idle connection; log in again and retry once.
+            logger.info("SMTP connection dropped, reconnecting to %s", self.host)
+            self._reset()
+            self._server = self._connect()
+            self._server.send_message(msg)
+        except Exception:
+            # Unknown connection state after other failures; start fresh next time.
+            self._reset()
+            raise
+        self._last_used = time.monotonic()
+
+    def _reset(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+    def close(self) -> None:
+        self._reset()
+
+
+class SendRateLimiter:
+    """Sliding-window cap on messages per minute, shared by all SMTP threads."""
+
+    def __init__(self):
+        self._sent: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= 60:
+                    self._sent.popleft()
+                limit = settings.smtp_max_per_minute
+                if limit <= 0 or len(self._sent) < limit:
+                    self._sent.append(now)
+                    return
+                delay = 60 - (now - self._sent[0])
+            # Runs on an SMTP thread, so sleeping here does not block the event loop.
+            time.sleep(delay)
+
+
+_thread_sessions = threading.local()
+_send_rate_limiter = SendRateLimiter()
+
+# How long shutdown waits for in-flight sends before giving up on closing sessions.
+SMTP_CLOSE_TIMEOUT = 60.0
+
+
+def _close_thread_session(barrier: threading.Barrier) -> None:
+    session = getattr(_thread_sessions, "session", None)
+    if session is not None:
+        session.close()
+        _thread_sessions.session = None
+    # Hold this thread until every SMTP thread has picked up a close job.
+    try:
+        barrier.wait(timeout=SMTP_CLOSE_TIMEOUT)
+    except threading.BrokenBarrierError:
+        pass
+
+
+async def close_smtp_sessions() -> None:
+    """
+    Log out of every pooled SMTP session, e.g. on shutdown.
+
+    Sessions are only touched by the thread that owns them, so one close job is
+    queued per SMTP thread; each runs after that thread's in-flight send finishes.
+    """
+    barrier = threading.Barrier(SMTP_THREADS)
+    futures = [
+        asyncio.wrap_future(_smtp_executor.submit(_close_thread_session, barrier))
+        for _ in range(SMTP_THREADS)
+    ]
+    _, pending = await asyncio.wait(futures, timeout=SMTP_CLOSE_TIMEOUT)
+    if pending:
+        barrier.abort()
+        logger.warning("Timed out closing SMTP sessions; %s thread(s) still busy", len(pending))
+
 
 def _format_value(value: Any) -> str:
     if value is None or value == "":
@@ -164,18 +305,30 @@ class EmailService:
         </html>
         """
 
-    async def send_grading_email(
+    def _config_key(self) -> Tuple[str, int, str, str]:
+        return (self.smtp_host, self.smtp_port, self.smtp_username, self.smtp_password)
+
+    def _send_message_sync(self, msg: MIMEMultipart) -> None:
+        _send_rate_limiter.wait()
+        session = getattr(_thread_sessions, "session", None)
+        if session is None or session.config_key != self._config_key():
+            if session is not None:
+                session.close()
+            session = SMTPSession(*self._config_key())
+            _thread_sessions.session = session
+        session.send(msg)
+
+    async def deliver_grading_email(
         self,
         student_name: str,
         student_email: str,
         grading_result: Dict,
-    ) -> bool:
+    ) -> None:
+        """Send the grading report, raising the underlying exception when delivery fails."""
         if not student_email:
-            logger.info("Skip email: student email is empty for %s", student_name)
-            return False
+            raise ValueError("学生邮箱为空")
         if not self.is_configured():
-            logger.info("Skip email: SMTP is not enabled or incomplete.")
-            return False
+            raise ValueError("SMTP 未启用或配置不完整")
 
         subject = f"【作文批阅报告】{student_name}同学，你的作文已批阅"
         msg = MIMEMultipart("alternative")
@@ -184,19 +337,7 @@ class EmailService:
         msg["To"] = student_email
         msg.attach(MIMEText(self._render_email_template(student_name, grading_result), "html", "utf-8"))
 
-        try:
-            if self.smtp_port == 465:
-                context = ssl.create_default_context()
-                with smtplib.SMTP_SSL(self.smtp_host, self.smtp_port, context=context, timeout=30) as server:
-                    server.login(self.smtp_username, self.smtp_password)
-                    server.send_message(msg)
-            else:
-                with smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=30) as server:
-                    server.starttls()
-                    server.login(self.smtp_username, self.smtp_password)
-                    server.send_message(msg)
-            logger.info("Email sent to %s <%s>", student_name, student_email)
-            return True
-        except Exception as exc:
-            logger.error("Failed to send email to %s <%s>: %s", student_name, student_email, exc, exc_info=True)
-            return False
+        # smtplib is blocking; run it on the dedicated SMTP threads so the event loop stays free.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_smtp_executor, self._send_message_sync, msg)
+        logger.info("Email sent to %s <%s>", student_name, student_email)
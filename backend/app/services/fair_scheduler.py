@@ -0,0 +1,109 @@
+"""
+作文级公平调度。
+
+同一执行进程中的所有批次共享 grading_concurrency 个作文名额。名额空出时，
+按提交老师做加权公平排队（WFQ）：每位老师的每篇作文得到一个虚拟完成时间
+max(当前虚拟时间, 该老师上一篇的完成时间) + 1/权重，完成时间最小的作文先进入流水线。
+一位老师连续提交多个班级时，其他老师的作文仍然交替进入，不会被饿死；
+小批次（单篇重批等）优先于所有普通作文。
+"""
+import asyncio
+import heapq
+import itertools
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+
+class SchedulerFlow:
+    """一个批次在调度器中的句柄，作为 StagedPipeline 的准入控制使用。"""
+
+    def __init__(self, scheduler: "FairScheduler", user_key: str, weight: float = 1.0, priority: int = 0):
+        self.scheduler = scheduler
+        self.user_key = user_key
+        self.weight = max(weight, 0.01)
+        self.priority = priority
+
+    async def acquire(self) -> None:
+        await self.scheduler.acquire(self)
+
+    def release(self) -> None:
+        self.scheduler.release()
+
+
+class FairScheduler:
+    """进程内所有批次共享的作文名额，按提交老师加权公平分配。"""
+
+    def __init__(self, slots: Optional[int] = None):
+        self._slots = slots
+        self._in_use = 0
+        # (优先级排序值, 虚拟完成时间, 序号, 虚拟开始时间, future, 提交者)
+        self._waiters: List[Tuple[int, float, int, float, asyncio.Future, str]] = []
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._sequence = itertools.count()
+        self._granted: Dict[str, int] = {}
+
+    @property
+    def slots(self) -> int:
+        return max(1, self._slots or settings.grading_concurrency)
+
+    def flow(self, user_key: str, weight: float = 1.0, priority: int = 0) -> SchedulerFlow:
+        return SchedulerFlow(self, user_key, weight, priority)
+
+    def _tag(self, flow: SchedulerFlow) -> Tuple[float, float]:
+        start = max(self._virtual_time, self._last_finish.get(flow.user_key, 0.0))
+        finish = start + 1 / flow.weight
+        self._last_finish[flow.user_key] = finish
+        return start, finish
+
+    def _grant(self, user_key: str, start: float) -> None:
+        self._in_use += 1
+        self._virtual_time = max(self._virtual_time, start)
+        self._granted[user_key] = self._granted.get(user_key, 0) + 1
+        # 完成时间已落后于虚拟时间的老师没有积压，不必再记录
+        if len(self._last_finish) > 64:
+            self._last_finish = {
+                key: finish for key, finish in self._last_finish.items() if finish > self._virtual_time
+            }
+
+    async def acquire(self, flow: SchedulerFlow) -> None:
+        start, finish = self._tag(flow)
+        if self._in_use < self.slots and not self._waiters:
+            self._grant(flow.user_key, start)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._waiters,
+            (-flow.priority, finish, next(self._sequence), start, future, flow.user_key),
+        )
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已经分到名额后才被取消时交还名额
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self._in_use -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._waiters and self._in_use < self.slots:
+            _, _, _, start, future, user_key = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._grant(user_key, start)
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slots": self.slots,
+            "in_use": self._in_use,
+            "waiting": sum(1 for waiter in self._waiters if not waiter[4].done()),
+            "granted_by_user": dict(self._granted),
+        }
+
+
+fair_scheduler = FairScheduler()
@@ -2,17 +2,37 @@
 批阅记录数据库服务
 处理作文和批阅记录的数据库操作
 """
+import asyncio
 import json
 import logging
-from typing import Optional, Dict, List
+from datetime import datetime
+from typing import Optional, Dict, List, Set, Tuple
 from sqlalchemy.orm import Session
 
-from app.models.database import User, Essay, GradingRecord
-from app.database import get_db_session
+from app.config import settings
+from app.models.database import User, Essay, GradingRecord, PendingStudentMatch
+from app.database import get_db_session, run_in_db_thread
 
 logger = logging.getLogger(__name__)
 
 
+def _pending_to_dict(pending: PendingStudentMatch) -> Dict:
+    return {
+        "id": pending.id,
+        "recognized_name": pending.recognized_name,
+        "class_name": pending.class_name,
+        "candidates": json.loads(pending.candidates) if pending.candidates else [],
+        "essay_text": pending.essay_text,
+        "requirements": pending.requirements,
+        "image_path": pending.image_path,
+        "grading_result": json.loads(pending.raw_result) if pending.raw_result else None,
+        "status": pending.status,
+        "grading_record_id": pending.grading_record_id,
+        "created_at": pending.created_at.isoformat() if pending.created_at else None,
+        "resolved_at": pending.resolved_at.isoformat() if pending.resolved_at else None,
+    }
+
+
 class GradingDatabaseService:
     """批阅记录数据库服务"""
     
@@ -23,6 +43,8 @@ class GradingDatabaseService:
         requirements: str,
         grading_result: Dict,
         image_path: Optional[str] = None,
+        student_id: Optional[int] = None,
+        student_email: Optional[str] = None,
         db: Optional[Session] = None
     ) -> Dict:
         """
@@ -34,6 +56,8 @@ class GradingDatabaseService:
             requirements: 作文要求
             grading_result: LLM批阅结果字典
             image_path: 作文图片路径（可选）
+            student_id: 已通过学生名单匹配到的学生ID（可选，提供时不再按姓名查询）
+            student_email: 匹配到的学生邮箱（与 student_id 一起提供）
             db: 数据库会话（可选，如果不提供则创建新会话）
             
         Returns:
@@ -41,70 +65,17 @@ class GradingDatabaseService:
         """
         def _save(session: Session):
             try:
-                # 1. 查找学生
-                student = session.query(User).filter(
-                    User.username == student_name,
-                    User.role == "student"
-                ).first()
-                
-                if not student:
-                    logger.error(f"学生不存在: {student_name}")
-                    return {
-                        "success": False,
-                        "error": f"学生 '{student_name}' 不存在于数据库中"
-                    }
-                
-                # 2. 创建作文记录
-                essay = Essay(
-                    student_id=student.id,
-                    image_path=image_path,
-                    essay_text=essay_text,
-                    requirements=requirements
-                )
-                session.add(essay)
-                session.flush()  # 获取essay.id
-                
-                # 3. 创建批阅记录
-                # 将 list/dict 类型的字段转换为 JSON 字符串
-                advantages = grading_result.get("advantages", grading_result.get("strengths"))
-                if isinstance(advantages, (list, dict)):
-                    advantages = json.dumps(advantages, ensure_ascii=False)
-
-                disadvantages = grading_result.get("disadvantages", grading_result.get("weaknesses"))
-                if isinstance(disadvantages, (list, dict)):
-                    disadvantages = json.dumps(disadvantages, ensure_ascii=False)
-
-                suggestions = grading_result.get("suggestions")
-                if isinstance(suggestions, (list, dict)):
-                    suggestions = json.dumps(suggestions, ensure_ascii=False)
-
-                grading_record = GradingRecord(
-                    essay_id=essay.id,
-                    score=grading_result.get("score"),
-                    advantages=advantages,
-                    disadvantages=disadvantages,
-                    suggestions=suggestions,
-                    graded_by="AI",
-                    raw_result=json.dumps(grading_result, ensure_ascii=False)
-                )
-                session.add(grading_record)
-                
-                # 4. 提交事务
-                session.commit()
-                
-                logger.info(
-                    f"成功保存批阅记录: 学生={student_name}, "
-                    f"Essay ID={essay.id}, Record ID={grading_record.id}"
+                result = self._add_grading_result(
+                    session, student_name, essay_text, requirements, grading_result,
+                    image_path, student_id, student_email
                 )
-                
-                return {
-                    "success": True,
-                    "student_id": student.id,
-                    "student_email": student.email,
-                    "essay_id": essay.id,
-                    "grading_record_id": grading_record.id,
-                    "score": grading_result.get("score")
-                }
+                if result["success"]:
+                    session.commit()
+                    logger.info(
+                        f"成功保存批阅记录: 学生={student_name}, "
+                        f"Essay ID={result['essay_id']}, Record ID={result['grading_record_id']}"
+                    )
+                return result
                 
             except Exception as e:
                 session.rollback()
@@ -121,6 +92,111 @@ class GradingDatabaseService:
             with get_db_session() as session:
                 return _save(session)
     
+    def _add_grading_result(
+        self,
+        session: Session,
+        student_name: str,
+        essay_text: str,
+        requirements: str,
+        grading_result: Dict,
+        image_path: Optional[str] = None,
+        student_id: Optional[int] = None,
+        student_email: Optional[str] = None
+    ) -> Dict:
+        """
+        在当前事务中写入作文和批阅记录（只 flush 获取 ID，不提交）
+        
+        Returns:
+            Dict: 包含保存结果的字典，学生不存在时 success 为 False
+        """
+        # 1. 查找学生（批阅流水线已通过学生名单匹配时直接使用）
+        if student_id is None:
+            student = session.query(User).filter(
+                User.username == student_name,
+                User.role == "student"
+            ).first()
+            
+            if not student:
+                logger.error(f"学生不存在: {student_name}")
+                return {
+                    "success": False,
+                    "error": f"学生 '{student_name}' 不存在于数据库中"
+                }
+            student_id, student_email = student.id, student.email
+        
+        # 2. 创建作文记录
+        essay = Essay(
+            student_id=student_id,
+            image_path=image_path,
+            essay_text=essay_text,
+            requirements=requirements
+        )
+        session.add(essay)
+        session.flush()  # 获取essay.id
+        
+        # 3. 创建批阅记录
+        # 将 list/dict 类型的字段转换为 JSON 字符串
+        advantages = grading_result.get("advantages", grading_result.get("strengths"))
+        if isinstance(advantages, (list, dict)):
+            advantages = json.dumps(advantages, ensure_ascii=False)
+
+        disadvantages = grading_result.get("disadvantages", grading_result.get("weaknesses"))
+        if isinstance(disadvantages, (list, dict)):
+            disadvantages = json.dumps(disadvantages, ensure_ascii=False)
+
+        suggestions = grading_result.get("suggestions")
+        if isinstance(suggestions, (list, dict)):
+            suggestions = json.dumps(suggestions, ensure_ascii=False)
+
+        grading_record = GradingRecord(
+            essay_id=essay.id,
+            score=grading_result.get("score"),
+            advantages=advantages,
+            disadvantages=disadvantages,
+            suggestions=suggestions,
+            graded_by="AI",
+            raw_result=json.dumps(grading_result, ensure_ascii=False)
+        )
+        session.add(grading_record)
+        session.flush()  # 获取grading_record.id
+        
+        return {
+            "success": True,
+            "student_id": student_id,
+            "student_email": student_email,
+            "essay_id": essay.id,
+            "grading_record_id": grading_record.id,
+            "score": grading_result.get("score")
+        }
+    
+    def save_grading_results_batch(self, items: List[Dict]) -> List[Dict]:
+        """
+        在一个事务中保存多篇作文的批阅结果
+        
+        Args:
+            items: save_grading_result 的参数字典列表（不含 db）
+            
+        Returns:
+            List[Dict]: 与 items 一一对应的保存结果
+        """
+        with get_db_session() as session:
+            try:
+                results = [self._add_grading_result(session, **item) for item in items]
+                session.commit()
+            except Exception as e:
+                # 整组回滚后逐条重试，只让出错的那一篇失败
+                session.rollback()
+                logger.warning(f"批量保存批阅结果失败，改为逐条保存: {e}")
+                return [self.save_grading_result(**item) for item in items]
+        
+        saved = [result for result in results if result["success"]]
+        if saved:
+            logger.info(
+                f"成功批量保存 {len(saved)} 条批阅记录: "
+                f"Record ID={[result['grading_record_id'] for result in saved]}"
+            )
+        return results
+    
     def get_student_records(
         self,
         student_id: int,
@@ -284,6 +360,294 @@ class GradingDatabaseService:
             with get_db_session() as session:
                 return _query(session)
 
+    def find_student(
+        self,
+        username: str,
+        db: Optional[Session] = None
+    ) -> Optional[Dict]:
+        """
+        根据用户名查找学生
+        
+        Args:
+            username: 学生用户名
+            db: 数据库会话
+            
+        Returns:
+            Dict: 学生信息，如果不存在则返回None
+        """
+        def _query(session: Session):
+            student = session.query(User).filter(
+                User.username == username,
+                User.role == "student"
+            ).first()
+            if not student:
+                return None
+            return {
+                "id": student.id,
+                "username": student.username,
+                "email": student.email,
+                "class_name": student.class_name
+            }
+        
+        if db:
+            return _query(db)
+        else:
+            with get_db_session() as session:
+                return _query(session)
+    
+    def save_pending_match(
+        self,
+        recognized_name: Optional[str],
+        class_name: Optional[str],
+        candidates: List[Dict],
+        essay_text: str,
+        requirements: str,
+        grading_result: Dict,
+        image_path: Optional[str] = None,
+        db: Optional[Session] = None
+    ) -> Dict:
+        """
+        暂存无法可靠匹配到学生的批阅结果，等待老师确认
+        
+        Args:
+            recognized_name: 识别出的姓名
+            class_name: 识别出的班级
+            candidates: 候选学生及置信度
+            essay_text: OCR识别的作文全文
+            requirements: 作文要求
+            grading_result: LLM批阅结果字典
+            image_path: 作文图片路径（可选）
+            db: 数据库会话
+            
+        Returns:
+            Dict: 待确认记录
+        """
+        def _save(session: Session):
+            pending = PendingStudentMatch(
+                recognized_name=recognized_name,
+                class_name=class_name,
+                candidates=json.dumps(candidates, ensure_ascii=False),
+                essay_text=essay_text,
+                requirements=requirements,
+                image_path=image_path,
+                raw_result=json.dumps(grading_result, ensure_ascii=False),
+                status="pending"
+            )
+            session.add(pending)
+            session.commit()
+            logger.info(f"学生姓名 '{recognized_name}' 无法可靠匹配，已暂存待老师确认 (ID={pending.id})")
+            return _pending_to_dict(pending)
+        
+        if db:
+            return _save(db)
+        else:
+            with get_db_session() as session:
+                return _save(session)
+    
+    def list_pending_matches(
+        self,
+        status: Optional[str] = "pending",
+        skip: int = 0,
+        limit: int = 100,
+        db: Optional[Session] = None
+    ) -> List[Dict]:
+        """查询待确认的学生匹配，最新的在前"""
+        def _query(session: Session):
+            query = session.query(PendingStudentMatch)
+            if status:
+                query = query.filter(PendingStudentMatch.status == status)
+            entries = query.order_by(PendingStudentMatch.id.desc()).offset(skip).limit(limit).all()
+            return [_pending_to_dict(entry) for entry in entries]
+        
+        if db:
+            return _query(db)
+        else:
+            with get_db_session() as session:
+                return _query(session)
+    
+    def confirm_pending_match(
+        self,
+        pending_id: int,
+        student_id: int,
+        db: Optional[Session] = None
+    ) -> Dict:
+        """
+        老师确认学生后，把暂存的批阅结果保存为正式记录
+        
+        Args:
+            pending_id: 待确认记录ID
+            student_id: 老师选择的学生ID
+            db: 数据库会话
+            
+        Returns:
+            Dict: 与 save_grading_result 相同格式的保存结果
+        """
+        def _confirm(session: Session):
+            pending = session.query(PendingStudentMatch).filter(
+                PendingStudentMatch.id == pending_id,
+                PendingStudentMatch.status == "pending"
+            ).first()
+            if not pending:
+                return {"success": False, "error": "待确认记录不存在或已处理"}
+            
+            student = session.query(User).filter(
+                User.id == student_id,
+                User.role == "student"
+            ).first()
+            if not student:
+                return {"success": False, "error": "学生不存在"}
+            
+            try:
+                grading_result = json.loads(pending.raw_result) if pending.raw_result else {}
+                result = self._add_grading_result(
+                    session, student.username, pending.essay_text, pending.requirements,
+                    grading_result, pending.image_path, student.id, student.email
+                )
+                pending.status = "confirmed"
+                pending.grading_record_id = result["grading_record_id"]
+                pending.resolved_at = datetime.utcnow()
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"确认学生匹配失败: {e}", exc_info=True)
+                return {"success": False, "error": str(e)}
+            
+            logger.info(
+                f"已确认学生匹配: '{pending.recognized_name}' -> {student.username}, "
+                f"Record ID={result['grading_record_id']}"
+            )
+            result["student_name"] = student.username
+            return result
+        
+        if db:
+            return _confirm(db)
+        else:
+            with get_db_session() as session:
+                return _confirm(session)
+    
+    def dismiss_pending_match(self, pending_id: int, db: Optional[Session] = None) -> bool:
+        """忽略一条待确认记录（例如不属于任何学生的作文）"""
+        def _dismiss(session: Session):
+            count = session.query(PendingStudentMatch).filter(
+                PendingStudentMatch.id == pending_id,
+                PendingStudentMatch.status == "pending"
+            ).update(
+                {
+                    PendingStudentMatch.status: "dismissed",
+                    PendingStudentMatch.resolved_at: datetime.utcnow(),
+                },
+                synchronize_session=False
+            )
+            session.commit()
+            return count > 0
+        
+        if db:
+            return _dismiss(db)
+        else:
+            with get_db_session() as session:
+                return _dismiss(session)
+    
+    # ===== 异步接口：在数据库线程池中执行，供事件循环中的代码调用 =====
+    
+    async def save_grading_result_async(self, **kwargs) -> Dict:
+        return await run_in_db_thread(self.save_grading_result, **kwargs)
+    
+    async def get_student_records_async(self, **kwargs) -> List[Dict]:
+        return await run_in_db_thread(self.get_student_records, **kwargs)
+    
+    async def get_all_records_async(self, **kwargs) -> List[Dict]:
+        return await run_in_db_thread(self.get_all_records, **kwargs)
+    
+    async def get_record_by_id_async(self, **kwargs) -> Optional[Dict]:
+        return await run_in_db_thread(self.get_record_by_id, **kwargs)
+    
+    async def find_student_async(self, **kwargs) -> Optional[Dict]:
+        return await run_in_db_thread(self.find_student, **kwargs)
+    
+    async def save_pending_match_async(self, **kwargs) -> Dict:
+        return await run_in_db_thread(self.save_pending_match, **kwargs)
+    
+    async def list_pending_matches_async(self, **kwargs) -> List[Dict]:
+        return await run_in_db_thread(self.list_pending_matches, **kwargs)
+    
+    async def confirm_pending_match_async(self, **kwargs) -> Dict:
+        return await run_in_db_thread(self.confirm_pending_match, **kwargs)
+    
+    async def dismiss_pending_match_async(self, **kwargs) -> bool:
+        return await run_in_db_thread(self.dismiss_pending_match, **kwargs)
+
+
+class GradingResultWriter:
+    """
+    批阅结果的批量写入器
+    
+    批阅流水线中的保存请求先进入当前分组，分组达到 db_commit_batch_size 条
+    或等待超过 db_commit_interval_ms 后在一个事务中提交，减少 SQLite 的 fsync 次数和写锁竞争。
+    调用方在所在分组提交后才拿到结果（含 ID），因此崩溃时最多丢失尚未提交的当前分组。
+    """
+    
+    def __init__(self, service: GradingDatabaseService):
+        self.service = service
+        self._pending: List[Tuple[Dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._flushes: Set[asyncio.Task] = set()
+    
+    async def save(self, **kwargs) -> Dict:
+        """加入当前分组并等待分组提交，参数同 save_grading_result（不含 db）"""
+        if settings.db_commit_batch_size <= 1:
+            return await self.service.save_grading_result_async(**kwargs)
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((kwargs, future))
+        
+        if len(self._pending) >= settings.db_commit_batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(settings.db_commit_interval_ms / 1000, self._start_flush)
+        return await future
+    
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        # 调用方已被取消（例如关闭时取消了批阅任务）的保存请求不再提交，重启后由检查点继续
+        group = [(item, future) for item, future in self._pending if not future.done()]
+        self._pending = []
+        if not group:
+            return
+        task = asyncio.create_task(self._flush(group))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+    
+    async def _flush(self, group: List[Tuple[Dict, asyncio.Future]]) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # SQLite 只有一个写入者，分组按顺序逐个提交
+        async with self._lock:
+            try:
+                results = await run_in_db_thread(
+                    self.service.save_grading_results_batch,
+                    [item for item, _ in group],
+                )
+            except Exception as e:
+                logger.error(f"批量保存批阅结果失败: {e}", exc_info=True)
+                results = [{"success": False, "error": str(e)} for _ in group]
+        
+        for (_, future), result in zip(group, results):
+            if not future.done():
+                future.set_result(result)
+    
+    async def flush(self) -> None:
+        """立即提交当前分组并等待所有进行中的提交完成（关闭时调用）"""
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
 
 # 创建全局实例
 grading_db_service = GradingDatabaseService()
+grading_result_writer = GradingResultWriter(grading_db_service)
@@ -0,0 +1,180 @@
+"""
+分阶段批阅流水线。
+
+每个阶段有独立的队列和并发上限，作文在阶段之间流转：
+第 N+1 篇作文的图片识别可以和第 N 篇的批改同时进行，
+慢速的邮件发送也不会占用 LLM 调用的并发名额。
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class StageMetrics:
+    """单个阶段的累计运行指标，用于调优各阶段并发数。"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queued = 0
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        finished = self.processed + self.failed
+        elapsed_minutes = max(time.monotonic() - self.started_at, 1e-6) / 60
+        return {
+            "stage": self.name,
+            "queue_depth": self.queued,
+            "active": self.active,
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_seconds": round(self.busy_seconds / finished, 3) if finished else 0,
+            "throughput_per_minute": round(finished / elapsed_minutes, 2),
+        }
+
+
+class PipelineMetrics:
+    """所有正在运行的流水线共享的阶段指标。"""
+
+    def __init__(self):
+        self.stages: Dict[str, StageMetrics] = {}
+
+    def stage(self, name: str) -> StageMetrics:
+        if name not in self.stages:
+            self.stages[name] = StageMetrics(name)
+        return self.stages[name]
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [metrics.to_dict() for metrics in self.stages.values()]
+
+
+pipeline_metrics = PipelineMetrics()
+
+
+class PipelineStage:
+    """
+    流水线中的一个阶段。
+
+    handler 接收作业对象；如果作业在该阶段已经结束（例如保存失败），
+    handler 应把作业的 finished 属性设为 True，后续阶段将被跳过。
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], Awaitable[None]], concurrency: int):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+
+
+class StagedPipeline:
+    """按阶段调度作业的异步流水线，每个阶段有自己的工作协程池。"""
+
+    def __init__(
+        self,
+        stages: List[PipelineStage],
+        max_in_flight: int,
+        on_error: Callable[[Any, Exception], None],
+        metrics: PipelineMetrics = pipeline_metrics,
+        admission: Optional[Any] = None,
+    ):
+        """
+        Args:
+            admission: 作业进入流水线前的准入控制（有 acquire/release 方法），
+                例如多个批次共享名额的公平调度器；默认每次运行使用 max_in_flight 个名额的信号量。
+        """
+        self.stages = stages
+        self.max_in_flight = max(1, max_in_flight)
+        self.on_error = on_error
+        self.metrics = metrics
+        self.admission = admission
+
+    async def run(
+        self,
+        jobs: List[Any],
+        on_admit: Optional[Callable[[Any], None]] = None,
+        on_complete: Optional[Callable[[Any], None]] = None,
+    ) -> None:
+        """
+        运行所有作业直到全部完成。
+
+        Args:
+            jobs: 作业列表，每个作业需要有 finished 属性。
+            on_admit: 作业进入流水线时的回调。
+            on_complete: 作业完成（成功、失败或提前结束）时的回调。
+        """
+        if not jobs:
+            return
+
+        queues: List[asyncio.Queue] = [asyncio.Queue() for _ in self.stages]
+        admission = self.admission or asyncio.Semaphore(self.max_in_flight)
+        all_done = asyncio.Event()
+        remaining = len(jobs)
+        in_flight = 0
+
+        def enqueue(stage_index: int, job: Any) -> None:
+            self.metrics.stage(self.stages[stage_index].name).queued += 1
+            queues[stage_index].put_nowait(job)
+
+        def finish(job: Any) -> None:
+            nonlocal remaining, in_flight
+            admission.release()
+            in_flight -= 1
+            remaining -= 1
+            if on_complete:
+                on_complete(job)
+            if remaining == 0:
+                all_done.set()
+
+        async def worker(stage_index: int) -> None:
+            stage = self.stages[stage_index]
+            metrics = self.metrics.stage(stage.name)
+            while True:
+                job = await queues[stage_index].get()
+                metrics.queued -= 1
+                metrics.active += 1
+                started = time.monotonic()
+                try:
+                    await stage.handler(job)
+                    metrics.processed += 1
+                except Exception as exc:
+                    metrics.failed += 1
+                    self.on_error(job, exc)
+                    job.finished = True
+                finally:
+                    metrics.active -= 1
+                    metrics.busy_seconds += time.monotonic() - started
+
+                if job.finished or stage_index == len(self.stages) - 1:
+                    finish(job)
+                else:
+                    enqueue(stage_index + 1, job)
+
+        async def feeder() -> None:
+            nonlocal in_flight
+            for job in jobs:
+                await admission.acquire()
+                in_flight += 1
+                if on_admit:
+                    on_admit(job)
+                enqueue(0, job)
+
+        workers = [
+            asyncio.create_task(worker(index))
+            for index, stage in enumerate(self.stages)
+            for _ in range(stage.concurrency)
+        ]
+        workers.append(asyncio.create_task(feeder()))
+        try:
+            await all_done.wait()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # 被取消时交还仍在流水线中的作业占用的名额（共享的准入控制不会随本次运行释放）
+            for _ in range(in_flight):
+                admission.release()
+            # 被取消时清理尚未处理的排队计数，避免指标失真
+            for stage, queue in zip(self.stages, queues):
+                self.metrics.stage(stage.name).queued -= queue.qsize()
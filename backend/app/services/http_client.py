@@ -0,0 +1,60 @@
+"""
+LLM 接口共享的 HTTP 客户端。
+
+应用生命周期内复用同一个 httpx.AsyncClient，保持长连接，
+避免每次调用都重新进行 TCP 和 TLS 握手。
+"""
+import importlib.util
+import logging
+from typing import Optional
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LLMHttpClient:
+    """在 lifespan 中打开和关闭的长连接客户端池。"""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _create_client(self) -> httpx.AsyncClient:
+        http2 = settings.llm_http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("未安装 h2，无法启用 HTTP/2，将使用 HTTP/1.1（pip install httpx[http2]）")
+            http2 = False
+
+        limits = httpx.Limits(
+            max_connections=settings.llm_http_max_connections,
+            max_keepalive_connections=settings.llm_http_max_keepalive,
+            keepalive_expiry=settings.llm_http_keepalive_seconds,
+        )
+        logger.info(
+            "LLM HTTP 客户端已创建 (http2=%s, max_connections=%s)",
+            http2,
+            settings.llm_http_max_connections,
+        )
+        return httpx.AsyncClient(timeout=180.0, limits=limits, http2=http2)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """返回共享客户端；未在 lifespan 中打开时（如脚本中调用）按需创建。"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+
+    async def open(self) -> None:
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+
+    async def close(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("LLM HTTP 客户端已关闭")
+        self._client = None
+
+
+llm_http_client = LLMHttpClient()
@@ -0,0 +1,111 @@
+"""
+作文图片预处理。
+
+手机拍摄的作文照片通常有 4-12 MB，直接 base64 上传会让请求体和视觉 token 都很大。
+上传前先按 EXIF 方向旋正、缩放到指定长边、必要时转为灰度，再按目标质量重新编码为 JPEG。
+图片处理在进程池中执行，不占用事件循环。
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import ExifTags, Image, ImageOps, ImageStat
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# HSV 饱和度均值低于该值时视为黑白文稿，转为灰度
+GRAYSCALE_SATURATION_THRESHOLD = 24
+
+
+def preprocess_image(image_bytes: bytes, max_long_edge: int, quality: int) -> bytes:
+    """
+    在子进程中执行的图片处理函数。
+
+    如果处理后反而比原图大（例如原图本来就很小），返回原图；
+    但 EXIF 方向需要旋转的图片总是返回处理后的结果，否则模型看到的是未旋正的原图。
+    """
+    with Image.open(BytesIO(image_bytes)) as original:
+        rotated = original.getexif().get(ExifTags.Base.Orientation, 1) not in (0, 1)
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        if max(image.size) > max_long_edge:
+            image.thumbnail((max_long_edge, max_long_edge), Image.Resampling.LANCZOS)
+
+        if image.mode == "RGB":
+            saturation = ImageStat.Stat(image.convert("HSV").getchannel("S")).mean[0]
+            if saturation < GRAYSCALE_SATURATION_THRESHOLD:
+                image = image.convert("L")
+
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+
+    processed = output.getvalue()
+    if rotated or len(processed) < len(image_bytes):
+        return processed
+    return image_bytes
+
+
+class ImagePreprocessor:
+    """管理图片预处理进程池。"""
+
+    def __init__(self):
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Optional[Executor]:
+        if settings.image_preprocess_workers <= 0:
+            # 为 0 时使用默认线程池（例如打包后的 Windows 单进程模式）
+            return None
+        if self._executor is None:
+            # 使用 spawn：事件循环、数据库连接等线程已启动后再 fork 子进程不安全
+            self._executor = ProcessPoolExecutor(
+                max_workers=settings.image_preprocess_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def prepare(
+        self,
+        image_bytes: bytes,
+        max_long_edge: Optional[int] = None,
+    ) -> Tuple[bytes, Dict[str, Any]]:
+        """
+        预处理一张图片。
+
+        Returns:
+            Tuple[bytes, Dict]: 处理后的图片数据，以及处理前后的字节数。
+        """
+        stats = {"original_bytes": len(image_bytes), "processed_bytes": len(image_bytes)}
+        if not settings.image_preprocess_enabled or not image_bytes:
+            return image_bytes, stats
+
+        loop = asyncio.get_running_loop()
+        try:
+            processed = await loop.run_in_executor(
+                self._get_executor(),
+                preprocess_image,
+                image_bytes,
+                max_long_edge or settings.image_max_long_edge,
+                settings.image_jpeg_quality,
+            )
+        except Exception as exc:
+            # 无法解析的图片按原样上传，由模型自行处理
+            logger.warning("图片预处理失败，使用原图: %s", exc)
+            return image_bytes, stats
+
+        stats["processed_bytes"] = len(processed)
+        return processed, stats
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_preprocessor = ImagePreprocessor()
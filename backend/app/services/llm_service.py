@@ -1,19 +1,54 @@
+import asyncio
 import base64
 import json
 import logging
 import re
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
-import httpx
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 from app.config import settings
+from app.services.http_client import llm_http_client
+from app.services.rate_limiter import llm_rate_limiter, parse_retry_after
+from app.services.result_cache import result_cache
 from app.services.teacher_config import teacher_config_service
 
 logging.basicConfig(level=settings.log_level)
 logger = logging.getLogger(__name__)
 
 
+# 低分辨率识别结果的本地检查阈值
+MIN_RECOGNIZED_CHARS = 40
+MAX_GARBAGE_RATIO = 0.1
+NAME_LINE_PATTERN = re.compile(r"(姓\s*名|名\s*字|name)\s*[:：]", re.IGNORECASE)
+# 中日韩文字、ASCII 可打印字符、空白和常见中文标点之外的字符视为乱码
+NORMAL_CHAR_PATTERN = re.compile(r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef\x20-\x7e\s“”‘’—…·]")
+
+# 分级识别统计：低分辨率结果直接采用的次数和重发原图的次数
+recognition_stats = {"preview_accepted": 0, "full_resolution_retries": 0}
+
+
+def garbage_ratio(text: str) -> float:
+    """识别文本中乱码字符（包括 � □ 等占位符）所占比例。"""
+    if not text:
+        return 1.0
+    garbage = sum(
+        1 for char in text
+        if char in "�□■" or not NORMAL_CHAR_PATTERN.match(char)
+    )
+    return garbage / len(text)
+
+
+def has_name_line(text: str) -> bool:
+    return bool(NAME_LINE_PATTERN.search(text[:300]))
+
+
+# 限流时单张图片按此估算 token 数
+IMAGE_TOKEN_ESTIMATE = 1500
+
+# 修改 GRADING_PROMPT_TEMPLATE 时同步更新版本号，旧的批改缓存随之失效
+GRADING_PROMPT_VERSION = "2"
+
 GRADING_PROMPT_TEMPLATE = """
 你是一名专业的作文批改老师，能够同时批改中文作文和英文作文。
 在批改前，请先自动判断作文语言类型：
@@ -73,6 +108,19 @@ NAME_EXTRACTION_PROMPT_TEMPLATE = """
 """
 
 
+ESSAY_RECOGNITION_PROMPT = """
+请识别这张学生作文图片，同时提取学生姓名和班级。
+姓名通常在开头、结尾、姓名/班级标签旁，或单独成行。
+
+请严格返回纯 JSON，不要添加 Markdown 或解释文字。字段如下：
+{
+  "student_name": "学生姓名，无法判断时返回空字符串",
+  "class_name": "班级，无法判断时返回空字符串",
+  "essay_text": "作文全文，尽量保留原文、换行、学生姓名和班级"
+}
+"""
+
+
 OVERALL_ANALYSIS_PROMPT_TEMPLATE = """
 你是一名英语教研组长。请根据本次批量批阅结果，分析全班/本批学生总体写作情况。
 
@@ -97,6 +145,58 @@ OVERALL_ANALYSIS_PROMPT_TEMPLATE = """
 """
 
 
+CHUNK_ANALYSIS_PROMPT_TEMPLATE = """
+你是一名英语教研组长。下面是一批学生中一部分学生的批阅结果，请先归纳这部分学生的写作情况，
+稍后会与其他部分的归纳合并成全班分析。
+
+这部分学生的批阅结果 JSON：
+{chunk_json}
+
+请严格返回纯 JSON，不要添加 Markdown 或解释文字。字段如下：
+{{
+  "student_count": 学生人数,
+  "score_summary": "这部分学生的分数概况，包括最高分、最低分和大致分布。",
+  "common_strengths": ["共性优点1", "共性优点2"],
+  "common_issues": ["共性问题1", "共性问题2"],
+  "students_needing_attention": [{{"student": "学生A", "reason": "分数较低或问题集中"}}],
+  "outstanding_students": ["学生B"]
+}}
+"""
+
+
+OVERALL_ANALYSIS_REDUCE_PROMPT_TEMPLATE = """
+你是一名英语教研组长。本批作文较多，已经按每组若干名学生分别归纳，请把各组归纳合并成全班/本批学生总体写作情况。
+合并时请去除重复的优点和问题，按出现的普遍程度排序。
+
+本批统计：
+{summary_json}
+
+各组归纳 JSON：
+{chunks_json}
+
+请严格返回纯 JSON，不要添加 Markdown 或解释文字。字段如下：
+{{
+  "overview": "一句话概括本批作文整体水平。",
+  "score_distribution": "概括分数分布、平均分、最高/最低区间。",
+  "common_strengths": ["共性优点1", "共性优点2"],
+  "common_issues": ["共性问题1", "共性问题2"],
+  "teaching_focus": ["下一节课建议重点1", "下一节课建议重点2"],
+  "student_groups": [
+    {{
+      "group": "需要重点关注",
+      "students": ["学生A"],
+      "reason": "分数较低或问题集中"
+    }}
+  ]
+}}
+"""
+
+# 修改总体分析相关提示词时同步更新版本号，旧的分组归纳缓存随之失效
+ANALYSIS_PROMPT_VERSION = "1"
+# 每组学生归纳最多尝试的次数，仍然失败的组不参与合并
+ANALYSIS_CHUNK_ATTEMPTS = 3
+
+
 class LLMService:
     def __init__(self):
         self.api_url = "https://ark.cn-beijing.volces.com/api/v3/chat/completions"
@@ -115,6 +215,24 @@ class LLMService:
             "Content-Type": "application/json",
         }
 
+    @staticmethod
+    def _accept_preview(text: str, missing_name: bool) -> bool:
+        """检查低分辨率识别结果，不可靠时记录原因并返回 False。"""
+        reason = None
+        if len(text.strip()) < MIN_RECOGNIZED_CHARS:
+            reason = "识别文本过短"
+        elif garbage_ratio(text) > MAX_GARBAGE_RATIO:
+            reason = "乱码字符比例过高"
+        elif missing_name:
+            reason = "未找到姓名行"
+
+        if reason:
+            recognition_stats["full_resolution_retries"] += 1
+            logger.info("低分辨率识别结果不可靠（%s），改用原图重新识别", reason)
+            return False
+        recognition_stats["preview_accepted"] += 1
+        return True
+
     @staticmethod
     def _detect_mime(image_bytes: bytes) -> str:
         if image_bytes.startswith(b"\x89PNG"):
@@ -155,6 +273,21 @@ class LLMService:
             raise ValueError("suggestions 字段必须是列表")
         return result
 
+    def _estimate_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        """粗略估算一次调用的 token 数，用于限流；实际用量在响应后修正。"""
+        tokens = self.max_tokens // 4
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, str):
+                tokens += len(content)
+                continue
+            for part in content or []:
+                if part.get("type") == "text":
+                    tokens += len(part.get("text", ""))
+                else:
+                    tokens += IMAGE_TOKEN_ESTIMATE
+        return tokens
+
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=8), reraise=True)
     async def _call_messages(self, messages: List[Dict[str, Any]], *, temperature: float | None = None) -> str:
         config = self._runtime_config()
@@ -166,30 +299,33 @@ class LLMService:
         }
 
         logger.info("正在调用豆包模型: %s", config["model_id"])
-        async with httpx.AsyncClient(timeout=180.0) as client:
-            response = await client.post(
+        estimated_tokens = self._estimate_tokens(messages)
+        actual_tokens = None
+        sent_at = await llm_rate_limiter.acquire(estimated_tokens)
+        try:
+            response = await llm_http_client.client.post(
                 self.api_url,
                 headers=self._headers(config["api_key"]),
                 json=payload,
             )
+            if response.status_code == 429:
+                llm_rate_limiter.record_throttle(
+                    parse_retry_after(response.headers.get("Retry-After")), sent_at
+                )
             response.raise_for_status()
+            response_data = response.json()
+            actual_tokens = (response_data.get("usage") or {}).get("total_tokens")
+            llm_rate_limiter.record_success()
+        finally:
+            llm_rate_limiter.release(estimated_tokens, actual_tokens)
 
-        response_data = response.json()
         content = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
         if not content:
             raise ValueError("LLM API 返回内容为空")
         return content
 
-    async def recognize_image_text(self, image_bytes: bytes, purpose: str) -> str:
-        if not image_bytes:
-            raise ValueError("输入的图片数据不能为空")
-
-        prompt = (
-            f"请识别这张图片中的{purpose}。"
-            "要求尽量保留原文、换行、学生姓名、班级和题目要求。"
-            "只返回识别出的文本，不要添加解释。"
-        )
-        messages = [
+    def _vision_messages(self, prompt: str, image_bytes: bytes) -> List[Dict[str, Any]]:
+        return [
             {"role": "system", "content": "你是一个高准确率的图片文字识别助手。"},
             {
                 "role": "user",
@@ -199,9 +335,139 @@ class LLMService:
                 ],
             },
         ]
-        text = await self._call_messages(messages, temperature=0.0)
+
+    async def _recognize_text_once(self, image_bytes: bytes, purpose: str) -> str:
+        prompt = (
+            f"请识别这张图片中的{purpose}。"
+            "要求尽量保留原文、换行、学生姓名、班级和题目要求。"
+            "只返回识别出的文本，不要添加解释。"
+        )
+        text = await self._call_messages(self._vision_messages(prompt, image_bytes), temperature=0.0)
         return text.strip()
 
+    async def recognize_image_text(
+        self,
+        image_bytes: bytes,
+        purpose: str,
+        preview_bytes: Optional[bytes] = None,
+        expect_name: bool = False,
+    ) -> str:
+        """
+        识别图片中的文字。
+
+        提供 preview_bytes（低分辨率版本）时先识别低分辨率图片，
+        本地检查不通过才重新发送原图。
+        """
+        if not image_bytes:
+            raise ValueError("输入的图片数据不能为空")
+
+        cache_key = result_cache.make_key(image_bytes, purpose, self._runtime_config()["model_id"])
+        cached = await result_cache.get_async("ocr", cache_key)
+        if cached is not None:
+            logger.info("图片识别命中缓存: %s", purpose)
+            return cached
+
+        text = ""
+        if preview_bytes:
+            text = await self._recognize_text_once(preview_bytes, purpose)
+            if not self._accept_preview(text, expect_name and not has_name_line(text)):
+                text = ""
+        if not text:
+            text = await self._recognize_text_once(image_bytes, purpose)
+
+        if text:
+            await result_cache.set_async("ocr", cache_key, text)
+        return text
+
+    async def recognize_requirements(self, image_bytes: bytes) -> str:
+        """
+        识别作文要求图片。
+
+        同一张题目图片常被多个班级重复使用，识别结果只按图片哈希缓存，
+        切换模型后也可以继续复用。
+        """
+        if not image_bytes:
+            raise ValueError("输入的图片数据不能为空")
+
+        cache_key = result_cache.make_key(image_bytes)
+        cached = await result_cache.get_async("requirements", cache_key)
+        if cached is not None:
+            logger.info("作文要求识别命中缓存")
+            return cached
+
+        requirements = await self.recognize_image_text(image_bytes, "作文题目和写作要求")
+        if requirements:
+            await result_cache.set_async("requirements", cache_key, requirements)
+        return requirements
+
+    async def _recognize_essay_once(self, image_bytes: bytes) -> Dict[str, Any]:
+        response_text = await self._call_messages(
+            self._vision_messages(ESSAY_RECOGNITION_PROMPT, image_bytes),
+            temperature=0.0,
+        )
+        try:
+            data = json.loads(self._extract_json_from_response(response_text), strict=False)
+            essay_text = str(data.get("essay_text") or "").strip()
+            if not essay_text:
+                raise ValueError("essay_text 为空")
+        except Exception as exc:
+            logger.warning("合并识别结果解析失败，改用单独识别: %s", exc)
+            return {
+                "student_name": None,
+                "class_name": None,
+                "essay_text": await self.recognize_image_text(image_bytes, "学生作文全文", expect_name=True),
+            }
+
+        # 没有识别出姓名时返回 None，由调用方继续用本地规则或 LLM 提取
+        student_name = str(data.get("student_name") or "").strip()
+        if student_name == "未知学生":
+            student_name = ""
+        return {
+            "student_name": student_name or None,
+            "class_name": str(data.get("class_name") or "").strip() or None,
+            "essay_text": essay_text,
+        }
+
+    async def recognize_essay(self, image_bytes: bytes, preview_bytes: Optional[bytes] = None) -> Dict[str, Any]:
+        """
+        一次视觉调用同时识别作文全文、学生姓名和班级。
+
+        模型没有识别出姓名，或返回的 JSON 无法解析而退回到单独的文字识别调用时，
+        student_name 为 None，表示需要调用方再单独提取姓名。
+        提供 preview_bytes 时先识别低分辨率图片，检查不通过再发送原图。
+
+        Returns:
+            Dict: 包含 student_name、class_name、essay_text 的字典。
+        """
+        if not image_bytes:
+            raise ValueError("输入的图片数据不能为空")
+
+        cache_key = result_cache.make_key(image_bytes, ESSAY_RECOGNITION_PROMPT, self._runtime_config()["model_id"])
+        cached = await result_cache.get_async("ocr", cache_key)
+        if cached is not None:
+            logger.info("作文识别命中缓存")
+            recognized = json.loads(cached)
+            if recognized.get("student_name") == "未知学生":
+                # 早期缓存的结果用 "未知学生" 表示没有识别出姓名
+                recognized["student_name"] = None
+            return recognized
+
+        recognized = None
+        if preview_bytes:
+            recognized = await self._recognize_essay_once(preview_bytes)
+            missing_name = (
+                recognized["student_name"] is None
+                and not has_name_line(recognized["essay_text"])
+            )
+            if not self._accept_preview(recognized["essay_text"], missing_name):
+                recognized = None
+        if recognized is None:
+            recognized = await self._recognize_essay_once(image_bytes)
+
+        if recognized["essay_text"]:
+            await result_cache.set_async("ocr", cache_key, json.dumps(recognized, ensure_ascii=False))
+        return recognized
+
     async def extract_student_name(self, essay_text: str) -> str:
         prompt = NAME_EXTRACTION_PROMPT_TEMPLATE.format(essay_text=essay_text)
         name = await self._call_messages(
@@ -214,7 +480,34 @@ class LLMService:
         cleaned_name = name.strip().replace("姓名：", "").replace("姓名:", "").strip()
         return cleaned_name or "未知学生"
 
-    async def grade_essay(self, requirements: str, essay_text: str) -> Dict[str, Any]:
+    async def grade_essay(
+        self,
+        requirements: str,
+        essay_text: str,
+        force_regrade: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        批改作文。
+
+        相同的作文要求、作文文本、模型和提示词版本会直接复用缓存的批改结果；
+        force_regrade 为 True 时跳过缓存重新批改，并用新结果覆盖缓存。
+        """
+        cache_key = result_cache.make_key(
+            requirements,
+            essay_text,
+            self._runtime_config()["model_id"],
+            GRADING_PROMPT_VERSION,
+        )
+        if not force_regrade:
+            cached = await result_cache.get_async(
+                "grading",
+                cache_key,
+                ttl_seconds=settings.grading_cache_ttl_hours * 3600,
+            )
+            if cached is not None:
+                logger.info("批改结果命中缓存")
+                return json.loads(cached)
+
         prompt = GRADING_PROMPT_TEMPLATE.format(
             essay_requirements=requirements,
             essay_text=essay_text,
@@ -228,12 +521,16 @@ class LLMService:
 
         try:
             result = json.loads(self._extract_json_from_response(response_text))
-            return self._normalize_grading_result(result)
+            result = self._normalize_grading_result(result)
         except Exception as exc:
             logger.error("LLM 原始批阅响应: %s", response_text)
             raise ValueError(f"LLM 返回的批阅结果格式不正确: {exc}") from exc
 
-    async def analyze_batch(self, summary: Dict[str, Any], details: List[Dict[str, Any]]) -> Dict[str, Any]:
+        await result_cache.set_async("grading", cache_key, json.dumps(result, ensure_ascii=False))
+        return result
+
+    @staticmethod
+    def _compact_details(details: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         compact_details = []
         for item in details:
             grading = item.get("grading_result") or {}
@@ -246,6 +543,113 @@ class LLMService:
                 "disadvantages": grading.get("disadvantages"),
                 "summary_comment": grading.get("summary_comment"),
             })
+        return compact_details
+
+    async def _analysis_json(self, namespace: str, prompt: str) -> Dict[str, Any]:
+        """调用模型生成一段分析 JSON；解析成功的结果按提示词内容缓存。"""
+        cache_key = result_cache.make_key(prompt, self._runtime_config()["model_id"], ANALYSIS_PROMPT_VERSION)
+        cached = await result_cache.get_async(namespace, cache_key)
+        if cached is not None:
+            logger.info("总体分析结果命中缓存 (%s)", namespace)
+            return json.loads(cached)
+
+        response_text = await self._call_messages(
+            [
+                {"role": "system", "content": "你是英语教研组长，严格返回 JSON。"},
+                {"role": "user", "content": prompt},
+            ]
+        )
+        try:
+            result = json.loads(self._extract_json_from_response(response_text))
+        except Exception:
+            logger.error("LLM 原始总体分析响应: %s", response_text)
+            raise
+        await result_cache.set_async(namespace, cache_key, json.dumps(result, ensure_ascii=False))
+        return result
+
+    async def _analyze_batch_chunked(
+        self,
+        summary: Dict[str, Any],
+        compact_details: List[Dict[str, Any]],
+        chunk_size: int,
+    ) -> Dict[str, Any]:
+        """
+        分组归纳后再合并（map-reduce）。
+
+        每组的归纳单独缓存，失败的组最多尝试 ANALYSIS_CHUNK_ATTEMPTS 次；仍然失败的组不参与合并，
+        总体分析中注明未包含的学生。所有组都失败时抛出异常。
+        """
+        chunks = [
+            compact_details[start:start + chunk_size]
+            for start in range(0, len(compact_details), chunk_size)
+        ]
+        semaphore = asyncio.Semaphore(max(1, settings.text_concurrency))
+
+        async def summarize(chunk: List[Dict[str, Any]]) -> Dict[str, Any]:
+            # 保存状态与归纳内容无关，不放进提示词，避免影响缓存命中
+            chunk = [{k: v for k, v in item.items() if k != "saved_to_db"} for item in chunk]
+            prompt = CHUNK_ANALYSIS_PROMPT_TEMPLATE.format(
+                chunk_json=json.dumps(chunk, ensure_ascii=False)
+            )
+            async with semaphore:
+                return await self._analysis_json("analysis_chunk", prompt)
+
+        logger.info("作文较多，分 %s 组归纳后合并总体分析", len(chunks))
+        results: Dict[int, Any] = {}
+        pending = list(range(len(chunks)))
+        for attempt in range(1, ANALYSIS_CHUNK_ATTEMPTS + 1):
+            # 已成功的组不再重新请求，失败的组重新归纳
+            outcomes = await asyncio.gather(
+                *(summarize(chunks[index]) for index in pending),
+                return_exceptions=True,
+            )
+            for index, outcome in zip(pending, outcomes):
+                results[index] = outcome
+            pending = [index for index in pending if isinstance(results[index], BaseException)]
+            if not pending:
+                break
+            logger.warning(
+                "第 %s 次归纳有 %s/%s 组失败: %s",
+                attempt,
+                len(pending),
+                len(chunks),
+                results[pending[0]],
+            )
+
+        succeeded = [results[index] for index in range(len(chunks)) if index not in pending]
+        if not succeeded:
+            raise RuntimeError(f"{len(chunks)} 组学生归纳全部失败: {results[pending[0]]}")
+
+        prompt = OVERALL_ANALYSIS_REDUCE_PROMPT_TEMPLATE.format(
+            summary_json=json.dumps(summary, ensure_ascii=False),
+            chunks_json=json.dumps(succeeded, ensure_ascii=False),
+        )
+        analysis = await self._analysis_json("analysis", prompt)
+        if pending:
+            # 返回副本，不修改缓存中的合并结果
+            missing = [item.get("student_name") or "未知学生" for index in pending for item in chunks[index]]
+            analysis = {
+                **analysis,
+                "overview": (
+                    f"{analysis.get('overview') or ''}\n"
+                    f"（{len(pending)}/{len(chunks)} 组学生的归纳生成失败，本分析未包含以下 {len(missing)} 名学生："
+                    f"{'、'.join(missing)}）"
+                ).strip(),
+                "missing_students": missing,
+            }
+        return analysis
+
+    async def analyze_batch(self, summary: Dict[str, Any], details: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        生成本批作文的总体分析。
+
+        学生数超过 analysis_chunk_size 时先按固定人数分组并发归纳，再合并各组归纳，
+        避免单个提示词过长导致超时或超出 max_tokens。
+        """
+        compact_details = self._compact_details(details)
+        chunk_size = settings.analysis_chunk_size
+        if chunk_size > 0 and len(compact_details) > chunk_size:
+            return await self._analyze_batch_chunked(summary, compact_details, chunk_size)
 
         prompt = OVERALL_ANALYSIS_PROMPT_TEMPLATE.format(
             batch_json=json.dumps(
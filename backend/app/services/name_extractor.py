@@ -0,0 +1,132 @@
+"""
+本地学生姓名提取
+
+多数作文在开头有“姓名：”或“Name:”一行，直接用正则读取并与学生名单核对即可，
+不必把整篇作文发给大模型。只有本地规则无法确定时才调用 LLM 提取姓名。
+
+没有姓名行时会在开头几行中查找名单里的姓名，这种结果只作为候选，再由 LLM 提取姓名核对，
+两者不一致时交给老师确认。
+"""
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Pattern
+
+from app.config import settings
+
+from .roster_index import RosterIndex
+
+logger = logging.getLogger(__name__)
+
+# 只在作文开头查找姓名
+HEADER_CHARS = 300
+HEADER_LINES = 5
+# “姓名：张三  班级：1班” 中冒号之后、下一个字段或分隔符之前的部分
+NAME_VALUE_PATTERN = re.compile(
+    r"(?:姓\s*名|名\s*字|name)\s*[:：]\s*(.+?)\s*"
+    r"(?=$|[\n,，;；|/（(]|\s{2,}|\s*(?:班\s*级|学\s*号|座\s*号|日\s*期|class|no\.?|date)\s*[:：])",
+    re.IGNORECASE | re.MULTILINE,
+)
+# 没有名单可核对时，只接受看起来像姓名的内容
+CHINESE_NAME_PATTERN = re.compile(r"^[\u4e00-\u9fff·]{2,5}$")
+ENGLISH_NAME_PATTERN = re.compile(r"^[A-Za-z][A-Za-z .'\-]{1,39}$")
+
+# 名单扫描时中文姓名两侧必须是分隔符或行首行尾，避免“王明天说”匹配到“王明”
+SCAN_DELIMITERS = r"\s,，.。;；:：、|/\\()（）\[\]【】<>《》\"'“”‘’!！?？\-—_"
+
+# 各种方式确定姓名的次数：合并识别直接给出、正则读取、名单扫描、调用 LLM 提取
+name_extraction_stats = {"recognized": 0, "regex": 0, "roster_scan": 0, "llm_fallback": 0}
+
+
+def record_name_source(source: str) -> None:
+    name_extraction_stats[source] = name_extraction_stats.get(source, 0) + 1
+
+
+def _plain_name(value: str) -> Optional[str]:
+    """看起来像姓名时返回姓名（去掉中文姓名中间的空格），否则返回 None。"""
+    compact = re.sub(r"\s+", "", value)
+    if CHINESE_NAME_PATTERN.match(compact):
+        return compact
+    if ENGLISH_NAME_PATTERN.match(value):
+        return value
+    return None
+
+
+@dataclass
+class LocalName:
+    name: str
+    # False 表示只是在作文开头找到了名单中的姓名，还需要与 LLM 提取的姓名核对
+    confirmed: bool
+
+
+@lru_cache(maxsize=4096)
+def _scan_pattern(username: str) -> Optional[Pattern]:
+    """姓名在作文中独立出现时才匹配：英文按单词边界，中文要求两侧是分隔符或行首行尾。"""
+    name = unicodedata.normalize("NFKC", username).strip()
+    if not name:
+        return None
+    if re.search(r"[\u4e00-\u9fff]", name):
+        # 识别结果中姓名的字之间可能有空格
+        body = r"\s*".join(re.escape(char) for char in name if not char.isspace())
+        return re.compile(rf"(?<![^{SCAN_DELIMITERS}]){body}(?![^{SCAN_DELIMITERS}])")
+    body = r"\s+".join(re.escape(word) for word in name.split())
+    return re.compile(rf"(?<![A-Za-z0-9]){body}(?![A-Za-z0-9])", re.IGNORECASE)
+
+
+def _scan_header(header: str, roster: RosterIndex) -> Optional[str]:
+    """没有姓名行时，在开头几行中查找独立出现的名单姓名；恰好找到一个才采用。"""
+    text = unicodedata.normalize("NFKC", header)
+    found = set()
+    for entry in roster.entries:
+        if len(entry.key) < 2:
+            continue
+        pattern = _scan_pattern(entry.username)
+        if pattern is not None and pattern.search(text):
+            found.add(entry.username)
+    if len(found) == 1:
+        return found.pop()
+    return None
+
+
+def extract_name_locally(essay_text: str, roster: Optional[RosterIndex] = None) -> Optional[LocalName]:
+    """
+    用本地规则提取学生姓名
+
+    Args:
+        essay_text: 识别出的作文全文
+        roster: 本批次的学生名单
+
+    Returns:
+        Optional[LocalName]: 找到时返回姓名（有名单时为名单中的用户名）以及是否无需确认，
+        无法确定时返回 None
+    """
+    if not settings.local_name_extraction or not essay_text:
+        return None
+
+    header = "\n".join(essay_text[:HEADER_CHARS].splitlines()[:HEADER_LINES])
+    has_roster = roster is not None and bool(roster.entries)
+
+    value_match = NAME_VALUE_PATTERN.search(header)
+    if value_match:
+        value = value_match.group(1).strip()
+        if has_roster:
+            match = roster.best(value)
+            if match and match.confidence >= settings.roster_match_threshold:
+                record_name_source("regex")
+                return LocalName(match.username, confirmed=True)
+        else:
+            name = _plain_name(value)
+            if name:
+                record_name_source("regex")
+                return LocalName(name, confirmed=True)
+        logger.info("姓名行内容 %r 无法与学生名单对应", value)
+        return None
+
+    if has_roster:
+        name = _scan_header(header, roster)
+        if name:
+            record_name_source("roster_scan")
+            return LocalName(name, confirmed=False)
+    return None
@@ -0,0 +1,183 @@
+"""
+LLM 调用的自适应限流器。
+
+按每分钟请求数和每分钟 token 数两个令牌桶限流，并发上限按 AIMD 调整：
+每次成功缓慢增加，遇到 429 限流时减半，同时遵守服务端返回的 Retry-After。
+同一批并发请求一起收到的 429 只减半一次：在上次减半之前发出的请求再被限流不再减半。
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），返回需要等待的秒数。"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """所有 LLM 调用共享的令牌桶限流器，带 AIMD 并发控制。"""
+
+    def __init__(
+        self,
+        requests_per_minute: int = settings.llm_requests_per_minute,
+        tokens_per_minute: int = settings.llm_tokens_per_minute,
+        max_concurrency: int = settings.llm_max_concurrency,
+        min_concurrency: int = 1,
+    ):
+        self.requests_per_minute = max(1, requests_per_minute)
+        self.tokens_per_minute = max(1, tokens_per_minute)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+
+        self._request_allowance = float(self.requests_per_minute)
+        self._token_allowance = float(self.tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._concurrency_limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._last_decrease: Optional[float] = None
+        self._last_pause = 0.0
+        self._throttled = 0
+        self._lock: Optional[asyncio.Lock] = None
+        self._released: Optional[asyncio.Event] = None
+        # 最近一分钟的 (时间, token 数)，用于报告当前速率
+        self._recent: Deque[Tuple[float, int]] = deque()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_allowance = min(
+            float(self.requests_per_minute),
+            self._request_allowance + elapsed * self.requests_per_minute / 60,
+        )
+        self._token_allowance = min(
+            float(self.tokens_per_minute),
+            self._token_allowance + elapsed * self.tokens_per_minute / 60,
+        )
+
+    def _prune_recent(self, now: float) -> None:
+        """丢弃一分钟以前的记录，使 _recent 的长度不超过每分钟的请求数。"""
+        while self._recent and now - self._recent[0][0] > 60:
+            self._recent.popleft()
+
+    def _wait_seconds(self, tokens: int) -> float:
+        """返回还需等待的秒数，0 表示可以立即发出请求。"""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._in_flight >= int(self._concurrency_limit):
+            return -1.0
+        if self._request_allowance < 1:
+            return (1 - self._request_allowance) * 60 / self.requests_per_minute
+        needed = min(tokens, self.tokens_per_minute)
+        if self._token_allowance < needed:
+            return (needed - self._token_allowance) * 60 / self.tokens_per_minute
+        return 0.0
+
+    async def acquire(self, tokens: int) -> float:
+        """等待直到可以发出一个预计消耗 tokens 个 token 的请求，返回发出时间（供 record_throttle 使用）。"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._released = asyncio.Event()
+
+        # 排队者按先后顺序获得名额
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._wait_seconds(tokens)
+                if wait == 0:
+                    break
+                if wait < 0:
+                    # 并发已满，等待某个请求结束
+                    self._released.clear()
+                    try:
+                        await asyncio.wait_for(self._released.wait(), timeout=1.0)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(min(wait, 1.0))
+
+            self._request_allowance -= 1
+            self._token_allowance -= min(tokens, self.tokens_per_minute)
+            self._in_flight += 1
+            now = time.monotonic()
+            self._prune_recent(now)
+            self._recent.append((now, tokens))
+            return now
+
+    def release(self, estimated_tokens: int = 0, actual_tokens: Optional[int] = None) -> None:
+        """请求结束时调用；提供实际 token 用量时修正令牌桶。"""
+        self._in_flight = max(0, self._in_flight - 1)
+        if actual_tokens is not None:
+            self._token_allowance -= actual_tokens - estimated_tokens
+        if self._released is not None:
+            self._released.set()
+
+    def record_success(self) -> None:
+        # 加性增：大约每成功一个并发窗口的请求，并发上限加 1
+        self._concurrency_limit = min(
+            float(self.max_concurrency),
+            self._concurrency_limit + 1 / max(self._concurrency_limit, 1.0),
+        )
+
+    def record_throttle(self, retry_after: Optional[float] = None, sent_at: Optional[float] = None) -> None:
+        """
+        收到 429 时调用：并发上限减半，并在 Retry-After 期间暂停发出新请求。
+
+        sent_at 为该请求由 acquire 返回的发出时间。上次减半之前发出的请求属于同一个窗口，
+        只延长暂停，不再减半；未提供 sent_at 时，距上次减半不足一个暂停周期也不再减半。
+        """
+        self._throttled += 1
+        now = time.monotonic()
+        pause = retry_after if retry_after is not None else 60 / self.requests_per_minute
+        self._blocked_until = max(self._blocked_until, now + pause)
+        if self._last_decrease is not None:
+            if sent_at is not None:
+                same_window = sent_at < self._last_decrease
+            else:
+                same_window = now - self._last_decrease < self._last_pause
+            if same_window:
+                return
+        self._concurrency_limit = max(float(self.min_concurrency), self._concurrency_limit / 2)
+        self._last_decrease = now
+        self._last_pause = pause
+        logger.warning(
+            "LLM 调用被限流，并发上限降为 %s，暂停 %.1f 秒",
+            int(self._concurrency_limit),
+            pause,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._prune_recent(now)
+        return {
+            "requests_per_minute_limit": self.requests_per_minute,
+            "tokens_per_minute_limit": self.tokens_per_minute,
+            "current_requests_per_minute": len(self._recent),
+            "current_tokens_per_minute": sum(tokens for _, tokens in self._recent),
+            "concurrency_limit": int(self._concurrency_limit),
+            "in_flight": self._in_flight,
+            "throttled": self._throttled,
+            "paused_seconds": round(max(0.0, self._blocked_until - now), 1),
+        }
+
+
+llm_rate_limiter = AdaptiveRateLimiter()
@@ -0,0 +1,261 @@
+"""
+LLM 结果缓存。
+
+按内容哈希缓存识别、批改等 LLM 调用的结果，存放在 data/llm_cache.db，
+总大小超过上限时按最近访问时间淘汰（LRU），读取时可指定有效期。
+异步代码通过 get_async/set_async 在缓存专用线程中读写，不阻塞事件循环；
+命中时的访问时间先记在内存中，随下一次写入或攒够一批后统一提交。
+缓存文件由所有进程共用，总大小由触发器记录在数据库中。
+"""
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+from app.paths import LLM_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+# 攒够这么多条访问时间刷新后再写入数据库
+TOUCH_BATCH_SIZE = 64
+
+
+class ResultCache:
+    """基于 SQLite 的内容寻址缓存，不同用途的结果放在不同命名空间中。"""
+
+    def __init__(self, path: Path = LLM_CACHE_PATH, max_bytes: int = settings.llm_cache_max_mb * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = settings.llm_cache_enabled
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._counters: Dict[str, Dict[str, int]] = {}
+        # 尚未写入数据库的访问时间：(命名空间, 键) -> 时间
+        self._pending_touches: Dict[Tuple[str, str], float] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache")
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """把多个组成部分（bytes 或字符串）合并成一个 SHA-256 键。"""
+        digest = hashlib.sha256()
+        for part in parts:
+            data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+            digest.update(hashlib.sha256(data).digest())
+        return digest.hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries (accessed_at)"
+            )
+            self._create_size_counter(self._conn)
+        return self._conn
+
+    @staticmethod
+    def _create_size_counter(conn: sqlite3.Connection) -> None:
+        """
+        缓存总大小保存在数据库中，由触发器随写入和删除更新。
+
+        多个进程共用同一个缓存文件，各自在内存中计数会漏掉其他进程的写入。
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO cache_meta (key, value)
+                SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM cache_entries
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS cache_size_insert AFTER INSERT ON cache_entries BEGIN
+                    UPDATE cache_meta SET value = value + NEW.size WHERE key = 'total_bytes';
+                END
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS cache_size_update AFTER UPDATE OF size ON cache_entries BEGIN
+                    UPDATE cache_meta SET value = value + NEW.size - OLD.size WHERE key = 'total_bytes';
+                END
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS cache_size_delete AFTER DELETE ON cache_entries BEGIN
+                    UPDATE cache_meta SET value = value - OLD.size WHERE key = 'total_bytes';
+                END
+                """
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+    def _count(self, namespace: str, field: str) -> None:
+        counters = self._counters.setdefault(namespace, {"hits": 0, "misses": 0})
+        counters[field] += 1
+
+    def _flush_touches(self, conn: sqlite3.Connection) -> None:
+        """把内存中的访问时间写入数据库（不提交，由调用方提交）。"""
+        if not self._pending_touches:
+            return
+        conn.executemany(
+            "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+            [(accessed_at, namespace, key) for (namespace, key), accessed_at in self._pending_touches.items()],
+        )
+        self._pending_touches.clear()
+
+    def get(self, namespace: str, key: str, ttl_seconds: Optional[float] = None) -> Optional[str]:
+        """读取缓存，命中时刷新访问时间；设置 ttl_seconds 时过期条目视为未命中。"""
+        if not self.enabled:
+            return None
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT value, created_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                ).fetchone()
+                if row is not None and ttl_seconds is not None and time.time() - row[1] > ttl_seconds:
+                    conn.execute(
+                        "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                        (namespace, key),
+                    )
+                    conn.commit()
+                    self._pending_touches.pop((namespace, key), None)
+                    row = None
+                if row is None:
+                    self._count(namespace, "misses")
+                    return None
+                self._pending_touches[(namespace, key)] = time.time()
+                if len(self._pending_touches) >= TOUCH_BATCH_SIZE:
+                    self._flush_touches(conn)
+                    conn.commit()
+                self._count(namespace, "hits")
+                return row[0]
+        except sqlite3.Error as exc:
+            logger.warning("读取 LLM 缓存失败: %s", exc)
+            return None
+
+    async def get_async(self, namespace: str, key: str, ttl_seconds: Optional[float] = None) -> Optional[str]:
+        """在缓存线程中执行 get，供异步代码使用。"""
+        if not self.enabled:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.get, namespace, key, ttl_seconds)
+
+    def set(self, namespace: str, key: str, value: str) -> None:
+        """写入缓存，并在超出容量时淘汰最久未访问的条目。"""
+        if not self.enabled:
+            return
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        try:
+            with self._lock:
+                conn = self._connection()
+                try:
+                    self._pending_touches.pop((namespace, key), None)
+                    self._flush_touches(conn)
+                    # 用 UPSERT 而不是 INSERT OR REPLACE，覆盖时走 UPDATE 触发器更新总大小
+                    conn.execute(
+                        """
+                        INSERT INTO cache_entries
+                            (namespace, key, value, size, created_at, accessed_at)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (namespace, key) DO UPDATE SET
+                            value = excluded.value,
+                            size = excluded.size,
+                            created_at = excluded.created_at,
+                            accessed_at = excluded.accessed_at
+                        """,
+                        (namespace, key, value, size, now, now),
+                    )
+                    self._evict(conn)
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+        except sqlite3.Error as exc:
+            logger.warning("写入 LLM 缓存失败: %s", exc)
+
+    async def set_async(self, namespace: str, key: str, value: str) -> None:
+        """在缓存线程中执行 set，供异步代码使用。"""
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.set, namespace, key, value)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT value FROM cache_meta WHERE key = 'total_bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute(
+            "SELECT namespace, key, size FROM cache_entries ORDER BY accessed_at ASC"
+        ).fetchall()
+        evicted = 0
+        for namespace, key, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            )
+            self._pending_touches.pop((namespace, key), None)
+            total -= size
+            evicted += 1
+        logger.info("LLM 缓存超出容量，已淘汰 %s 条记录", evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回各命名空间的命中/未命中次数以及条目数和占用空间。"""
+        namespaces: Dict[str, Dict[str, Any]] = {
+            namespace: {**counters, "entries": 0, "bytes": 0}
+            for namespace, counters in self._counters.items()
+        }
+        if self.enabled:
+            try:
+                with self._lock:
+                    rows = self._connection().execute(
+                        "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries GROUP BY namespace"
+                    ).fetchall()
+                for namespace, entries, size in rows:
+                    item = namespaces.setdefault(namespace, {"hits": 0, "misses": 0})
+                    item.update({"entries": entries, "bytes": size})
+            except sqlite3.Error as exc:
+                logger.warning("读取 LLM 缓存统计失败: %s", exc)
+        return {
+            "enabled": self.enabled,
+            "max_bytes": self.max_bytes,
+            "namespaces": namespaces,
+        }
+
+    async def stats_async(self) -> Dict[str, Any]:
+        """在缓存线程中执行 stats，供异步代码使用。"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.stats)
+
+
+result_cache = ResultCache()
@@ -0,0 +1,222 @@
+"""
+学生名单索引
+
+批次开始时把学生名单一次性载入内存，之后每篇作文的姓名都在内存中匹配，不再逐篇查询 User 表。
+匹配前先规范化姓名（全角转半角、去掉空格和标点、去掉“姓名：”前缀），
+再按编辑距离和拼音（识别成同音字时）做模糊匹配，给出置信度。
+置信度不足的匹配交给老师确认，而不是直接丢弃作文。
+
+拼音匹配依赖 pypinyin（已列入 requirements.txt），未安装时只按字形匹配，载入名单时会给出警告。
+"""
+import logging
+import re
+import unicodedata
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.database import get_db_session
+from app.models.database import User
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:  # pragma: no cover - 可选依赖
+    lazy_pinyin = None
+
+logger = logging.getLogger(__name__)
+
+NAME_PREFIX_PATTERN = re.compile(r"^(姓名|名字|学生|name)\s*[:：]?\s*", re.IGNORECASE)
+# 去掉空白、标点和下划线，保留汉字、字母和数字
+NAME_NOISE_PATTERN = re.compile(r"[\W_]+")
+
+# 拼音完全相同（同音字）时的置信度
+PINYIN_EXACT_CONFIDENCE = 0.9
+# 拼音相近时的置信度折扣，避免拼音相近优先于字形相近
+PINYIN_FUZZY_WEIGHT = 0.85
+# 多个学生同名且班级无法区分时的置信度，低于确认阈值，交给老师选择
+AMBIGUOUS_NAME_CONFIDENCE = 0.5
+
+_pinyin_warning_logged = False
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """规范化姓名：NFKC（全角转半角）、去掉前缀、空白和标点，英文转小写。"""
+    text = unicodedata.normalize("NFKC", name or "").strip()
+    text = NAME_PREFIX_PATTERN.sub("", text)
+    return NAME_NOISE_PATTERN.sub("", text).lower()
+
+
+def name_pinyin(normalized: str) -> Optional[str]:
+    """返回不带声调的拼音，未安装 pypinyin 时返回 None。"""
+    if lazy_pinyin is None or not normalized:
+        return None
+    return "".join(lazy_pinyin(normalized))
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein 编辑距离。"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        previous = current
+    return previous[-1]
+
+
+def similarity(a: str, b: str) -> float:
+    """按编辑距离计算的相似度，取值 0-1。"""
+    if not a or not b:
+        return 0.0
+    return 1 - edit_distance(a, b) / max(len(a), len(b))
+
+
+@dataclass
+class RosterEntry:
+    student_id: int
+    username: str
+    email: Optional[str]
+    class_name: Optional[str]
+    key: str
+    pinyin: Optional[str]
+
+
+@dataclass
+class RosterMatch:
+    student_id: int
+    username: str
+    email: Optional[str]
+    class_name: Optional[str]
+    confidence: float
+    method: str  # exact / pinyin / fuzzy
+
+    def to_dict(self) -> Dict:
+        data = asdict(self)
+        data["confidence"] = round(self.confidence, 3)
+        return data
+
+
+class RosterIndex:
+    """内存中的学生名单，按规范化姓名建立索引。"""
+
+    def __init__(self, entries: List[RosterEntry]):
+        self.entries = entries
+        # 不同班级可能有同名学生，同一姓名对应多个学生
+        self._by_key: Dict[str, List[RosterEntry]] = {}
+        for entry in entries:
+            self._by_key.setdefault(entry.key, []).append(entry)
+        self._by_pinyin: Dict[str, List[RosterEntry]] = {}
+        for entry in entries:
+            if entry.pinyin:
+                self._by_pinyin.setdefault(entry.pinyin, []).append(entry)
+
+    @classmethod
+    def load(cls, db: Optional[Session] = None) -> "RosterIndex":
+        """从数据库载入所有启用的学生账号（同步调用，异步代码中请放到数据库线程池执行）。"""
+        global _pinyin_warning_logged
+        if lazy_pinyin is None and not _pinyin_warning_logged:
+            logger.warning("未安装 pypinyin，学生姓名只按字形匹配，同音字无法识别（pip install pypinyin）")
+            _pinyin_warning_logged = True
+
+        def _load(session: Session):
+            students = session.query(User).filter(
+                User.role == "student",
+                User.is_active == True  # noqa: E712
+            ).all()
+            entries = []
+            for student in students:
+                key = normalize_name(student.username)
+                entries.append(RosterEntry(
+                    student_id=student.id,
+                    username=student.username,
+                    email=student.email,
+                    class_name=student.class_name,
+                    key=key,
+                    pinyin=name_pinyin(key),
+                ))
+            return cls(entries)
+
+        if db:
+            index = _load(db)
+        else:
+            with get_db_session() as session:
+                index = _load(session)
+        logger.info(f"已载入学生名单 {len(index.entries)} 人")
+        return index
+
+    def _score(self, key: str, pinyin: Optional[str], entry: RosterEntry) -> RosterMatch:
+        if key == entry.key:
+            confidence, method = 1.0, "exact"
+        elif pinyin and pinyin == entry.pinyin:
+            confidence, method = PINYIN_EXACT_CONFIDENCE, "pinyin"
+        else:
+            confidence, method = similarity(key, entry.key), "fuzzy"
+            if pinyin and entry.pinyin:
+                by_pinyin = similarity(pinyin, entry.pinyin) * PINYIN_FUZZY_WEIGHT
+                if by_pinyin > confidence:
+                    confidence, method = by_pinyin, "pinyin"
+        return RosterMatch(
+            student_id=entry.student_id,
+            username=entry.username,
+            email=entry.email,
+            class_name=entry.class_name,
+            confidence=confidence,
+            method=method,
+        )
+
+    def match(
+        self,
+        name: Optional[str],
+        class_name: Optional[str] = None,
+        limit: int = 3
+    ) -> List[RosterMatch]:
+        """
+        按置信度从高到低返回最可能的几个学生
+
+        Args:
+            name: 识别出的学生姓名
+            class_name: 识别出的班级；该班级有学生时只在班内做模糊匹配
+            limit: 最多返回的候选数
+        """
+        key = normalize_name(name)
+        if not key:
+            return []
+
+        class_key = normalize_name(class_name)
+
+        # 规范化后完全一致：只有一个学生时直接采用；同名学生先按班级区分，仍无法区分时交给老师选择
+        exact = self._by_key.get(key)
+        if exact:
+            if len(exact) > 1 and class_key:
+                exact = [entry for entry in exact if normalize_name(entry.class_name) == class_key] or exact
+            matches = [self._score(key, None, entry) for entry in exact]
+            if len(matches) > 1:
+                for match in matches:
+                    match.confidence = AMBIGUOUS_NAME_CONFIDENCE
+            # 同名学生全部列出，供老师选择
+            return matches
+
+        candidates = self.entries
+        if class_key:
+            in_class = [entry for entry in self.entries if normalize_name(entry.class_name) == class_key]
+            if in_class:
+                candidates = in_class
+
+        pinyin = name_pinyin(key)
+        if pinyin and len(self._by_pinyin.get(pinyin, [])) > 1:
+            # 多个学生同音时拼音无法区分，只按字形比较
+            pinyin = None
+        matches = [self._score(key, pinyin, entry) for entry in candidates]
+        matches.sort(key=lambda match: match.confidence, reverse=True)
+        return [match for match in matches[:limit] if match.confidence > 0]
+
+    def best(self, name: Optional[str], class_name: Optional[str] = None) -> Optional[RosterMatch]:
+        matches = self.match(name, class_name, limit=1)
+        return matches[0] if matches else None
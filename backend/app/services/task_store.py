@@ -0,0 +1,641 @@
+"""
+后台任务、任务队列和上传会话的持久化存储。
+
+uvicorn 以多个 worker 进程运行时，任务可能在一个进程中执行、在另一个进程中被查询，
+上传会话也可能在不同进程中创建和使用。任务状态、进度、结果和上传会话
+都保存在 data/tasks.db（SQLite WAL 模式），任何进程都可以读取。
+已完成任务的结果（全部作文、批改结果和总体分析）较大，压缩后单独保存在
+data/task_results/<task_id>.json.gz，查询时才读取。已结束的任务按保留时长和数量清理。
+
+待执行的批阅任务保存在 jobs 表中。执行进程领取任务时获得一段时间的租约，
+执行期间定期续约；进程退出或卡住导致租约过期后，任务可以被其他进程重新领取。
+领取顺序按提交老师公平分配：小批次（单篇重批等）优先，其次是正在执行的批次
+（按权重折算）最少的老师，最后按入队时间。
+"""
+import asyncio
+import gzip
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from app.config import settings
+from app.paths import TASK_RESULTS_DIR, TASKS_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 当前进程的标识，记录任务由哪个进程执行
+PROCESS_ID = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+TASK_FIELDS = (
+    "task_id", "status", "progress", "current_step", "total_count",
+    "completed_count", "result", "error", "owner",
+)
+# 已结束的任务状态，只有这些任务会被清理
+FINISHED_STATUSES = ("completed", "failed")
+
+
+class JobStatus:
+    QUEUED = "queued"
+    LEASED = "leased"
+
+
+# 旧版本创建的 jobs 表缺少的列
+JOB_EXTRA_COLUMNS = {
+    "user_key": "TEXT NOT NULL DEFAULT ''",
+    "weight": "REAL NOT NULL DEFAULT 1",
+    "priority": "INTEGER NOT NULL DEFAULT 0",
+    "total_count": "INTEGER NOT NULL DEFAULT 0",
+    "started_at": "REAL",
+}
+JOB_FIELDS = (
+    "job_id", "kind", "status", "owner", "lease_expires_at", "attempts", "created_at",
+    "user_key", "weight", "priority", "total_count", "started_at",
+)
+# 还没有完成过批次时，估算等待时间使用的每篇作文耗时（秒）
+DEFAULT_SECONDS_PER_ESSAY = 20.0
+# 每篇作文耗时的指数移动平均系数
+SECONDS_PER_ESSAY_ALPHA = 0.3
+
+
+def _fair_order(jobs: List[Dict[str, Any]], now: float) -> List[Dict[str, Any]]:
+    """
+    返回可领取任务的领取顺序。
+
+    优先级高的在前；同一优先级中，正在执行的批次数（除以权重）最少的老师在前，
+    每排入一个批次就计入该老师的执行数，同一老师的多个批次因此与其他老师交替排列。
+    """
+    running: Dict[str, float] = {}
+    waiting = []
+    for job in jobs:
+        if job["status"] == JobStatus.LEASED and (job["lease_expires_at"] or 0) >= now:
+            running[job["user_key"]] = running.get(job["user_key"], 0) + 1
+        else:
+            waiting.append(job)
+    order = []
+    while waiting:
+        best = min(
+            waiting,
+            key=lambda job: (
+                -job["priority"],
+                running.get(job["user_key"], 0) / max(job["weight"], 0.01),
+                job["created_at"],
+            ),
+        )
+        waiting.remove(best)
+        order.append(best)
+        running[best["user_key"]] = running.get(best["user_key"], 0) + 1
+    return order
+
+
+class TaskStore:
+    """基于 SQLite 的任务状态和上传会话存储，多进程共享。"""
+
+    def __init__(self, path: Path = TASKS_DB_PATH, results_dir: Path = TASK_RESULTS_DIR):
+        self.path = path
+        self.results_dir = results_dir
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 单线程执行写入，保证同一任务的进度按提交顺序落盘
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-store")
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=10, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    current_step TEXT NOT NULL DEFAULT '',
+                    total_count INTEGER NOT NULL DEFAULT 0,
+                    completed_count INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    owner TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS upload_sessions (
+                    session_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    owner TEXT,
+                    lease_expires_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            existing = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, definition in JOB_EXTRA_COLUMNS.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scheduler_state (
+                    key TEXT PRIMARY KEY,
+                    value REAL NOT NULL
+                )
+                """
+            )
+        return self._conn
+
+    # ===== 任务 =====
+
+    def save_task(self, record: Dict[str, Any]) -> None:
+        """写入或更新一个任务的完整状态。"""
+        now = time.time()
+        values = {field: record.get(field) for field in TASK_FIELDS}
+        if values["result"] is not None:
+            values["result"] = json.dumps(values["result"], ensure_ascii=False)
+        with self._lock:
+            self._connection().execute(
+                """
+                INSERT INTO tasks (task_id, status, progress, current_step, total_count,
+                                   completed_count, result, error, owner, created_at, updated_at)
+                VALUES (:task_id, :status, :progress, :current_step, :total_count,
+                        :completed_count, :result, :error, :owner, :now, :now)
+                ON CONFLICT(task_id) DO UPDATE SET
+                    status = excluded.status,
+                    progress = excluded.progress,
+                    current_step = excluded.current_step,
+                    total_count = excluded.total_count,
+                    completed_count = excluded.completed_count,
+                    result = excluded.result,
+                    error = excluded.error,
+                    owner = excluded.owner,
+                    updated_at = excluded.updated_at
+                """,
+                {**values, "now": now},
+            )
+
+    def save_task_later(self, record: Dict[str, Any]) -> None:
+        """在写入线程中保存任务状态，不阻塞事件循环。"""
+        future = self._executor.submit(self.save_task, record)
+        future.add_done_callback(self._log_failure)
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """在写入线程中执行同步操作并等待结果，与 save_task_later 的写入按顺序执行。"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    def _log_failure(future) -> None:
+        exc = future.exception()
+        if exc is not None:
+            logger.error(f"保存任务状态失败: {exc}")
+
+    def get_task(self, task_id: str, include_result: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        读取任务状态。
+
+        Args:
+            task_id: 任务ID
+            include_result: 已完成任务的结果保存在磁盘上时是否读取；只需要状态时传 False
+        """
+        with self._lock:
+            cursor = self._connection().execute(
+                f"SELECT {', '.join(TASK_FIELDS)} FROM tasks WHERE task_id = ?",
+                (task_id,),
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        record = dict(zip(TASK_FIELDS, row))
+        if record["result"] is not None:
+            record["result"] = json.loads(record["result"])
+        elif include_result and record["status"] == "completed":
+            record["result"] = self.load_result(task_id)
+        return record
+
+    async def get_task_async(self, task_id: str) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_task, task_id)
+
+    # ===== 任务结果 =====
+
+    def _result_path(self, task_id: str) -> Path:
+        return self.results_dir / f"{task_id}.json.gz"
+
+    def save_result(self, task_id: str, result: Any) -> None:
+        """压缩保存任务结果；先写临时文件再替换，其他进程不会读到写了一半的文件。"""
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        path = self._result_path(task_id)
+        tmp_path = path.with_suffix(".tmp")
+        data = gzip.compress(json.dumps(result, ensure_ascii=False).encode("utf-8"), compresslevel=6)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def load_result(self, task_id: str) -> Optional[Any]:
+        try:
+            with gzip.open(self._result_path(task_id), "rb") as f:
+                return json.loads(f.read().decode("utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取任务 {task_id} 的结果失败: {e}")
+            return None
+
+    def prune_tasks(self, max_age_seconds: float, max_count: int) -> List[str]:
+        """
+        删除超过保留时长、或超出保留数量的已结束任务及其结果文件。
+
+        Returns:
+            List[str]: 被删除的任务ID
+        """
+        cutoff = time.time() - max_age_seconds
+        placeholders = ", ".join("?" for _ in FINISHED_STATUSES)
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT task_id, updated_at FROM tasks WHERE status IN ({placeholders}) ORDER BY updated_at DESC",
+                    FINISHED_STATUSES,
+                ).fetchall()
+                expired = [
+                    task_id for index, (task_id, updated_at) in enumerate(rows)
+                    if index >= max_count or updated_at < cutoff
+                ]
+                conn.executemany("DELETE FROM tasks WHERE task_id = ?", [(task_id,) for task_id in expired])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        for task_id in expired:
+            try:
+                self._result_path(task_id).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"删除任务 {task_id} 的结果文件失败: {e}")
+        return expired
+
+    # ===== 任务队列 =====
+
+    def enqueue_job(
+        self,
+        job_id: str,
+        kind: str,
+        user_key: str = "",
+        weight: float = 1.0,
+        priority: int = 0,
+        total_count: int = 0,
+    ) -> None:
+        """
+        把任务放入队列，同一任务重复入队时不做修改。
+
+        Args:
+            job_id: 任务ID
+            kind: 任务类型
+            user_key: 提交者，同一提交者的任务共享一份公平份额
+            weight: 提交者的权重，权重为 2 的老师可以同时执行两倍的批次
+            priority: 优先级，大于 0 时排在普通任务前面
+            total_count: 作文篇数，用于估算排队时间
+        """
+        now = time.time()
+        with self._lock:
+            self._connection().execute(
+                """
+                INSERT OR IGNORE INTO jobs (job_id, kind, status, user_key, weight, priority, total_count,
+                                            created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (job_id, kind, JobStatus.QUEUED, user_key, weight, priority, total_count, now, now),
+            )
+
+    def has_job(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._connection().execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is not None
+
+    def has_claimable_job(self) -> bool:
+        """队列中是否有等待领取或租约已过期的任务；只读查询，不占用写锁。"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT 1 FROM jobs WHERE status = ? OR (status = ? AND lease_expires_at < ?) LIMIT 1",
+                (JobStatus.QUEUED, JobStatus.LEASED, time.time()),
+            ).fetchone()
+        return row is not None
+
+    @staticmethod
+    def _load_jobs(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        rows = conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs").fetchall()
+        return [dict(zip(JOB_FIELDS, row)) for row in rows]
+
+    def claim_job(
+        self,
+        lease_seconds: float,
+        priority_only: bool = False,
+        idle_users: bool = False,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        按公平顺序领取下一个任务（包括租约已过期的任务），当前进程获得 lease_seconds 秒的租约。
+
+        Args:
+            lease_seconds: 租约时长
+            priority_only: 只领取优先任务（执行进程满载时为小批次保留的名额）
+            idle_users: 与 priority_only 一起使用，同时领取没有批次在执行的老师的任务
+
+        Returns:
+            Optional[Dict[str, Any]]: 任务信息（job_id、kind、attempts、user_key、weight、priority），
+            队列为空时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                jobs = self._load_jobs(conn)
+                order = _fair_order(jobs, now)
+                if priority_only:
+                    running_users = {job["user_key"] for job in jobs if job not in order}
+                    order = [
+                        job for job in order
+                        if job["priority"] > 0 or (idle_users and job["user_key"] not in running_users)
+                    ]
+                job = order[0] if order else None
+                if job is not None:
+                    conn.execute(
+                        """
+                        UPDATE jobs SET status = ?, owner = ?, lease_expires_at = ?,
+                                        attempts = attempts + 1, started_at = ?, updated_at = ?
+                        WHERE job_id = ?
+                        """,
+                        (JobStatus.LEASED, PROCESS_ID, now + lease_seconds, now, now, job["job_id"]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if job is None:
+            return None
+        return {
+            "job_id": job["job_id"],
+            "kind": job["kind"],
+            "attempts": job["attempts"] + 1,
+            "user_key": job["user_key"],
+            "weight": job["weight"],
+            "priority": job["priority"],
+        }
+
+    def renew_leases(self, job_ids: List[str], lease_seconds: float) -> List[str]:
+        """为当前进程持有的任务续约，返回已不再由当前进程持有的任务。"""
+        now = time.time()
+        lost = []
+        with self._lock:
+            conn = self._connection()
+            for job_id in job_ids:
+                cursor = conn.execute(
+                    "UPDATE jobs SET lease_expires_at = ?, updated_at = ? WHERE job_id = ? AND owner = ? AND status = ?",
+                    (now + lease_seconds, now, job_id, PROCESS_ID, JobStatus.LEASED),
+                )
+                if cursor.rowcount != 1:
+                    lost.append(job_id)
+        return lost
+
+    def finish_job(self, job_id: str) -> None:
+        """任务执行结束（成功或失败），从队列中删除。"""
+        with self._lock:
+            self._connection().execute(
+                "DELETE FROM jobs WHERE job_id = ? AND owner = ?",
+                (job_id, PROCESS_ID),
+            )
+
+    def release_job(self, job_id: str) -> None:
+        """进程正常退出时交还任务，其他进程可以立即领取；不计入尝试次数。"""
+        with self._lock:
+            self._connection().execute(
+                """
+                UPDATE jobs SET status = ?, owner = NULL, lease_expires_at = NULL,
+                                attempts = MAX(attempts - 1, 0), updated_at = ?
+                WHERE job_id = ? AND owner = ?
+                """,
+                (JobStatus.QUEUED, time.time(), job_id, PROCESS_ID),
+            )
+
+    def job_stats(self) -> Dict[str, Any]:
+        """队列中等待和执行中的任务数，以及等待最久的任务已等待的秒数。"""
+        now = time.time()
+        with self._lock:
+            rows = self._connection().execute(
+                """
+                SELECT status, lease_expires_at < ? AS expired, COUNT(*), MIN(created_at)
+                FROM jobs GROUP BY status, expired
+                """,
+                (now,),
+            ).fetchall()
+        stats = {"queued": 0, "leased": 0, "expired": 0, "oldest_queued_seconds": 0.0}
+        for status, expired, count, oldest in rows:
+            if status == JobStatus.LEASED and expired:
+                key = "expired"
+            else:
+                key = status
+            stats[key] = stats.get(key, 0) + count
+            if key != JobStatus.LEASED and oldest is not None:
+                stats["oldest_queued_seconds"] = max(stats["oldest_queued_seconds"], round(now - oldest, 1))
+        return stats
+
+    async def job_stats_async(self) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.job_stats)
+
+    def record_batch_duration(self, essay_count: int, seconds: float) -> None:
+        """记录一个批次的耗时，更新每篇作文耗时的移动平均，用于估算排队时间。"""
+        if essay_count <= 0 or seconds <= 0:
+            return
+        sample = seconds / essay_count
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value FROM scheduler_state WHERE key = 'seconds_per_essay'").fetchone()
+            value = sample if row is None else row[0] + SECONDS_PER_ESSAY_ALPHA * (sample - row[0])
+            conn.execute(
+                "INSERT OR REPLACE INTO scheduler_state (key, value) VALUES ('seconds_per_essay', ?)",
+                (value,),
+            )
+
+    def queue_position(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        排队中的任务前面还有几个批次，以及预计多久后开始执行。
+
+        按领取顺序依次把排在前面的批次分配给最早空出的执行名额，每个批次的耗时按作文篇数乘以
+        每篇作文的平均耗时估算。名额数为持有租约的执行进程数（至少按一个计算）乘以每个进程的
+        task_workers；没有任何执行进程持有租约时无法确认有进程在运行，结果中 worker_active 为 False。
+        任务不在排队时返回 None。
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            jobs = self._load_jobs(conn)
+            completed = dict(conn.execute(
+                "SELECT task_id, completed_count FROM tasks WHERE task_id IN (SELECT job_id FROM jobs)"
+            ).fetchall())
+            row = conn.execute("SELECT value FROM scheduler_state WHERE key = 'seconds_per_essay'").fetchone()
+        seconds_per_essay = row[0] if row else DEFAULT_SECONDS_PER_ESSAY
+
+        order = _fair_order(jobs, now)
+        running = [job for job in jobs if job not in order]
+        workers = {job["owner"] for job in running}
+        slots = [
+            max(job["total_count"] - completed.get(job["job_id"], 0), 0) * seconds_per_essay
+            for job in running
+        ]
+        # 空闲的名额可以立即开始
+        capacity = max(1, len(workers)) * max(1, settings.task_workers)
+        slots.extend([0.0] * max(capacity - len(slots), 0))
+        heapq.heapify(slots)
+        for position, job in enumerate(order, 1):
+            start = heapq.heappop(slots)
+            if job["job_id"] == task_id:
+                return {
+                    "queue_position": position,
+                    "estimated_wait_seconds": round(start),
+                    "estimated_start_at": now + start,
+                    "worker_active": bool(workers),
+                }
+            heapq.heappush(slots, start + job["total_count"] * seconds_per_essay)
+        return None
+
+    async def queue_position_async(self, task_id: str) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.queue_position, task_id)
+
+    # ===== 上传会话 =====
+
+    def create_session(self, session_id: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO upload_sessions (session_id, data, created_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(data, ensure_ascii=False), time.time()),
+            )
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT data FROM upload_sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def create_session_async(self, session_id: str, data: Dict[str, Any]) -> None:
+        await self.run(self.create_session, session_id, data)
+
+    async def get_session_async(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await self.run(self.get_session, session_id)
+
+    async def add_session_essays_async(self, session_id: str, paths: List[str]) -> Optional[int]:
+        return await self.run(self.add_session_essays, session_id, paths)
+
+    async def take_session_async(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await self.run(self.take_session, session_id)
+
+    def add_session_essays(self, session_id: str, paths: List[str]) -> Optional[int]:
+        """向会话追加作文文件，返回会话中的作文总数；会话不存在时返回 None。"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT data FROM upload_sessions WHERE session_id = ?",
+                    (session_id,),
+                ).fetchone()
+                if row is None:
+                    conn.execute("ROLLBACK")
+                    return None
+                data = json.loads(row[0])
+                data.setdefault("essays", []).extend(paths)
+                conn.execute(
+                    "UPDATE upload_sessions SET data = ? WHERE session_id = ?",
+                    (json.dumps(data, ensure_ascii=False), session_id),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return len(data["essays"])
+
+    def take_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """取出并删除会话，同一会话只能被开始批阅一次。"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT data FROM upload_sessions WHERE session_id = ?",
+                    (session_id,),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("DELETE FROM upload_sessions WHERE session_id = ?", (session_id,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return json.loads(row[0]) if row else None
+
+    def prune_sessions(self, max_age_seconds: float) -> int:
+        """删除超过保留时长仍未开始批阅的上传会话及其上传的文件，返回删除的会话数。"""
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT session_id, data FROM upload_sessions WHERE created_at < ?",
+                    (cutoff,),
+                ).fetchall()
+                conn.executemany(
+                    "DELETE FROM upload_sessions WHERE session_id = ?",
+                    [(session_id,) for session_id, _ in rows],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        for session_id, data in rows:
+            try:
+                session = json.loads(data)
+            except ValueError:
+                continue
+            paths = list(session.get("essays") or [])
+            if session.get("prompt"):
+                paths.append(session["prompt"])
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"删除会话 {session_id} 的上传文件失败: {e}")
+        return len(rows)
+
+
+task_store = TaskStore()
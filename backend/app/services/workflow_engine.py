@@ -1,127 +1,407 @@
+import asyncio
 import logging
 from typing import Dict, List, Optional
 
 from sqlalchemy.orm import Session
 
+from app.config import settings
+from app.database import run_in_db_thread
+
+from .batch_checkpoint import BatchCheckpoint
+from .email_outbox import email_outbox_service
 from .email_service import EmailService
-from .grading_db import grading_db_service
+from .fair_scheduler import SchedulerFlow
+from .grading_db import grading_db_service, grading_result_writer
+from .grading_pipeline import PipelineStage, StagedPipeline
+from .image_preprocess import image_preprocessor
 from .llm_service import LLMService
+from .name_extractor import extract_name_locally, record_name_source
+from .roster_index import RosterIndex
 
 
 logging.basicConfig(level="INFO")
 logger = logging.getLogger(__name__)
 
+# 流水线的最后一个阶段，检查点中完成了该阶段的作文已处理完毕
+FINAL_STAGE = "email"
 
-class WorkflowEngine:
-    """
-    Coordinates the essay grading flow.
 
-    Images are recognized by the configured Doubao model instead of a separate OCR API.
-    """
+class EssayJob:
+    """单篇作文在各批阅阶段之间传递的状态。"""
 
-    def __init__(self, db: Optional[Session] = None):
-        self.llm_service = LLMService()
-        self.grading_db = grading_db_service
-        self.db = db
-
-    async def process_single_essay(
+    def __init__(
         self,
-        essay_image_bytes: bytes,
+        index: int,
+        image_bytes: bytes,
         requirements: str,
         image_path: Optional[str] = None,
-    ) -> Dict:
-        result = {
+        force_regrade: bool = False,
+        roster: Optional[RosterIndex] = None,
+    ):
+        self.index = index
+        self.image_bytes = image_bytes
+        self.requirements = requirements
+        self.image_path = image_path
+        self.preview_bytes: Optional[bytes] = None
+        self.force_regrade = force_regrade
+        self.roster = roster
+        self.essay_text = ""
+        self.student_name: Optional[str] = None
+        # 姓名只是在作文开头扫描名单得到的，保存前需要老师确认
+        self.name_needs_confirmation = False
+        self.save_result: Dict = {}
+        self.finished = False
+        self.completed_stages: List[str] = []
+        self.result: Dict = {
             "student_name": "未知学生",
             "student_id": None,
             "grading_result": None,
             "saved_to_db": False,
             "email_sent": False,
+            "email_queued": False,
             "email_error": None,
             "error": None,
         }
 
-        try:
-            logger.info("Step 1/5: recognizing essay image with AI...")
+    def snapshot(self) -> Dict:
+        """已完成阶段的结果，写入批次检查点。"""
+        return {
+            "completed_stages": self.completed_stages,
+            "essay_text": self.essay_text,
+            "student_name": self.student_name,
+            "name_needs_confirmation": self.name_needs_confirmation,
+            "save_result": self.save_result,
+            "finished": self.finished,
+            "result": self.result,
+        }
+
+    @staticmethod
+    def is_done(state: Dict) -> bool:
+        """检查点中保存的作文是否已经处理完（提前结束或完成了所有阶段）。"""
+        return bool(state.get("finished")) or FINAL_STAGE in state.get("completed_stages", [])
+
+    def restore(self, state: Dict) -> None:
+        """从检查点恢复，之后只执行尚未完成的阶段。"""
+        self.completed_stages = list(state.get("completed_stages", []))
+        self.essay_text = state.get("essay_text", "")
+        self.student_name = state.get("student_name")
+        self.name_needs_confirmation = state.get("name_needs_confirmation", False)
+        self.save_result = state.get("save_result", {})
+        self.finished = state.get("finished", False)
+        self.result.update(state.get("result", {}))
+
+
+class WorkflowEngine:
+    """
+    Coordinates the essay grading flow.
+
+    Images are recognized by the configured Doubao model instead of a separate OCR API.
+    Batches run through a staged pipeline so each step has its own concurrency limit.
+    """
+
+    def __init__(self, db: Optional[Session] = None):
+        self.llm_service = LLMService()
+        self.grading_db = grading_db_service
+        self.db = db
+
+    def _build_stages(self, checkpoint: Optional[BatchCheckpoint] = None) -> List[PipelineStage]:
+        stages = [
+            PipelineStage("preprocess", self._preprocess_stage, max(1, settings.image_preprocess_workers)),
+            PipelineStage("recognize", self._recognize_stage, settings.vision_concurrency),
+            PipelineStage("analyze", self._analyze_stage, settings.text_concurrency),
+            # 保存请求由 grading_result_writer 分组提交，这里的并发数决定一组最多能攒多少条
+            PipelineStage("save", self._save_stage, max(1, settings.db_commit_batch_size)),
+            # SQLite 只有一个写入者，邮件入队阶段串行执行即可
+            PipelineStage(FINAL_STAGE, self._email_stage, 1),
+        ]
+        if checkpoint is None:
+            return stages
+        return [
+            PipelineStage(stage.name, self._checkpointed(stage, checkpoint), stage.concurrency)
+            for stage in stages
+        ]
+
+    @staticmethod
+    def _checkpointed(stage: PipelineStage, checkpoint: BatchCheckpoint):
+        """Skip stages finished before a restart and persist each newly finished stage."""
+        async def handler(job: EssayJob) -> None:
+            if stage.name == "preprocess":
+                # The processed and preview images are not snapshotted, so preprocessing
+                # runs again on resume until recognition no longer needs them.
+                if "recognize" in job.completed_stages:
+                    return
+            elif stage.name in job.completed_stages:
+                return
+            await stage.handler(job)
+            if stage.name not in job.completed_stages:
+                job.completed_stages.append(stage.name)
+            await checkpoint.save_essay_async(job.index, job.snapshot())
+
+        return handler
+
+    @staticmethod
+    def _record_error(job: EssayJob, exc: Exception) -> None:
+        logger.error("Failed to process essay: %s", exc, exc_info=True)
+        job.result["error"] = str(exc)
+
+    async def _preprocess_stage(self, job: EssayJob) -> None:
+        job.image_bytes, image_stats = await image_preprocessor.prepare(job.image_bytes)
+        if settings.tiered_recognition:
+            # 先用低分辨率版本识别，检查不通过才发送完整图片
+            preview_bytes, preview_stats = await image_preprocessor.prepare(
+                job.image_bytes,
+                max_long_edge=settings.image_preview_long_edge,
+            )
+            if len(preview_bytes) < len(job.image_bytes):
+                job.preview_bytes = preview_bytes
+                image_stats["preview_bytes"] = preview_stats["processed_bytes"]
+        job.result["image_stats"] = image_stats
+        logger.info(
+            "Preprocessed essay image: %s -> %s bytes",
+            image_stats["original_bytes"],
+            image_stats["processed_bytes"],
+        )
+
+    async def _recognize_stage(self, job: EssayJob) -> None:
+        logger.info("Step 1/5: recognizing essay image with AI...")
+        if settings.fused_recognition:
+            recognized = await self.llm_service.recognize_essay(job.image_bytes, job.preview_bytes)
+            essay_text = recognized["essay_text"]
+            job.student_name = recognized["student_name"]
+            job.result["class_name"] = recognized["class_name"]
+        else:
             essay_text = await self.llm_service.recognize_image_text(
-                essay_image_bytes,
+                job.image_bytes,
                 "学生作文全文",
+                preview_bytes=job.preview_bytes,
+                expect_name=True,
             )
-            if not essay_text.strip():
-                raise ValueError("AI 未能识别出任何作文文本")
-
-            logger.info("Step 2/5: extracting student name...")
-            student_name = await self.llm_service.extract_student_name(essay_text)
-            result["student_name"] = student_name
-
-            logger.info("Step 3/5: grading essay for %s...", student_name)
-            grading_result = await self.llm_service.grade_essay(requirements, essay_text)
-            result["grading_result"] = grading_result
-
-            logger.info("Step 4/5: saving grading result...")
-            save_result = self.grading_db.save_grading_result(
-                student_name=student_name,
-                essay_text=essay_text,
-                requirements=requirements,
-                grading_result=grading_result,
-                image_path=image_path,
-                db=self.db,
-            )
-
-            if not save_result["success"]:
-                result["error"] = save_result.get("error")
-                logger.error("Failed to save grading result: %s", save_result.get("error"))
-                return result
-
-            result["saved_to_db"] = True
-            result["student_id"] = save_result.get("student_id")
-            result["essay_id"] = save_result.get("essay_id")
-            result["grading_record_id"] = save_result.get("grading_record_id")
+        if not essay_text.strip():
+            raise ValueError("AI 未能识别出任何作文文本")
+        job.essay_text = essay_text
+
+    async def _analyze_stage(self, job: EssayJob) -> None:
+        """姓名提取和批改只依赖作文文本，两个 LLM 调用并发执行。"""
+        calls = [self.llm_service.grade_essay(job.requirements, job.essay_text, job.force_regrade)]
+        # 名单扫描找到的姓名，需要与 LLM 提取的姓名核对
+        scanned_name = None
+        if job.student_name is not None:
+            # 合并识别已经给出了姓名，只需批改
+            record_name_source("recognized")
+        else:
+            local_name = extract_name_locally(job.essay_text, job.roster)
+            if local_name is not None and local_name.confirmed:
+                job.student_name = local_name.name
+                job.result["student_name"] = job.student_name
+            elif local_name is not None:
+                scanned_name = local_name.name
+        if job.student_name is None:
+            # 本地规则无法确定姓名时才让 LLM 提取
+            logger.info("Step 2-3/5: extracting student name and grading essay...")
+            record_name_source("llm_fallback")
+            calls.append(self.llm_service.extract_student_name(job.essay_text))
+        else:
+            logger.info("Step 2-3/5: grading essay for %s...", job.student_name)
+        grading_result, *name_results = await asyncio.gather(*calls, return_exceptions=True)
+        student_name = name_results[0] if name_results else job.student_name
+
+        if isinstance(student_name, BaseException):
+            # 姓名提取失败不影响批改结果，保留成绩以便之后关联到学生
+            logger.warning("Failed to extract student name: %s", student_name)
+            job.result["name_error"] = f"学生姓名提取失败: {student_name}"
+            if scanned_name is not None:
+                job.student_name = scanned_name
+                job.name_needs_confirmation = True
+                job.result["student_name"] = scanned_name
+        elif scanned_name is not None and not self._same_student(job, scanned_name, student_name):
+            logger.info("Roster scan found %r but the LLM extracted %r", scanned_name, student_name)
+            job.student_name = scanned_name
+            job.name_needs_confirmation = True
+            job.result["student_name"] = scanned_name
+        else:
+            job.student_name = student_name
+            job.result["student_name"] = student_name
+
+        if isinstance(grading_result, BaseException):
+            raise grading_result
+        job.result["grading_result"] = grading_result
+
+    @staticmethod
+    def _same_student(job: EssayJob, scanned_name: str, extracted_name: str) -> bool:
+        """LLM 提取的姓名能可靠地匹配到名单扫描找到的学生时返回 True。"""
+        match = job.roster.best(extracted_name, job.result.get("class_name")) if job.roster else None
+        return (
+            match is not None
+            and match.confidence >= settings.roster_match_threshold
+            and match.username == scanned_name
+        )
+
+    async def _save_stage(self, job: EssayJob) -> None:
+        logger.info("Step 4/5: saving grading result...")
+        result = job.result
+        recognized_name = job.student_name
+        match = job.roster.best(recognized_name, result.get("class_name")) if job.roster else None
+        if (
+            match is None
+            or match.confidence < settings.roster_match_threshold
+            or job.name_needs_confirmation
+        ):
+            await self._hold_for_confirmation(job)
+            return
+
+        if match.method != "exact":
             logger.info(
-                "Saved grading result for %s (Record ID: %s)",
-                student_name,
-                save_result.get("grading_record_id"),
-            )
-
-            logger.info("Step 5/5: sending grading email if configured...")
-            student_email = save_result.get("student_email")
-            if not student_email:
-                result["email_error"] = "学生未填写邮箱，已跳过邮件发送。"
-                return result
-
-            email_service = EmailService()
-            result["email_sent"] = await email_service.send_grading_email(
-                student_name=student_name,
-                student_email=student_email,
-                grading_result=grading_result,
+                "Matched recognized name %r to student %s (%s, confidence %.2f)",
+                recognized_name,
+                match.username,
+                match.method,
+                match.confidence,
             )
-            if not result["email_sent"] and email_service.is_configured():
-                result["email_error"] = "邮件发送失败，请检查 QQ 邮箱授权码或网络。"
+            result["recognized_name"] = recognized_name
+        result["student_name"] = match.username
+        result["match_confidence"] = round(match.confidence, 3)
+        save_kwargs = dict(
+            student_name=match.username,
+            essay_text=job.essay_text,
+            requirements=job.requirements,
+            grading_result=result["grading_result"],
+            image_path=job.image_path,
+            student_id=match.student_id,
+            student_email=match.email,
+        )
+        if self.db is not None:
+            save_result = await self.grading_db.save_grading_result_async(db=self.db, **save_kwargs)
+        else:
+            # 与同时完成的其他作文合并为一个事务提交
+            save_result = await grading_result_writer.save(**save_kwargs)
+        job.save_result = save_result
+
+        if not save_result["success"]:
+            result["error"] = save_result.get("error")
+            # 未能入库时保留识别文本，成绩可在之后手动关联到学生
+            result["essay_text"] = job.essay_text
+            logger.error("Failed to save grading result: %s", save_result.get("error"))
+            job.finished = True
+            return
+
+        result["saved_to_db"] = True
+        result["student_id"] = save_result.get("student_id")
+        result["essay_id"] = save_result.get("essay_id")
+        result["grading_record_id"] = save_result.get("grading_record_id")
+        logger.info(
+            "Saved grading result for %s (Record ID: %s)",
+            result["student_name"],
+            save_result.get("grading_record_id"),
+        )
+
+    async def _hold_for_confirmation(self, job: EssayJob) -> None:
+        """The name does not reliably match a student: keep the grade for the teacher to assign."""
+        result = job.result
+        candidates = job.roster.match(job.student_name, result.get("class_name")) if job.roster else []
+        pending = await self.grading_db.save_pending_match_async(
+            recognized_name=job.student_name,
+            class_name=result.get("class_name"),
+            candidates=[candidate.to_dict() for candidate in candidates],
+            essay_text=job.essay_text,
+            requirements=job.requirements,
+            grading_result=result["grading_result"],
+            image_path=job.image_path,
+        )
+        if job.name_needs_confirmation:
+            reason = "Recognized names disagree"
+        else:
+            reason = "No confident student match"
+        logger.warning(
+            "%s for %r, waiting for teacher confirmation (pending ID: %s)",
+            reason,
+            job.student_name,
+            pending["id"],
+        )
+        result["needs_confirmation"] = True
+        result["recognized_name"] = job.student_name
+        result["pending_match_id"] = pending["id"]
+        result["candidates"] = pending["candidates"]
+        result["essay_text"] = job.essay_text
+        job.finished = True
+
+    async def _email_stage(self, job: EssayJob) -> None:
+        logger.info("Step 5/5: queueing grading email if configured...")
+        result = job.result
+        student_email = job.save_result.get("student_email")
+        if not student_email:
+            result["email_error"] = "学生未填写邮箱，已跳过邮件发送。"
+            return
+        if not EmailService().is_configured():
+            return
+
+        # 邮件由后台投递器发送，批阅流程不再等待 SMTP
+        await email_outbox_service.enqueue_async(
+            grading_record_id=result["grading_record_id"],
+            student_name=result["student_name"],
+            recipient=student_email,
+            db=self.db,
+        )
+        result["email_queued"] = True
 
+    async def process_single_essay(
+        self,
+        essay_image_bytes: bytes,
+        requirements: str,
+        image_path: Optional[str] = None,
+        force_regrade: bool = False,
+    ) -> Dict:
+        job = EssayJob(0, essay_image_bytes, requirements, image_path, force_regrade)
+        try:
+            job.roster = await run_in_db_thread(RosterIndex.load, self.db)
+            for stage in self._build_stages():
+                await stage.handler(job)
+                if job.finished:
+                    break
         except Exception as e:
-            logger.error("Failed to process essay: %s", e, exc_info=True)
-            result["error"] = str(e)
+            self._record_error(job, e)
 
-        return result
+        return job.result
 
     async def process_batch(
         self,
-        prompt_image_bytes: bytes,
+        prompt_image_bytes: Optional[bytes],
         essay_images_bytes: List[bytes],
         progress_callback=None,
+        max_concurrency: Optional[int] = None,
+        requirements_text: Optional[str] = None,
+        force_regrade: bool = False,
+        checkpoint: Optional[BatchCheckpoint] = None,
+        admission: Optional[SchedulerFlow] = None,
     ) -> Dict:
+        """
+        Grade a batch of essays.
+
+        With a checkpoint, each essay's stage results are written to disk as they
+        finish, and essays restored from an earlier run continue from their last
+        completed stage. With an admission flow, essays enter the pipeline through
+        the process-wide fair scheduler instead of a per-batch limit.
+        """
         total_count = len(essay_images_bytes)
-        logger.info("Start batch grading, total essays: %s", total_count)
-
-        if progress_callback:
-            progress_callback(0, "AI 识别作文要求...")
+        manifest = (checkpoint.load_manifest() or {}) if checkpoint else {}
+        concurrency = max(1, max_concurrency or settings.grading_concurrency)
+        logger.info("Start batch grading, total essays: %s, concurrency: %s", total_count, concurrency)
 
         try:
-            requirements = await self.llm_service.recognize_image_text(
-                prompt_image_bytes,
-                "作文题目和写作要求",
-            )
+            if manifest.get("requirements"):
+                # 重启前已经识别过作文要求
+                requirements = manifest["requirements"]
+            elif requirements_text and requirements_text.strip():
+                # 老师直接提交了文字版作文要求，无需识别图片
+                requirements = requirements_text.strip()
+            else:
+                if progress_callback:
+                    progress_callback(0, "AI 识别作文要求...")
+                prompt_image_bytes, _ = await image_preprocessor.prepare(prompt_image_bytes or b"")
+                requirements = await self.llm_service.recognize_requirements(prompt_image_bytes)
             if not requirements.strip():
                 raise ValueError("AI 未能识别出任何作文要求")
+            if checkpoint and not manifest.get("requirements"):
+                await checkpoint.update_manifest_async(requirements=requirements)
         except Exception as e:
             logger.error("Failed to recognize essay requirements: %s", e)
             return {
@@ -132,26 +412,50 @@ class WorkflowEngine:
                     "failed_grades": total_count,
                     "saved_to_db": 0,
                     "email_sent": 0,
+                    "email_queued": 0,
                     "average_score": 0,
                 },
                 "details": [],
                 "overall_analysis": None,
             }
 
-        results = []
+        # The roster is loaded once per batch; names are matched in memory.
+        roster = await run_in_db_thread(RosterIndex.load, self.db)
+
+        # Essays are network-bound, so several are in flight at once and each
+        # step runs in its own worker pool; results keep upload order.
+        jobs = [
+            EssayJob(index, essay_bytes, requirements, force_regrade=force_regrade, roster=roster)
+            for index, essay_bytes in enumerate(essay_images_bytes)
+        ]
+        if checkpoint:
+            saved_states = await checkpoint.load_essays_async()
+            for job in jobs:
+                if job.index in saved_states:
+                    job.restore(saved_states[job.index])
+            if saved_states:
+                logger.info("Resuming batch from checkpoint, %s essays have saved progress", len(saved_states))
         completed_count = 0
 
-        for index, essay_bytes in enumerate(essay_images_bytes):
+        def on_admit(job: EssayJob) -> None:
             if progress_callback:
-                progress_callback(completed_count, f"处理第 {index + 1}/{total_count} 篇作文...")
+                progress_callback(completed_count, f"处理第 {job.index + 1}/{total_count} 篇作文...")
 
-            result = await self.process_single_essay(essay_bytes, requirements)
-            results.append(result)
+        def on_complete(job: EssayJob) -> None:
+            nonlocal completed_count
             completed_count += 1
-
             if progress_callback:
                 progress_callback(completed_count, f"已完成 {completed_count}/{total_count} 篇作文")
 
+        pipeline = StagedPipeline(
+            self._build_stages(checkpoint),
+            concurrency,
+            on_error=self._record_error,
+            admission=admission,
+        )
+        await pipeline.run(jobs, on_admit=on_admit, on_complete=on_complete)
+        results = [job.result for job in jobs]
+
         if progress_callback:
             progress_callback(completed_count, "分析学生总体写作情况...")
 
@@ -181,6 +485,8 @@ class WorkflowEngine:
         failed_grades = total_essays - successful_grades
         saved_to_db = sum(1 for r in results if r.get("saved_to_db", False))
         email_sent = sum(1 for r in results if r.get("email_sent", False))
+        email_queued = sum(1 for r in results if r.get("email_queued", False))
+        needs_confirmation = sum(1 for r in results if r.get("needs_confirmation", False))
 
         total_score = 0.0
         scored_essays = 0
@@ -202,6 +508,8 @@ class WorkflowEngine:
                 "failed_grades": failed_grades,
                 "saved_to_db": saved_to_db,
                 "email_sent": email_sent,
+                "email_queued": email_queued,
+                "needs_confirmation": needs_confirmation,
                 "average_score": average_score,
             },
             "details": results,
@@ -0,0 +1,249 @@
+"""
+批量批阅后台任务
+
+API 进程只创建检查点并把批次放入任务队列，由 JobWorker（API 进程内嵌或独立的
+python -m app.worker 进程）领取执行。上传的文件和每篇作文的阶段结果都保留到批次完成为止；
+执行进程中途退出后，其他进程领取同一批次时按检查点继续。
+"""
+import asyncio
+import logging
+import os
+import time
+from functools import partial
+from typing import Any, Coroutine, Dict, Optional, Tuple
+from uuid import uuid4
+
+from app.config import settings
+from app.services.batch_checkpoint import (
+    STALE_DIRECTORY_SECONDS,
+    BatchCheckpoint,
+    BatchStatus,
+    list_interrupted_batches,
+)
+from app.services.fair_scheduler import SchedulerFlow, fair_scheduler
+from app.services.task_store import PROCESS_ID, task_store
+from app.services.workflow_engine import EssayJob, WorkflowEngine
+from app.tasks.task_manager import TaskStatus, task_manager
+
+logger = logging.getLogger(__name__)
+
+JOB_KIND = "grading_batch"
+
+# 实例化工作流引擎
+workflow = WorkflowEngine()
+
+
+def _cleanup(checkpoint: BatchCheckpoint, manifest: Dict[str, Any]) -> None:
+    """批次结束后删除上传的文件和检查点。"""
+    try:
+        paths = list(manifest.get("essay_paths", []))
+        if manifest.get("prompt_path"):
+            paths.append(manifest["prompt_path"])
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        checkpoint.remove()
+        logger.info(f"批次 {checkpoint.task_id} 的临时文件已清理。")
+    except Exception as e:
+        logger.error(f"清理批次 {checkpoint.task_id} 的临时文件失败: {e}")
+
+
+async def _cleanup_async(checkpoint: BatchCheckpoint, manifest: Dict[str, Any]) -> None:
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _cleanup, checkpoint, manifest)
+
+
+def _read_uploads(prompt_path: Optional[str], essay_paths: list) -> Tuple[Optional[bytes], list]:
+    prompt_bytes = None
+    if prompt_path:
+        with open(prompt_path, "rb") as f:
+            prompt_bytes = f.read()
+    essay_bytes_list = []
+    for path in essay_paths:
+        with open(path, "rb") as f:
+            essay_bytes_list.append(f.read())
+    return prompt_bytes, essay_bytes_list
+
+
+def _create_batch_task(checkpoint: BatchCheckpoint, admission: Optional[SchedulerFlow] = None) -> Coroutine:
+    async def batch_processing_task():
+        """
+        实际执行批处理的协程任务。
+        """
+        loop = asyncio.get_running_loop()
+        manifest = await loop.run_in_executor(None, checkpoint.load_manifest) or {}
+        task_id = checkpoint.task_id
+        prompt_path: Optional[str] = manifest.get("prompt_path")
+        essay_paths = manifest.get("essay_paths", [])
+
+        try:
+            # 文件读写、fsync 和删除都放到线程池中，不阻塞事件循环
+            prompt_bytes, essay_bytes_list = await loop.run_in_executor(
+                None, _read_uploads, prompt_path, essay_paths
+            )
+
+            # 定义进度回调函数
+            def progress_callback(completed_count, current_step):
+                # 更新任务管理器中的进度信息（同时写入任务存储，其他进程可查询）
+                task_manager.update_progress(task_id, completed_count, current_step)
+                logger.info(f"任务 {task_id} 进度更新: {completed_count}/{len(essay_paths)} - {current_step}")
+
+            # 调用工作流引擎并返回结果
+            result = await workflow.process_batch(
+                prompt_bytes,
+                essay_bytes_list,
+                progress_callback,
+                requirements_text=manifest.get("requirements_text"),
+                force_regrade=manifest.get("force_regrade", False),
+                checkpoint=checkpoint,
+                admission=admission,
+            )
+        except Exception:
+            await _cleanup_async(checkpoint, manifest)
+            raise
+
+        # 只在批次正常结束时清理；进程退出导致的取消不会走到这里，文件和检查点留给重启后继续
+        await checkpoint.update_manifest_async(status=BatchStatus.COMPLETED)
+        await _cleanup_async(checkpoint, manifest)
+        return result
+
+    return batch_processing_task()
+
+
+def submit_grading_batch(
+    prompt_path: Optional[str],
+    essay_paths: list,
+    requirements_text: Optional[str] = None,
+    force_regrade: bool = False,
+    user_key: str = "",
+    weight: float = 1.0,
+) -> str:
+    """
+    为一批已上传的作文创建检查点并放入任务队列。
+
+    Args:
+        user_key: 提交者标识，同一提交者的批次共享一份公平份额
+        weight: 提交者的调度权重
+
+    Returns:
+        str: 任务ID
+    """
+    task_id = str(uuid4())
+    checkpoint = BatchCheckpoint(task_id)
+    checkpoint.create({
+        "prompt_path": prompt_path,
+        "requirements_text": requirements_text,
+        "essay_paths": list(essay_paths),
+        "force_regrade": force_regrade,
+        "user_key": user_key,
+        "weight": weight,
+    })
+    task_store.save_task({
+        "task_id": task_id,
+        "status": TaskStatus.PENDING,
+        "progress": 0,
+        "current_step": "等待执行...",
+        "total_count": len(essay_paths),
+        "completed_count": 0,
+    })
+    _enqueue(task_id, len(essay_paths), user_key, weight)
+    logger.info(f"批次 {task_id} 已放入任务队列，共 {len(essay_paths)} 篇作文。")
+    return task_id
+
+
+async def submit_grading_batch_async(prompt_path: Optional[str], essay_paths: list, **kwargs: Any) -> str:
+    """在任务存储的写入线程中执行 submit_grading_batch（检查点需要落盘），不阻塞事件循环。"""
+    return await task_store.run(partial(submit_grading_batch, prompt_path, essay_paths, **kwargs))
+
+
+def _enqueue(task_id: str, essay_count: int, user_key: str, weight: float) -> None:
+    # 小批次（单篇重批等）优先于批量批阅
+    priority = 1 if 0 < essay_count <= settings.priority_max_essays else 0
+    task_store.enqueue_job(
+        task_id,
+        JOB_KIND,
+        user_key=user_key,
+        weight=weight,
+        priority=priority,
+        total_count=essay_count,
+    )
+
+
+def _fail_batch(checkpoint: BatchCheckpoint, manifest: Dict[str, Any], error: str) -> None:
+    _cleanup(checkpoint, manifest)
+    task_store.save_task({
+        "task_id": checkpoint.task_id,
+        "status": TaskStatus.FAILED,
+        "progress": 0,
+        "current_step": "任务失败",
+        "total_count": len(manifest.get("essay_paths", [])),
+        "completed_count": 0,
+        "error": error,
+        "owner": PROCESS_ID,
+    })
+
+
+def prepare_batch_job(job: Dict[str, Any]) -> Optional[Tuple[Coroutine, int, int]]:
+    """
+    为领取到的批次创建执行协程，返回协程、作文篇数和本次需要处理的篇数（不含检查点中已完成的作文）。
+
+    批次已结束、上传文件缺失或已被反复领取（执行进程反复崩溃）时返回 None，
+    调用方直接把任务移出队列。
+    """
+    checkpoint = BatchCheckpoint(job["job_id"])
+    manifest = checkpoint.load_manifest()
+    if not manifest or manifest.get("status") != BatchStatus.RUNNING:
+        logger.info(f"批次 {checkpoint.task_id} 已结束或检查点不存在，跳过。")
+        return None
+
+    if job["attempts"] > settings.job_max_attempts:
+        logger.error(f"批次 {checkpoint.task_id} 已被领取 {job['attempts']} 次仍未完成，标记为失败。")
+        _fail_batch(checkpoint, manifest, "批阅进程多次中断，任务已停止，请重新上传")
+        return None
+
+    paths = list(manifest.get("essay_paths", []))
+    if manifest.get("prompt_path"):
+        paths.append(manifest["prompt_path"])
+    missing = [path for path in paths if not os.path.exists(path)]
+    if not manifest.get("essay_paths") or missing:
+        logger.warning(f"批次 {checkpoint.task_id} 的上传文件缺失，无法继续: {missing}")
+        _fail_batch(checkpoint, manifest, "上传的作文文件缺失，无法继续批阅，请重新上传")
+        return None
+
+    total_count = len(manifest["essay_paths"])
+    finished = sum(1 for state in checkpoint.load_essays().values() if EssayJob.is_done(state))
+    admission = fair_scheduler.flow(job["user_key"], job["weight"], job["priority"])
+    return _create_batch_task(checkpoint, admission), total_count, max(total_count - finished, 0)
+
+
+def requeue_orphaned_batches() -> int:
+    """
+    把有检查点、但不在任务队列中的未完成批次重新入队（例如升级前中断的批次）。
+
+    Returns:
+        int: 重新入队的批次数
+    """
+    requeued = 0
+    for checkpoint in list_interrupted_batches():
+        if task_store.has_job(checkpoint.task_id):
+            continue
+        # 刚创建检查点、还没来得及入队的新批次不处理
+        try:
+            age = time.time() - (checkpoint.directory / "batch.json").stat().st_mtime
+        except OSError:
+            continue
+        if age < STALE_DIRECTORY_SECONDS:
+            continue
+        record = task_store.get_task(checkpoint.task_id, include_result=False)
+        if record and record["status"] in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+            continue
+        manifest = checkpoint.load_manifest() or {}
+        _enqueue(
+            checkpoint.task_id,
+            len(manifest.get("essay_paths", [])),
+            manifest.get("user_key", ""),
+            manifest.get("weight", 1.0),
+        )
+        requeued += 1
+        logger.info(f"批次 {checkpoint.task_id} 已重新放入任务队列")
+    return requeued
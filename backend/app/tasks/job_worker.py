@@ -0,0 +1,197 @@
+"""
+批阅任务执行进程
+
+从持久化任务队列领取批次，交给本进程的任务管理器执行，执行期间定期续约。
+可以内嵌在 API 进程中运行（EMBEDDED_WORKER=true），也可以单独运行：
+
+    python -m app.worker
+
+每个执行进程最多同时持有 task_workers 个批次，另外为小批次（单篇重批等）保留一个名额，
+并为还没有批次在执行的老师保留 idle_user_batch_slots 个名额：满载时小批次和新来的老师
+都不必等待别人的整个批次结束，作文级的公平调度器限制同时处理的作文数。
+批阅能力按执行进程数扩展，与 API 进程数无关。
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.services.task_store import task_store
+from app.tasks.grading_batch import JOB_KIND, prepare_batch_job, requeue_orphaned_batches
+from app.tasks.task_manager import TaskAbandoned, task_manager
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorker:
+    """领取任务队列中的批次并在本进程执行。"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # 当前进程持有的任务；开始执行前值为 None
+        self._held: Dict[str, Optional[asyncio.Task]] = {}
+        self._lost: set = set()
+        self.jobs_claimed = 0
+
+    @property
+    def capacity(self) -> int:
+        """本进程最多同时执行的批次数（普通名额、小批次专用名额和空闲老师专用名额）。"""
+        return (
+            max(1, settings.task_workers)
+            + (1 if settings.priority_max_essays > 0 else 0)
+            + max(0, settings.idle_user_batch_slots)
+        )
+
+    def wake(self) -> None:
+        """有新批次入队或有批次执行结束时立即检查队列。"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _execute(self, job_id: str, coro, pending_count: int) -> Any:
+        """
+        执行批次；本进程退出时交还任务，租约被其他进程接管时停止执行。
+
+        pending_count 为本次实际需要处理的篇数，从检查点继续的批次不计入之前已完成的作文，
+        避免拉低每篇作文的平均耗时。
+        """
+        loop = asyncio.get_running_loop()
+        inner = asyncio.ensure_future(coro)
+        self._held[job_id] = inner
+        started = time.monotonic()
+        try:
+            result = await inner
+        except asyncio.CancelledError:
+            if job_id in self._lost:
+                raise TaskAbandoned("租约已过期，批次由其他进程继续执行")
+            await loop.run_in_executor(None, task_store.release_job, job_id)
+            raise
+        except Exception:
+            await loop.run_in_executor(None, task_store.finish_job, job_id)
+            raise
+        finally:
+            self._held.pop(job_id, None)
+            self._lost.discard(job_id)
+            self.wake()
+        elapsed = time.monotonic() - started
+        await loop.run_in_executor(None, task_store.finish_job, job_id)
+        await loop.run_in_executor(None, task_store.record_batch_duration, pending_count, elapsed)
+        return result
+
+    async def _claim(self, priority_only: bool = False, idle_users: bool = False) -> bool:
+        loop = asyncio.get_running_loop()
+        job = await loop.run_in_executor(
+            None, task_store.claim_job, settings.job_lease_seconds, priority_only, idle_users
+        )
+        if job is None:
+            return False
+        self.jobs_claimed += 1
+        if job["kind"] != JOB_KIND:
+            logger.error(f"未知的任务类型 {job['kind']}，任务 {job['job_id']} 已移出队列")
+            await loop.run_in_executor(None, task_store.finish_job, job["job_id"])
+            return True
+
+        logger.info(f"已领取批次 {job['job_id']}（第 {job['attempts']} 次）")
+        prepared = await loop.run_in_executor(None, prepare_batch_job, job)
+        if prepared is None:
+            await loop.run_in_executor(None, task_store.finish_job, job["job_id"])
+            return True
+
+        coro, total_count, pending_count = prepared
+        self._held[job["job_id"]] = None
+        task_manager.submit_task(
+            self._execute(job["job_id"], coro, pending_count),
+            total_count=total_count,
+            task_id=job["job_id"],
+        )
+        return True
+
+    async def _run(self) -> None:
+        logger.info("批阅任务执行器已启动。")
+        loop = asyncio.get_running_loop()
+        requeued = await loop.run_in_executor(None, requeue_orphaned_batches)
+        if requeued:
+            logger.info(f"🔁 已重新入队 {requeued} 个未完成的批阅批次")
+        # 被同一进程唤醒时直接领取；定时检查时先用只读查询确认队列中有任务
+        woken = True
+        while True:
+            self._wakeup.clear()
+            try:
+                if not woken and len(self._held) < self.capacity:
+                    woken = await loop.run_in_executor(None, task_store.has_claimable_job)
+                if woken:
+                    await self._claim_available()
+            except Exception as e:
+                logger.error(f"领取批阅任务失败: {e}", exc_info=True)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.job_poll_seconds)
+                woken = True
+            except asyncio.TimeoutError:
+                woken = False
+
+    async def _claim_available(self) -> None:
+        normal_slots = max(1, settings.task_workers)
+        while len(self._held) < self.capacity:
+            # 普通名额用完后只领取小批次，以及没有批次在执行的老师的批次
+            held = len(self._held)
+            priority_only = held >= normal_slots
+            idle_users = held < normal_slots + max(0, settings.idle_user_batch_slots)
+            if not await self._claim(priority_only, idle_users):
+                break
+
+    async def _heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(settings.job_heartbeat_seconds)
+            if not self._held:
+                continue
+            try:
+                lost = await loop.run_in_executor(
+                    None, task_store.renew_leases, list(self._held), settings.job_lease_seconds
+                )
+            except Exception as e:
+                logger.error(f"批阅任务续约失败: {e}", exc_info=True)
+                continue
+            for job_id in lost:
+                logger.warning(f"批次 {job_id} 的租约已被其他进程接管，停止本进程的执行")
+                self._lost.add(job_id)
+                inner = self._held.get(job_id)
+                if inner is not None:
+                    inner.cancel()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self) -> None:
+        """停止领取新批次。正在执行的批次由 task_manager.stop() 取消并交还队列。"""
+        for task in (self._task, self._heartbeat_task):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(
+            *(task for task in (self._task, self._heartbeat_task) if task is not None),
+            return_exceptions=True,
+        )
+        self._task = None
+        self._heartbeat_task = None
+
+    def release_all(self) -> None:
+        """交还已领取但还没开始执行的批次。"""
+        for job_id in list(self._held):
+            task_store.release_job(job_id)
+            self._held.pop(job_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "held": len(self._held),
+            "jobs_claimed": self.jobs_claimed,
+        }
+
+
+job_worker = JobWorker()
@@ -1,22 +1,33 @@
 import asyncio
 import logging
+import time
 import uuid
-from collections import deque
-from typing import Coroutine, Deque, Dict, Any
+from collections import OrderedDict
+from typing import Any, Coroutine, Dict, List
+
+from app.config import settings
+from app.services.task_store import PROCESS_ID, task_store
 
 # 配置日志
 logging.basicConfig(level="INFO")
 logger = logging.getLogger(__name__)
 
+# 清理过期任务的间隔
+PRUNE_INTERVAL_SECONDS = 600
+
 class TaskStatus:
     PENDING = "pending"
     RUNNING = "running"
     COMPLETED = "completed"
     FAILED = "failed"
 
+class TaskAbandoned(Exception):
+    """任务已交由其他进程执行，本进程不再记录它的状态。"""
+
+
 class Task:
-    def __init__(self, coro: Coroutine):
-        self.task_id: str = str(uuid.uuid4())
+    def __init__(self, coro: Coroutine, task_id: str | None = None):
+        self.task_id: str = task_id or str(uuid.uuid4())
         self.coro: Coroutine = coro
         self.status: str = TaskStatus.PENDING
         self.result: Any = None
@@ -25,30 +36,108 @@ class Task:
         self.current_step: str = ""
         self.total_count: int = 0
         self.completed_count: int = 0
+        # 结果已压缩保存到磁盘，任务存储中不再重复保存
+        self.result_offloaded: bool = False
 
-    def to_dict(self) -> Dict[str, Any]:
-        public_status = "processing" if self.status == TaskStatus.RUNNING else self.status
-        result = self.result if self.status == TaskStatus.COMPLETED else None
+    def to_record(self) -> Dict[str, Any]:
+        """写入任务存储的状态。"""
+        keep_result = self.status == TaskStatus.COMPLETED and not self.result_offloaded
         return {
             "task_id": self.task_id,
-            "status": public_status,
+            "status": self.status,
             "progress": self.progress,
-            "message": self.current_step,
             "current_step": self.current_step,
-            "result": result,
-            "summary": result.get("summary") if isinstance(result, dict) else None,
-            "details": result.get("details") if isinstance(result, dict) else [],
-            "overall_analysis": result.get("overall_analysis") if isinstance(result, dict) else None,
-            "error": str(self.error) if self.error else None,
-            "total": self.total_count,
-            "current": self.completed_count,
             "total_count": self.total_count,
             "completed_count": self.completed_count,
+            "result": self.result if keep_result else None,
+            "error": str(self.error) if self.error else None,
+            "owner": PROCESS_ID,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return task_payload({**self.to_record(), "result": self.result})
+
+
+def task_payload(record: Dict[str, Any]) -> Dict[str, Any]:
+    """把任务状态转换为状态查询接口返回的格式。"""
+    status = record["status"]
+    public_status = "processing" if status == TaskStatus.RUNNING else status
+    result = record.get("result") if status == TaskStatus.COMPLETED else None
+    return {
+        "task_id": record["task_id"],
+        "status": public_status,
+        "progress": record["progress"],
+        "message": record["current_step"],
+        "current_step": record["current_step"],
+        "result": result,
+        "summary": result.get("summary") if isinstance(result, dict) else None,
+        "details": result.get("details") if isinstance(result, dict) else [],
+        "overall_analysis": result.get("overall_analysis") if isinstance(result, dict) else None,
+        "error": record.get("error"),
+        "total": record["total_count"],
+        "current": record["completed_count"],
+        "total_count": record["total_count"],
+        "completed_count": record["completed_count"],
+        # 排队中的任务的排队位置（1 表示下一个执行）和预计开始时间，其他状态为 None
+        "queue_position": None,
+        "estimated_wait_seconds": None,
+        "estimated_start_at": None,
+        "worker_active": None,
+    }
+
+
+def with_queue_position(payload: Dict[str, Any], position: Dict[str, Any] | None) -> Dict[str, Any]:
+    """在排队中任务的状态中加入排队位置和预计开始时间。"""
+    if position is None:
+        return payload
+    seconds = position["estimated_wait_seconds"]
+    if not position["worker_active"] and seconds < 60:
+        # 没有执行进程持有租约，可能只是还没轮询到，也可能没有执行进程在运行
+        wait_text = "等待批阅进程领取"
+    elif seconds < 60:
+        wait_text = "即将开始"
+    else:
+        wait_text = f"预计约 {round(seconds / 60)} 分钟后开始"
+    ahead = position["queue_position"] - 1
+    message = f"排队中，前面还有 {ahead} 个批次，{wait_text}" if ahead else f"排队中，{wait_text}"
+    return {**payload, **position, "message": message}
+
+class WorkerStats:
+    """单个工作协程的运行统计。"""
+
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.started_at = time.monotonic()
+        self.busy_seconds = 0.0
+        self.tasks_completed = 0
+        self.current_task_id: str | None = None
+        self.current_started: float | None = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        busy = self.busy_seconds
+        if self.current_started is not None:
+            busy += now - self.current_started
+        uptime = max(now - self.started_at, 1e-9)
+        return {
+            "worker_id": self.worker_id,
+            "busy": self.current_task_id is not None,
+            "current_task_id": self.current_task_id,
+            "tasks_completed": self.tasks_completed,
+            "busy_seconds": round(busy, 1),
+            "utilization": round(busy / uptime, 3),
         }
 
+
 class TaskManager:
     """
     一个简单的内存任务管理器，用于处理异步后台任务。
+
+    提交的任务进入 asyncio.Queue，由 task_workers 个工作协程并发执行，
+    空闲的工作协程在提交时立即被唤醒。
+
+    任务结束后结果压缩保存到磁盘并移出 active_tasks；最近查询过的已结束任务
+    保留在有上限的 LRU 缓存中，其余查询时再从磁盘读取。
     """
     _instance = None
 
@@ -56,77 +145,229 @@ class TaskManager:
         if cls._instance is None:
             cls._instance = super(TaskManager, cls).__new__(cls)
             cls._instance.active_tasks: Dict[str, Task] = {}
-            cls._instance.task_queue: Deque[Task] = deque()
-            cls._instance.worker_task: asyncio.Task | None = None
+            cls._instance.task_queue: asyncio.Queue | None = None
+            cls._instance.worker_tasks: List[asyncio.Task] = []
+            cls._instance.worker_stats: List[WorkerStats] = []
+            cls._instance.finished_tasks: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+            cls._instance.prune_task: asyncio.Task | None = None
         return cls._instance
 
-    async def _worker(self):
+    def _queue(self) -> asyncio.Queue:
+        if self.task_queue is None:
+            self.task_queue = asyncio.Queue()
+        return self.task_queue
+
+    @staticmethod
+    def _persist(task: Task) -> None:
+        task_store.save_task_later(task.to_record())
+
+    def _remember(self, payload: Dict[str, Any]) -> None:
+        """把已结束任务的状态放入 LRU 缓存，超出上限时淘汰最久未查询的。"""
+        self.finished_tasks[payload["task_id"]] = payload
+        self.finished_tasks.move_to_end(payload["task_id"])
+        while len(self.finished_tasks) > max(0, settings.task_result_cache_size):
+            self.finished_tasks.popitem(last=False)
+
+    def _cached_status(self, task_id: str) -> Dict[str, Any] | None:
+        task = self.active_tasks.get(task_id)
+        if task:
+            return task.to_dict()
+        payload = self.finished_tasks.get(task_id)
+        if payload is not None:
+            self.finished_tasks.move_to_end(task_id)
+        return payload
+
+    def _loaded_status(self, record: Dict[str, Any] | None) -> Dict[str, Any] | None:
+        if record is None:
+            return None
+        payload = task_payload(record)
+        if record["status"] in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+            self._remember(payload)
+        return payload
+
+    async def _offload_result(self, task: Task) -> None:
+        """把结果压缩写入磁盘；写入失败时仍把结果保存在任务存储中。"""
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, task_store.save_result, task.task_id, task.result)
+            task.result_offloaded = True
+        except Exception as e:
+            logger.warning(f"任务 {task.task_id} 的结果写入磁盘失败: {e}")
+
+    def _finish(self, task: Task) -> None:
+        """任务结束：写入任务存储，移出 active_tasks，状态放入 LRU 缓存。"""
+        self._persist(task)
+        self.active_tasks.pop(task.task_id, None)
+        self._remember(task.to_dict())
+
+    async def _run_task(self, task: Task) -> None:
+        task.status = TaskStatus.RUNNING
+        task.current_step = "任务开始执行..."
+        self._persist(task)
+
+        logger.info(f"开始执行任务 {task.task_id}。")
+        try:
+            result = await task.coro
+            task.result = result
+            task.status = TaskStatus.COMPLETED
+            task.progress = 100
+            task.current_step = "任务完成"
+            # 结果文件写好后才写入完成状态，其他进程看到完成时一定能读到结果
+            await self._offload_result(task)
+            logger.info(f"任务 {task.task_id} 执行成功。")
+        except TaskAbandoned as e:
+            self.active_tasks.pop(task.task_id, None)
+            logger.warning(f"任务 {task.task_id} 已停止执行: {e}")
+            return
+        except Exception as e:
+            task.error = e
+            task.status = TaskStatus.FAILED
+            task.current_step = "任务失败"
+            logger.error(f"任务 {task.task_id} 执行失败: {e}", exc_info=True)
+        self._finish(task)
+
+    async def _worker(self, stats: WorkerStats):
+        """
+        后台工作协程，从队列中取出并执行任务，队列为空时等待新任务。
+        """
+        logger.info(f"任务管理器工作协程 {stats.worker_id} 已启动。")
+        queue = self._queue()
+        while True:
+            task = await queue.get()
+            stats.current_task_id = task.task_id
+            stats.current_started = time.monotonic()
+            try:
+                await self._run_task(task)
+            finally:
+                stats.busy_seconds += time.monotonic() - stats.current_started
+                stats.tasks_completed += 1
+                stats.current_task_id = None
+                stats.current_started = None
+                queue.task_done()
+
+    def start(self, workers: int | None = None):
         """
-        后台工作协程，从队列中取出并执行任务。
+        启动任务管理器的后台工作协程。
+
+        Args:
+            workers (int | None): 工作协程数，默认使用 settings.task_workers。
         """
-        logger.info("任务管理器后台工作进程已启动。")
+        if any(not worker.done() for worker in self.worker_tasks):
+            return
+        count = max(1, workers or settings.task_workers)
+        self._queue()
+        self.worker_stats = [WorkerStats(worker_id) for worker_id in range(count)]
+        self.worker_tasks = [asyncio.create_task(self._worker(stats)) for stats in self.worker_stats]
+        self.prune_task = asyncio.create_task(self._prune_periodically())
+
+    async def _prune_periodically(self):
+        """定期删除超过保留时长或数量的已结束任务，以及长时间没有开始批阅的上传会话。"""
+        loop = asyncio.get_running_loop()
         while True:
-            if self.task_queue:
-                task = self.task_queue.popleft()
-                task.status = TaskStatus.RUNNING
-                task.current_step = "任务开始执行..."
-                self.active_tasks[task.task_id] = task
-                
-                logger.info(f"开始执行任务 {task.task_id}。")
-                try:
-                    # 在这里，我们假设coro是一个可以更新进度的函数
-                    # 但为了简化，我们直接await
-                    result = await task.coro
-                    task.result = result
-                    task.status = TaskStatus.COMPLETED
-                    task.progress = 100
-                    task.current_step = "任务完成"
-                    logger.info(f"任务 {task.task_id} 执行成功。")
-                except Exception as e:
-                    task.error = e
-                    task.status = TaskStatus.FAILED
-                    task.current_step = "任务失败"
-                    logger.error(f"任务 {task.task_id} 执行失败: {e}", exc_info=True)
-            else:
-                await asyncio.sleep(1) # 队列为空时，等待1秒
-
-    def start(self):
+            try:
+                removed = await loop.run_in_executor(
+                    None,
+                    task_store.prune_tasks,
+                    settings.task_retention_hours * 3600,
+                    settings.task_retention_max,
+                )
+                for task_id in removed:
+                    self.finished_tasks.pop(task_id, None)
+                if removed:
+                    logger.info(f"已清理 {len(removed)} 个过期任务。")
+                sessions = await loop.run_in_executor(
+                    None, task_store.prune_sessions, settings.upload_session_hours * 3600
+                )
+                if sessions:
+                    logger.info(f"已清理 {sessions} 个过期的上传会话。")
+            except Exception as e:
+                logger.error(f"清理过期任务失败: {e}", exc_info=True)
+            await asyncio.sleep(PRUNE_INTERVAL_SECONDS)
+
+    async def stop(self):
         """
-        启动任务管理器的后台工作进程。
+        停止工作协程。正在执行的任务被取消，批阅任务的检查点保留，重启后继续。
         """
-        if self.worker_task is None or self.worker_task.done():
-            self.worker_task = asyncio.create_task(self._worker())
+        tasks = list(self.worker_tasks)
+        if self.prune_task is not None:
+            tasks.append(self.prune_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.worker_tasks = []
+        self.prune_task = None
 
-    def submit_task(self, coro: Coroutine, total_count: int = 0) -> str:
+    def submit_task(self, coro: Coroutine, total_count: int = 0, task_id: str | None = None) -> str:
         """
         提交一个协程任务到队列。
 
         Args:
             coro (Coroutine): 要执行的协程。
             total_count (int): 任务要处理的总数量。
+            task_id (str | None): 指定任务ID（例如重启后恢复的任务），默认自动生成。
 
         Returns:
             str: 分配给该任务的唯一ID。
         """
-        task = Task(coro)
+        task = Task(coro, task_id)
         task.total_count = total_count
-        self.task_queue.append(task)
+        self._queue().put_nowait(task)
         self.active_tasks[task.task_id] = task # 立即加入active_tasks以便查询
+        self._persist(task)
         logger.info(f"任务 {task.task_id} 已提交到队列，总数: {total_count}。")
         return task.task_id
 
+    def update_progress(self, task_id: str, completed_count: int, current_step: str) -> None:
+        """更新任务进度并写入任务存储，其他进程可以查询到。"""
+        task = self.active_tasks.get(task_id)
+        if task is None:
+            return
+        task.completed_count = completed_count
+        task.current_step = current_step
+        if task.total_count:
+            task.progress = int((completed_count / task.total_count) * 100)
+        self._persist(task)
+
+    def stats(self) -> Dict[str, Any]:
+        """工作协程的利用率和队列长度。"""
+        return {
+            "workers": [stats.to_dict() for stats in self.worker_stats],
+            "queued": self.task_queue.qsize() if self.task_queue is not None else 0,
+            "running": sum(1 for stats in self.worker_stats if stats.current_task_id is not None),
+            "active_tasks": len(self.active_tasks),
+            "cached_results": len(self.finished_tasks),
+        }
+
     def get_task_status(self, task_id: str) -> Dict[str, Any] | None:
         """
         根据任务ID获取任务的状态和结果。
 
+        本进程中正在执行的任务和最近查询过的已结束任务直接读取内存中的状态，
+        其他任务从任务存储读取（已完成任务的结果从磁盘读取）；排队中的任务附带排队位置和预计开始时间。
+
         Args:
             task_id (str): 任务ID。
 
         Returns:
             Dict[str, Any] | None: 任务的状态信息字典，如果任务不存在则返回None。
         """
-        task = self.active_tasks.get(task_id)
-        return task.to_dict() if task else None
+        payload = self._cached_status(task_id)
+        if payload is not None:
+            return payload
+        payload = self._loaded_status(task_store.get_task(task_id))
+        if payload and payload["status"] == TaskStatus.PENDING:
+            payload = with_queue_position(payload, task_store.queue_position(task_id))
+        return payload
+
+    async def get_task_status_async(self, task_id: str) -> Dict[str, Any] | None:
+        """同 get_task_status，读取任务存储和结果文件时不阻塞事件循环。"""
+        payload = self._cached_status(task_id)
+        if payload is not None:
+            return payload
+        payload = self._loaded_status(await task_store.get_task_async(task_id))
+        if payload and payload["status"] == TaskStatus.PENDING:
+            payload = with_queue_position(payload, await task_store.queue_position_async(task_id))
+        return payload
 
 # 创建一个全局的任务管理器实例
 task_manager = TaskManager()
@@ -13,6 +13,8 @@ from app.utils.security import decode_access_token
 
 # HTTP Bearer Token认证方案
 security = HTTPBearer()
+# 未携带 Token 时不报错，用于登录可选的接口
+optional_security = HTTPBearer(auto_error=False)
 
 
 def get_current_user(
@@ -72,6 +74,33 @@ def get_current_user(
     return user
 
 
+def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: Session = Depends(get_db)
+) -> Optional[User]:
+    """
+    获取当前登录用户（可选）
+    未携带Token或Token无效时返回None，不拒绝请求
+    
+    Args:
+        credentials: HTTP Authorization Bearer Token
+        db: 数据库会话
+        
+    Returns:
+        Optional[User]: 当前登录的用户对象
+    """
+    if credentials is None:
+        return None
+    payload = decode_access_token(credentials.credentials)
+    user_id = payload.get("user_id") if payload else None
+    if user_id is None:
+        return None
+    user = db.query(User).filter(User.id == user_id).first()
+    if user is None or not user.is_active:
+        return None
+    return user
+
+
 def get_current_active_user(
     current_user: User = Depends(get_current_user)
 ) -> User:
@@ -0,0 +1,72 @@
+"""
+事件循环阻塞监控
+
+定期让出事件循环并测量实际唤醒延迟，用于发现阻塞事件循环的同步调用
+（例如同步 SMTP 发送、同步数据库提交）。
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoopMonitor:
+    """测量事件循环的调度延迟（stall）。"""
+
+    def __init__(self, interval: float = 0.1, stall_threshold: float = 0.1, window: int = 600):
+        """
+        Args:
+            interval: 采样间隔（秒）
+            stall_threshold: 超过该延迟（秒）记为一次阻塞
+            window: 保留的最近采样数
+        """
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.stall_threshold:
+                self.stalls += 1
+                logger.warning("事件循环阻塞 %.0f ms", lag * 1000)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0, "stalls": self.stalls, "max_lag_ms": 0, "avg_lag_ms": 0, "p95_lag_ms": 0}
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return {
+            "samples": len(samples),
+            "stalls": self.stalls,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "avg_lag_ms": round(sum(samples) / len(samples) * 1000, 1),
+            "p95_lag_ms": round(p95 * 1000, 1),
+        }
+
+
+# 全局监控实例
+loop_monitor = EventLoopMonitor()
@@ -0,0 +1,93 @@
+"""
+独立的批阅任务执行进程
+
+    cd backend && python -m app.worker
+
+从任务队列领取批次并执行，同时负责投递发件箱中的邮件。API 进程设置
+EMBEDDED_WORKER=false 后只负责接收上传、入队和查询进度，批阅能力通过增加本进程的数量扩展。
+执行进程和 API 进程需要共享同一个 data 目录和上传目录。
+"""
+import asyncio
+import logging
+import signal
+
+from app.config import settings
+from app.database import init_db
+from app.paths import WORKER_LOG, ensure_directories
+from app.services.email_outbox import email_dispatcher
+from app.services.grading_db import grading_result_writer
+from app.services.http_client import llm_http_client
+from app.services.image_preprocess import image_preprocessor
+from app.tasks.job_worker import job_worker
+from app.tasks.task_manager import task_manager
+from app.utils.loop_monitor import loop_monitor
+
+logger = logging.getLogger(__name__)
+
+
+async def start_worker_services() -> None:
+    """启动执行批阅任务所需的服务：LLM 连接池、任务管理器、任务领取和邮件投递。"""
+    await llm_http_client.open()
+    logger.info("🔗 LLM HTTP 连接池已就绪")
+
+    task_manager.start(workers=job_worker.capacity)
+    job_worker.start()
+    logger.info("⚙️  批阅任务执行器已启动")
+
+    # 邮件只由执行进程投递，多个 API 进程不会重复领取同一封邮件
+    email_dispatcher.start()
+    logger.info("📧 邮件投递器已启动")
+
+
+async def stop_worker_services() -> None:
+    """停止领取新批次，正在执行的批次交还任务队列，由下次启动的执行进程继续。"""
+    await job_worker.stop()
+    await task_manager.stop()
+    job_worker.release_all()
+    await grading_result_writer.flush()
+    await email_dispatcher.stop()
+    await llm_http_client.close()
+    image_preprocessor.shutdown()
+
+
+async def run_worker() -> None:
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows 不支持，Ctrl+C 时由 asyncio.run 取消
+            pass
+
+    init_db()
+    loop_monitor.start()
+    await start_worker_services()
+    logger.info("✅ 批阅任务执行进程已启动")
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("👋 批阅任务执行进程正在关闭...")
+        await stop_worker_services()
+        await loop_monitor.stop()
+
+
+def main() -> None:
+    ensure_directories()
+    logging.basicConfig(
+        level=settings.log_level,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(WORKER_LOG, encoding='utf-8'),
+            logging.StreamHandler()
+        ],
+        force=True,
+    )
+    try:
+        asyncio.run(run_worker())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
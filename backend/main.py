@@ -20,9 +20,10 @@ from app.routes.auth import router as auth_router
 from app.routes.users import router as users_router
 from app.routes.records import router as records_router
 from app.routes.settings import router as settings_router
-from app.tasks.task_manager import task_manager
+from app.worker import start_worker_services, stop_worker_services
 from app.paths import ensure_directories, APP_LOG, STATIC_DIR, TEMPLATES_DIR, FRONTEND_DIST_DIR
 from app.database import init_db
+from app.utils.loop_monitor import loop_monitor
 
 # 确保目录存在
 ensure_directories()
@@ -56,15 +57,23 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning(f"数据库初始化警告: {e}")
     
-    # 启动任务管理器
-    task_manager.start()
-    logger.info("⚙️  后台任务管理器已启动")
+    # 启动事件循环阻塞监控
+    loop_monitor.start()
+    
+    # 在本进程中执行批阅任务；否则由独立的 python -m app.worker 进程执行
+    if settings.embedded_worker:
+        await start_worker_services()
+    else:
+        logger.info("⚙️  批阅任务由独立的执行进程处理（python -m app.worker）")
     
     logger.info("✅ 系统初始化完成")
     yield
     
     # 关闭时执行
     logger.info("👋 系统正在关闭...")
+    if settings.embedded_worker:
+        await stop_worker_services()
+    await loop_monitor.stop()
 
 
 # 创建FastAPI应用
@@ -3,6 +3,7 @@ Windows packaged launcher.
 
 Double-clicking the packaged exe starts the FastAPI server and opens the browser.
 """
+import multiprocessing
 import threading
 import time
 import webbrowser
@@ -19,6 +20,8 @@ def open_browser_later() -> None:
 
 
 if __name__ == "__main__":
+    # 图片预处理使用进程池，打包后的 exe 需要 freeze_support
+    multiprocessing.freeze_support()
     threading.Thread(target=open_browser_later, daemon=True).start()
     uvicorn.run(
         app,
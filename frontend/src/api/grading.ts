@@ -4,7 +4,7 @@ export interface UploadPromptResponse {
   success: boolean
   message: string
   session_id: string
-  file_id: string
+  file_id?: string
 }
 
 export interface UploadEssaysResponse {
@@ -20,6 +20,14 @@ export interface ProcessBatchResponse {
   task_id: string
 }
 
+export interface MatchCandidate {
+  student_id: number
+  username: string
+  class_name?: string | null
+  confidence: number
+  method: 'exact' | 'pinyin' | 'fuzzy'
+}
+
 export interface TaskStatus {
   task_id: string
   status: 'pending' | 'processing' | 'completed' | 'failed'
@@ -28,12 +36,18 @@ export interface TaskStatus {
   current: number
   message: string
   current_step?: string
+  queue_position?: number | null
+  estimated_wait_seconds?: number | null
+  estimated_start_at?: number | null
+  worker_active?: boolean | null
   summary?: {
     total_essays: number
     successful_grades: number
     failed_grades: number
     saved_to_db: number
     email_sent?: number
+    email_queued?: number
+    needs_confirmation?: number
     average_score: number
   }
   details?: Array<{
@@ -43,7 +57,13 @@ export interface TaskStatus {
     grading_record_id?: number
     saved_to_db: boolean
     email_sent?: boolean
+    email_queued?: boolean
     email_error?: string | null
+    recognized_name?: string | null
+    match_confidence?: number
+    needs_confirmation?: boolean
+    pending_match_id?: number
+    candidates?: MatchCandidate[]
     grading_result?: {
       score: number
       advantages: any
@@ -65,6 +85,7 @@ export interface TaskStatus {
       students: string[]
       reason: string
     }>
+    missing_students?: string[]
   } | null
 }
 
@@ -87,6 +108,13 @@ export function uploadPrompt(file: File) {
   })
 }
 
+/**
+ * 提交文字版作文要求（跳过作文要求图片识别）
+ */
+export function uploadPromptText(requirements: string) {
+  return request.post<UploadPromptResponse>('/grading/upload-prompt-text', { requirements })
+}
+
 /**
  * 批量上传学生作文图片
  */
@@ -105,8 +133,10 @@ export function uploadEssays(sessionId: string, files: File[]) {
 /**
  * 开始批量处理任务
  */
-export function processBatch(sessionId: string) {
-  return request.post<ProcessBatchResponse>(`/grading/process-batch/${sessionId}`)
+export function processBatch(sessionId: string, forceRegrade = false) {
+  return request.post<ProcessBatchResponse>(`/grading/process-batch/${sessionId}`, null, {
+    params: forceRegrade ? { force_regrade: true } : undefined
+  })
 }
 
 /**
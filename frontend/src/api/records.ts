@@ -1,5 +1,6 @@
 import request from '@/utils/request'
 import type { GradingRecord, RecordDetail } from '@/types'
+import type { MatchCandidate } from '@/api/grading'
 
 export interface RecordListResponse {
   total: number
@@ -38,3 +39,41 @@ export function getRecordDetail(recordId: number) {
   return request.get<RecordDetail>(`/records/${recordId}`)
 }
 
+
+export interface PendingMatch {
+  id: number
+  recognized_name: string | null
+  class_name: string | null
+  candidates: MatchCandidate[]
+  essay_text: string | null
+  grading_result: Record<string, any> | null
+  status: 'pending' | 'confirmed' | 'dismissed'
+  grading_record_id: number | null
+  created_at: string | null
+}
+
+/**
+ * 管理员查看待确认的学生匹配
+ */
+export function getPendingMatches(statusFilter: string = 'pending') {
+  return request.get<{ total: number; entries: PendingMatch[] }>('/records/pending-matches', {
+    params: { status_filter: statusFilter }
+  })
+}
+
+/**
+ * 把待确认的批阅结果保存到指定学生名下
+ */
+export function confirmPendingMatch(pendingId: number, studentId: number) {
+  return request.post<{ success: boolean; grading_record_id: number; email_queued: boolean }>(
+    `/records/pending-matches/${pendingId}/confirm`,
+    { student_id: studentId }
+  )
+}
+
+/**
+ * 忽略待确认的批阅结果
+ */
+export function dismissPendingMatch(pendingId: number) {
+  return request.post(`/records/pending-matches/${pendingId}/dismiss`)
+}